@@ -1,73 +1,80 @@
 # app.py
 import os
-from flask import Flask, request, jsonify, render_template, send_from_directory, session, redirect, url_for
-from werkzeug.utils import secure_filename
-from firebase_admin import credentials, initialize_app, auth, firestore, storage
-import firebase_admin
-import pandas as pd
-from auth_utils import admin_required, login_required, web_login_required
-from flask_cors import CORS
-from processing.file_processors import process_uploaded_file  # placeholder
-from firebase_config import db, bucket
-import openpyxl
-from openpyxl.drawing.image import Image
-from PIL import Image as PILImage
-import io
 import base64
-from datetime import datetime
+import binascii
+import hmac
+import ipaddress
+import itertools
 import time
-import gspread
-from google.oauth2.service_account import Credentials
+import uuid
 from datetime import datetime
-import json
-import os
-
-# Add these configurations after your existing config
-GOOGLE_SHEETS_SCOPES = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive'
-]
-
-# Initialize Google Sheets client
+from flask import (Flask, Blueprint, current_app, request, jsonify, render_template, send_from_directory,
+                   redirect, url_for, g, Response, send_file)
+from werkzeug.utils import secure_filename
+from firebase_admin import firestore
+from auth_utils import admin_required, login_required, web_login_required, invalidate_admin_role, set_admin_claim
+from flask_cors import CORS
+from processing.file_processors import process_uploaded_file
+from staff_query import parse_staff_query, StaffQueryError
+from staff_cache import staff_cache
+from serial_numbers import sl_allocator
+from staff_stats import get_staff_stats, STATS_CACHE_CONTROL
+from http_caching import (conditional_staff_response, compress_response, static_url, resolve_static,
+                          STAFF_DATA_CACHE_CONTROL, SEARCH_CACHE_CONTROL)
+from staff_sync import staff_changes, add_tombstone, SyncTokenError
+from staff_search import search_staff, parse_search_args, SearchQueryError, staff_search_index
+from processing.staff_import import import_staff_file, preview_digest, IMPORT_EXTENSIONS, IMPORT_MODES
+from processing.staff_export import parse_export_args, csv_chunks, export_xlsx, ExportError, CONTENT_TYPES as EXPORT_CONTENT_TYPES
+from processing.photo_uploads import PhotoUploader
+from processing.photo_pipeline import PHOTO_MAX_BYTES
+from processing.upload_stream import open_file_part, store_upload, find_upload, UploadError, UploadStorageError
+from jobs import job_handler, enqueue, get_job, cancel_job, load_job_data
+from registrations import create_registration_repository, PENDING
+from firebase_config import db, auth
+from sheets_gateway import sheets_gateway, SheetsUnavailableError
+import metrics
+import fanout
+from fanout import gather
+from metrics import render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 
 UPLOAD_FOLDER = 'uploads'
+# Dry-run import files wait in UPLOAD_FOLDER for their commit at most this long
+IMPORT_PREVIEW_TTL = int(os.environ.get('IMPORT_PREVIEW_TTL', str(24 * 3600)))
+DRY_RUN_PREFIX = 'dryrun_'
 ALLOWED_EXTENSIONS = set(['xlsx','xls','csv','png','jpg','jpeg','pdf','txt','mp4','mp3'])
 
-app = Flask(__name__, static_folder='static', template_folder='templates')
-CORS(app)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')  # Add this for sessions
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Per-call limits of the Firebase Admin batch APIs
+GET_ALL_CHUNK = 300
+FIRESTORE_BATCH_LIMIT = 500
+AUTH_GET_USERS_LIMIT = 100
+AUTH_DELETE_USERS_LIMIT = 1000
 
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Addresses/networks that may scrape /metrics without the token, e.g. '10.0.0.0/8,127.0.0.1'
+METRICS_ALLOW = [ipaddress.ip_network(n.strip(), strict=False)
+                 for n in os.environ.get('METRICS_ALLOW', '').split(',') if n.strip()]
 
-def init_google_sheets():
-    try:
-        # For Render deployment, use environment variable
-        creds_json = os.environ.get('GOOGLE_SHEETS_CREDENTIALS')
-        if creds_json:
-            creds_info = json.loads(creds_json)
-            creds = Credentials.from_service_account_info(creds_info, scopes=GOOGLE_SHEETS_SCOPES)
-        else:
-            # For local development, use file
-            creds = Credentials.from_service_account_file('test123456.json', scopes=GOOGLE_SHEETS_SCOPES)
 
-        
-        client = gspread.authorize(creds)
-        return client
-    except Exception as e:
-        print(f"Error initializing Google Sheets: {e}")
-        return None
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# All routes live on this blueprint; create_app() builds the Flask app around it
+main = Blueprint('main', __name__)
 
-# Global sheets client
-sheets_client = init_google_sheets()
-PENDING_SHEET_ID = os.environ.get("PENDING_SHEET_ID")  # Replace with your actual sheet ID
+
+# Pending registrations store (Google Sheet unless REGISTRATION_BACKEND says otherwise).
+# The worksheet handle is opened once per worker by the gateway.
+pending_registrations = create_registration_repository(
+    sheets_gateway.worksheet if sheets_gateway.is_configured() else None
+)
 
 # Add these new routes to your app.py
 
-@app.route('/download/apk')
+@main.route('/download/apk')
 def download_apk():
-    apk_directory = os.path.join(app.root_path, 'static', 'downloads')
+    apk_directory = os.path.join(current_app.root_path, 'static', 'downloads')
     apk_filename = 'MACE-Connect.apk'
     file_path = os.path.join(apk_directory, apk_filename)
     if not os.path.exists(file_path):
@@ -79,19 +86,19 @@ def download_apk():
         mimetype='application/vnd.android.package-archive'
     )
 
-@app.route('/app-manual')
-@app.route('/manual')
+@main.route('/app-manual')
+@main.route('/manual')
 def app_manual():
     return render_template('app_manual.html')
 
-@app.route('/staff-registration')
+@main.route('/staff-registration')
 def staff_registration():
     return render_template('staff_registration.html')
 
-@app.route('/api/submit_registration', methods=['POST'])
+@main.route('/api/submit_registration', methods=['POST'])
 def submit_registration():
     try:
-        if not sheets_client:
+        if pending_registrations is None:
             return jsonify({'success': False, 'error': 'Google Sheets not configured'})
         
         data = request.get_json()
@@ -102,63 +109,53 @@ def submit_registration():
             if not data.get(field):
                 return jsonify({'success': False, 'error': f'Missing required field gjhgjhg: {field}'})
         
-        # Open the pending registrations sheet
-        sheet = sheets_client.open_by_key(PENDING_SHEET_ID).sheet1
-        
         # Check if email already exists in pending (use email as unique identifier)
-        existing_records = sheet.get_all_records()
-        for record in existing_records:
-            if record.get('Email') == data.get('email'):
-                return jsonify({'success': False, 'error': 'Registration already exists for this email address'})
+        if pending_registrations.find_by_email(data.get('email')):
+            return jsonify({'success': False, 'error': 'Registration already exists for this email address'})
         
         # Also check if employee number exists if provided
-        if data.get('emp_no'):
-            for record in existing_records:
-                if record.get('Employee ID') == data.get('emp_no'):
-                    return jsonify({'success': False, 'error': 'Registration already exists for this Employee ID'})
+        if data.get('emp_no') and pending_registrations.find_by_emp_no(data.get('emp_no')):
+            return jsonify({'success': False, 'error': 'Registration already exists for this Employee ID'})
         
         # Prepare row data (match your sheet columns)
-        row_data = [
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),  # Timestamp
-            data.get('name', ''),
-            data.get('emp_no', ''),  # Can be empty now
-            data.get('email', ''),
-            data.get('department', ''),
-            data.get('designation', ''),
-            data.get('mobile_no', ''),
-            data.get('type', ''),
-            data.get('contract_type', ''),
-            data.get('category', ''),
-            data.get('gender', ''),
-            data.get('blood_group', ''),
-            data.get('permanent_address', ''),
-            'PENDING'  # Status column
-        ]
-        
-        # Add row to sheet
-        sheet.append_row(row_data)
+        record = {
+            'Timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'Name': data.get('name', ''),
+            'Employee ID': data.get('emp_no', ''),  # Can be empty now
+            'Email': data.get('email', ''),
+            'Department': data.get('department', ''),
+            'Designation': data.get('designation', ''),
+            'Mobile No': data.get('mobile_no', ''),
+            'Type': data.get('type', ''),
+            'Contract Type': data.get('contract_type', ''),
+            'Category': data.get('category', ''),
+            'Gender': data.get('gender', ''),
+            'Blood Group': data.get('blood_group', ''),
+            'Permanent Address': data.get('permanent_address', ''),
+            'Status': PENDING
+        }
+        
+        pending_registrations.add(record)
         
         return jsonify({'success': True, 'message': 'Registration submitted successfully! Please wait for admin approval.'})
         
+    except SheetsUnavailableError as e:
+        print(f"Registration submission throttled: {e}")
+        response = jsonify({'success': False, 'error': 'Too many registrations right now, please try again in a minute'})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
     except Exception as e:
         print(f"Registration submission error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/pending_registrations', methods=['GET'])
+@main.route('/api/pending_registrations', methods=['GET'])
 @admin_required
 def get_pending_registrations():
     try:
-        if not sheets_client:
+        if pending_registrations is None:
             return jsonify({'success': False, 'error': 'Google Sheets not configured'})
         
-        # Open the pending registrations sheet
-        sheet = sheets_client.open_by_key(PENDING_SHEET_ID).sheet1
-        
-        # Get all records
-        records = sheet.get_all_records()
-        
-        # Filter only pending records
-        pending_records = [record for record in records if record.get('Status') == 'PENDING']
+        pending_records = pending_registrations.list_pending()
         
         return jsonify({'success': True, 'registrations': pending_records})
         
@@ -167,11 +164,15 @@ def get_pending_registrations():
         return jsonify({'success': False, 'error': str(e)})
 
         
-@app.route('/api/approve_registration', methods=['POST'])
+@main.route('/api/approve_registration', methods=['POST'])
 @admin_required
 def approve_registration():
+    """
+    Queue approval of a pending registration.
+    Returns a task_id; poll /api/upload_progress/<task_id> for the outcome.
+    """
     try:
-        if not sheets_client:
+        if pending_registrations is None:
             return jsonify({'success': False, 'error': 'Google Sheets not configured'})
         
         data = request.get_json()
@@ -181,71 +182,72 @@ def approve_registration():
         if not email:
             return jsonify({'success': False, 'error': 'Email address required'})
         
-        # Open the pending registrations sheet
-        sheet = sheets_client.open_by_key(PENDING_SHEET_ID).sheet1
-        records = sheet.get_all_records()
-        
-        # Find the record to approve using email
-        record_to_approve = None
-        row_index = None
-        
-        for idx, record in enumerate(records, start=2):  # Start from 2 because row 1 is header
-            if record.get('Email') == email and record.get('Status') == 'PENDING':
-                record_to_approve = record
-                row_index = idx
-                break
-        
-        if not record_to_approve:
-            return jsonify({'success': False, 'error': 'Registration not found'})
-        
-        # Add to main database
-        staff_data = {
-            'slNo': get_next_sl_no(),
-            'empNo': record_to_approve.get('Employee ID', ''),  # Can be empty
-            'name': record_to_approve.get('Name', ''),
-            'type': record_to_approve.get('Type', ''),
-            'contractType': record_to_approve.get('Contract Type', ''),
-            'department': record_to_approve.get('Department', ''),
-            'category': record_to_approve.get('Category', ''),
-            'gender': record_to_approve.get('Gender', ''),
-            'designation': record_to_approve.get('Designation', ''),
-            'mobileNo': record_to_approve.get('Mobile No', ''),
-            'bloodGroup': record_to_approve.get('Blood Group', ''),
-            'permanentAddress': record_to_approve.get('Permanent Address', ''),
-            'email': record_to_approve.get('Email', ''),
-            'photo': ''  # Empty for now
-        }
-        
-        # Use email as doc ID since emp_no might be empty
-        doc_id = staff_data['email'].replace('@', '_at_').replace('.', '_dot_')  # Make email Firebase-safe
-        doc_ref = db.collection('staff').document(doc_id)
-        
-        # Check if staff already exists in database
-        if doc_ref.get().exists:
-            return jsonify({'success': False, 'error': 'Staff member already exists in database'})
-        
-        # Set the document
-        doc_ref.set(staff_data)
-        
-        # Verify the write succeeded
-        if not doc_ref.get().exists:
-            raise Exception('Failed to verify staff addition in Firestore')
-        
-        # Delete the row from Google Sheets
-        sheet.delete_rows(row_index)
-        
-        return jsonify({'success': True, 'message': 'Registration approved and added to database'})
+        task_id = enqueue('approve_registration', {'email': email}, created_by=g.firebase_uid)
+        return jsonify({'success': True, 'task_id': task_id, 'message': 'Approval queued'}), 202
         
     except Exception as e:
         print(f"Error approving registration: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
 
-@app.route('/api/reject_registration', methods=['POST'])
+def registration_doc_id(record):
+    # Make email Firebase-safe
+    return str(record.get('Email', '')).replace('@', '_at_').replace('.', '_dot_')
+
+
+def staff_from_registration(record, sl_no):
+    return {
+        'slNo': sl_no,
+        'empNo': record.get('Employee ID', ''),  # Can be empty
+        'name': record.get('Name', ''),
+        'type': record.get('Type', ''),
+        'contractType': record.get('Contract Type', ''),
+        'department': record.get('Department', ''),
+        'category': record.get('Category', ''),
+        'gender': record.get('Gender', ''),
+        'designation': record.get('Designation', ''),
+        'mobileNo': record.get('Mobile No', ''),
+        'bloodGroup': record.get('Blood Group', ''),
+        'permanentAddress': record.get('Permanent Address', ''),
+        'email': record.get('Email', ''),
+        'photo': '',  # Empty for now
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }
+
+
+@job_handler('approve_registration')
+def approve_registration_job(ctx, email):
+    # Use email as doc ID since emp_no might be empty. The pending row is
+    # matched on the stripped email, so the ID is known before it is read
+    doc_ref = db.collection('staff').document(registration_doc_id({'Email': str(email).strip()}))
+    
+    # Look up the registration and check the staff doc at the same time
+    record_to_approve, existing_doc = gather(lambda: pending_registrations.find_pending(email), doc_ref.get)
+    if not record_to_approve:
+        return {'success': False, 'error': 'Registration not found'}
+    
+    # Check if staff already exists in database
+    if existing_doc.exists:
+        return {'success': False, 'error': 'Staff member already exists in database'}
+    
+    ctx.check_cancelled()
+    
+    # Add to main database; set() raises if the write didn't happen
+    staff_data = staff_from_registration(record_to_approve, sl_allocator.allocate())
+    doc_ref.set(staff_data)
+    staff_cache.put(doc_ref.id, staff_data)
+    
+    # Delete the pending registration
+    pending_registrations.remove(email)
+    
+    return {'success': True, 'message': 'Registration approved and added to database'}
+
+
+@main.route('/api/reject_registration', methods=['POST'])
 @admin_required
 def reject_registration():
     try:
-        if not sheets_client:
+        if pending_registrations is None:
             return jsonify({'success': False, 'error': 'Google Sheets not configured'})
         
         data = request.get_json()
@@ -255,15 +257,8 @@ def reject_registration():
         if not email:
             return jsonify({'success': False, 'error': 'Email address required'})
         
-        # Open the pending registrations sheet
-        sheet = sheets_client.open_by_key(PENDING_SHEET_ID).sheet1
-        records = sheet.get_all_records()
-        
-        # Find and delete the record using email
-        for idx, record in enumerate(records, start=2):  # Start from 2 because row 1 is header
-            if record.get('Email') == email and record.get('Status') == 'PENDING':
-                sheet.delete_rows(idx)
-                return jsonify({'success': True, 'message': 'Registration rejected and removed'})
+        if pending_registrations.remove(email):
+            return jsonify({'success': True, 'message': 'Registration rejected and removed'})
         
         return jsonify({'success': False, 'error': 'Registration not found'})
         
@@ -271,40 +266,110 @@ def reject_registration():
         print(f"Error rejecting registration: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
-# Helper function to get next serial number
-def get_next_sl_no():
+@main.route('/api/registrations/batch', methods=['POST'])
+@admin_required
+def batch_registrations():
+    """
+    Approve or reject several pending registrations at once.
+    Expects JSON: {"emails": [...], "action": "approve" | "reject"}
+    Runs as a background job; returns a task_id for /api/upload_progress.
+    """
     try:
-        staffs = db.collection('staff').get()
-        if not staffs:
-            return 1
+        if pending_registrations is None:
+            return jsonify({'success': False, 'error': 'Google Sheets not configured'})
+        
+        data = request.get_json() or {}
+        emails = data.get('emails', [])
+        action = data.get('action')
+        
+        if not emails or not isinstance(emails, list):
+            return jsonify({'success': False, 'error': 'emails array required'}), 400
+        if action not in ('approve', 'reject'):
+            return jsonify({'success': False, 'error': 'action must be approve or reject'}), 400
         
-        max_sl = 0
-        for staff in staffs:
-            staff_data = staff.to_dict()
-            sl_no = staff_data.get('slNo', 0)
-            if isinstance(sl_no, (int, str)) and str(sl_no).isdigit():
-                max_sl = max(max_sl, int(sl_no))
+        task_id = enqueue('registrations_batch', {'emails': emails, 'action': action}, created_by=g.firebase_uid)
+        return jsonify({'success': True, 'task_id': task_id, 'message': f'Batch {action} started'}), 202
         
-        return max_sl + 1
-    except:
-        return 1
+    except Exception as e:
+        print(f"Error starting batch registration update: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@job_handler('registrations_batch')
+def registrations_batch_job(ctx, emails, action):
+    """
+    One sheet read for the records, one block of serial numbers, batched
+    Firestore writes and one batch_update that deletes every handled row.
+    """
+    emails = list(dict.fromkeys(emails))
+    errors = []
+    
+    records = pending_registrations.find_pending_many(emails)
+    errors.extend({'email': email, 'error': 'Registration not found'} for email in emails if email not in records)
+    
+    if action == 'reject':
+        ctx.check_cancelled()
+        removed = pending_registrations.remove_many(list(records))
+        errors.extend({'email': email, 'error': 'Registration row not found'} for email in records if email not in removed)
+        return {'success': True, 'rejected': len(removed), 'errors': errors}
+    
+    # Skip registrations that are already staff members
+    candidates = {}
+    for chunk in _chunks(list(records), GET_ALL_CHUNK):
+        refs = [db.collection('staff').document(registration_doc_id(records[email])) for email in chunk]
+        existing = {snap.id for snap in db.get_all(refs) if snap.exists}
+        for email in chunk:
+            if registration_doc_id(records[email]) in existing:
+                errors.append({'email': email, 'error': 'Staff member already exists in database'})
+            else:
+                candidates[email] = records[email]
+    
+    ctx.check_cancelled()
+    sl_numbers = sl_allocator.reserve(len(candidates))
+    
+    approved = []
+    pending = list(candidates)
+    for chunk_start in range(0, len(pending), FIRESTORE_BATCH_LIMIT):
+        ctx.progress(len(approved), len(pending), f'Approved {len(approved)} of {len(pending)}')
+        chunk = pending[chunk_start:chunk_start + FIRESTORE_BATCH_LIMIT]
+        batch = db.batch()
+        written = []
+        for offset, email in enumerate(chunk):
+            doc_id = registration_doc_id(candidates[email])
+            staff_data = staff_from_registration(candidates[email], sl_numbers[chunk_start + offset])
+            batch.set(db.collection('staff').document(doc_id), staff_data)
+            written.append((doc_id, staff_data))
+        try:
+            batch.commit()
+        except Exception as e:
+            errors.extend({'email': email, 'error': str(e)} for email in chunk)
+            continue
+        for doc_id, staff_data in written:
+            staff_cache.put(doc_id, staff_data)
+        approved.extend(chunk)
+    
+    # Only rows whose staff doc was written leave the sheet
+    removed = pending_registrations.remove_many(approved)
+    errors.extend({'email': email, 'error': 'Approved, but the pending row could not be removed'}
+                  for email in approved if email not in removed)
+    return {'success': True, 'approved': len(approved), 'errors': errors}
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
+@main.route('/')
 def index():
-    return redirect(url_for('login_page'))
+    return redirect(url_for('.login_page'))
 
 
-@app.route('/login')
+@main.route('/login')
 def login_page():
     return render_template('login.html')
 
 
 # Manual staff entry endpoint
-@app.route('/api/add_staff_manual', methods=['POST'])
+@main.route('/api/add_staff_manual', methods=['POST'])
 @admin_required
 def add_staff_manual():
     """
@@ -330,10 +395,24 @@ def add_staff_manual():
                 'error': f'Missing required fields: {", ".join(missing_fields)}'
             }), 400
         
-        # Check if email already exists
         email = data.get('email').strip()
         doc_id = email.replace('@', '_at_').replace('.', '_dot_')
         
+        # Decode the photo here; resizing, thumbnails and the upload run as a job
+        image_bytes = None
+        if data.get('photo'):
+            # Extract base64 data
+            photo_data = data.get('photo')
+            if ',' in photo_data:
+                photo_data = photo_data.split(',')[1]
+            try:
+                image_bytes = base64.b64decode(photo_data, validate=True)
+            except (binascii.Error, ValueError):
+                return jsonify({'success': False, 'error': 'Photo is not valid base64 data'}), 400
+            if len(image_bytes) > PHOTO_MAX_BYTES:
+                return jsonify({'success': False, 'error': 'Photo is too large'}), 400
+        
+        # Check if email already exists
         existing_doc = db.collection('staff').document(doc_id).get()
         if existing_doc.exists:
             return jsonify({
@@ -341,34 +420,8 @@ def add_staff_manual():
                 'error': 'A staff member with this email already exists'
             }), 400
         
-        # Generate next serial number
-        sl_no = get_next_sl_no()
-        
-        # Handle photo upload if provided
-        photo_url = ''
-        if data.get('photo'):
-            try:
-                # Extract base64 data
-                photo_data = data.get('photo')
-                if ',' in photo_data:
-                    photo_data = photo_data.split(',')[1]
-                
-                # Decode base64
-                image_bytes = base64.b64decode(photo_data)
-                
-                # Create filename
-                safe_identifier = email.replace('@', '_at_').replace('.', '_dot_')
-                filename = f'staff_photos/{safe_identifier}_photo.jpg'
-                
-                # Upload to Firebase Storage
-                blob = bucket.blob(filename)
-                blob.upload_from_string(image_bytes, content_type='image/jpeg')
-                blob.make_public()
-                photo_url = blob.public_url
-                
-            except Exception as photo_error:
-                print(f'Error uploading photo: {photo_error}')
-                # Continue without photo rather than failing
+        # Reserved only now, so a rejected duplicate doesn't use up a number
+        sl_no = sl_allocator.allocate()
         
         # Prepare staff data
         designation = data.get('designation').strip()
@@ -386,22 +439,31 @@ def add_staff_manual():
             'bloodGroup': data.get('bloodGroup').strip(),
             'permanentAddress': data.get('permanentAddress').strip(),
             'email': email,
-            'photoUrl': photo_url,
+            'photoUrl': '',
+            'photoThumb64Url': '',
+            'photoThumb256Url': '',
             'timestamp': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP,
         }
         
-        # Save to Firestore
+        # Save to Firestore; set() raises if the write didn't happen
         db.collection('staff').document(doc_id).set(staff_data)
+        staff_cache.put(doc_id, staff_data)
         
-        # Verify the write succeeded
-        if not db.collection('staff').document(doc_id).get().exists:
-            raise Exception('Failed to verify staff addition in Firestore')
+        photo_task_id = None
+        if image_bytes:
+            photo_task_id = enqueue('staff_photo', {
+                'doc_id': doc_id,
+                'identifier': email,
+                'photo': base64.b64encode(image_bytes).decode('ascii'),
+            }, created_by=g.firebase_uid)
         
         return jsonify({
             'success': True,
             'message': f'Staff member {data.get("name")} added successfully!',
             'staff_id': doc_id,
-            'sl_no': sl_no
+            'sl_no': sl_no,
+            'photo_task_id': photo_task_id
         })
         
     except Exception as e:
@@ -412,10 +474,35 @@ def add_staff_manual():
         }), 500
 
 
+@job_handler('staff_photo')
+def staff_photo_job(ctx, doc_id, identifier, photo):
+    """Normalise a staff photo, upload it with its thumbnails and link them on the staff doc"""
+    uploader = PhotoUploader(max_workers=1)
+    try:
+        urls = uploader.process(identifier, base64.b64decode(photo))
+    finally:
+        uploader.close()
+    if not urls:
+        raise Exception('Photo could not be processed')
+    db.collection('staff').document(doc_id).update(dict(urls, updatedAt=firestore.SERVER_TIMESTAMP))
+    staff_cache.merge(doc_id, dict(urls, updatedAt=firestore.SERVER_TIMESTAMP))
+    return urls
+
+
 # Updated Excel upload endpoint to match Flutter functionality exactly
-@app.route('/api/upload_excel', methods=['POST'])
+@main.route('/api/upload_excel', methods=['POST'])
 @admin_required
 def upload_excel():
+    """
+    Queue an import of an .xlsx, .xls or .csv sheet.
+    Returns a task_id; /api/upload_progress/<task_id> reports row-level
+    progress and, once finished, the import summary with per-chunk results
+    and per-row errors.
+    Form fields: mode=replace (default, every row is written) or diff (only
+    new and changed rows are written); dry_run=1 (implies diff) writes
+    nothing and reports creates/updates/unchanged/conflicts, to be applied
+    with POST /api/upload_excel/<task_id>/commit.
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
@@ -424,199 +511,152 @@ def upload_excel():
         return jsonify({'error': 'Empty filename'}), 400
     
     filename = secure_filename(f.filename)
-    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if '.' not in filename or filename.rsplit('.', 1)[1].lower() not in IMPORT_EXTENSIONS:
+        return jsonify({'error': f'File type not allowed. Use one of: {", ".join(IMPORT_EXTENSIONS)}'}), 400
+
+    dry_run = request.form.get('dry_run', '').lower() in ('1', 'true')
+    mode = 'diff' if dry_run else request.form.get('mode', 'replace')
+    if mode not in IMPORT_MODES:
+        return jsonify({'error': f'mode must be one of: {", ".join(IMPORT_MODES)}'}), 400
+    # A unique name, so a concurrent upload of the same name can't replace the file
+    filename = f'{DRY_RUN_PREFIX if dry_run else ""}{uuid.uuid4().hex[:12]}_{filename}'
+    _expire_dry_run_files(current_app.config['UPLOAD_FOLDER'])
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
     f.save(path)
 
-    # Required columns exactly as in Flutter
-    required_columns = [
-        'Sl No', 'Emp No', 'Name', 'Type', 'Contract Type', 'Department', 
-        'Category', 'Gender', 'Designation', 'Mobile No', 'Blood Group', 
-        'Permanent Address', 'Email', 'Photo'
-    ]
-
     try:
-        # Load workbook to handle images
-        workbook = openpyxl.load_workbook(path)
-        sheet = workbook.active
-        
-        # Get headers from first row
-        headers = []
-        for cell in sheet[1]:
-            headers.append(cell.value.strip() if cell.value else '')
-        
-        # Create column indices mapping
-        column_indices = {}
-        for i, header in enumerate(headers):
-            if header:
-                column_indices[header] = i
-        
-        # Check for missing required columns (Photo is optional)
-        missing_columns = []
-        for col in required_columns:
-            if col != 'Photo' and col not in column_indices:
-                missing_columns.append(col)
-        
-        if missing_columns:
-            return jsonify({
-                'error': f'Missing columns: {", ".join(missing_columns)}'
-            }), 400
-        
-        has_photo_column = 'Photo' in column_indices
-        staff_data = []
-        total_records = sheet.max_row - 1  # Exclude header row
-        processed_records = 0
-        errors = []
-        
-        # Process data rows (starting from row 2)
-        for row_num in range(2, sheet.max_row + 1):
-            try:
-                row = sheet[row_num]
-                
-                # Skip empty rows
-                if not row[0].value:
-                    total_records -= 1
-                    continue
-                
-                staff = {}
-                photo_url = ''
-                
-                # Process text columns
-                for column in required_columns:
-                    if column == 'Photo':
-                        continue
-                    
-                    if column not in column_indices:
-                        staff[column] = ''
-                        continue
-                    
-                    col_index = column_indices[column]
-                    if col_index >= len(row):
-                        staff[column] = ''
-                        continue
-                    
-                    cell_value = row[col_index].value
-                    
-                    # Special handling for Mobile No
-                    if column == 'Mobile No' and cell_value:
-                        cell_value = str(cell_value).replace('.0', '')
-                    
-                    staff[column] = str(cell_value).strip() if cell_value else ''
-                
-                # Handle photo if column exists
-                if has_photo_column:
-                    photo_col_index = column_indices['Photo']
-                    
-                    # Check if there's an image in this cell
-                    photo_url = process_excel_image(sheet, row_num, photo_col_index, staff.get('Email', staff.get('Sl No', str(int(time.time())))))
-                
-                staff['photoUrl'] = photo_url
-                staff_data.append(staff)
-                processed_records += 1
-                
-            except Exception as e:
-                errors.append({
-                    'row': row_num,
-                    'error': str(e)
-                })
-        
-        # Batch upload to Firestore exactly like Flutter
-        batch = db.batch()
-        
-        for staff in staff_data:
-            # Use Email as document ID if available, otherwise use Emp No, otherwise auto-generate
-            doc_id = None
-            if staff.get('Email') and staff.get('Email').strip():
-                # Make email Firebase-safe by replacing special characters
-                doc_id = staff.get('Email').strip().replace('@', '_at_').replace('.', '_dot_')
-            elif staff.get('Emp No') and staff.get('Emp No').strip():
-                doc_id = str(staff.get('Emp No')).strip()
-            
-            if doc_id:
-                doc_ref = db.collection('staff').document(doc_id)
-            else:
-                doc_ref = db.collection('staff').document()
-            
-            # Structure exactly matching Flutter
-            batch.set(doc_ref, {
-                'slNo': staff.get('Sl No', ''),
-                'empNo': staff.get('Emp No', ''),
-                'name': staff.get('Name', ''),
-                'type': staff.get('Type', ''),
-                'contractType': staff.get('Contract Type', ''),
-                'department': staff.get('Department', ''),
-                'category': staff.get('Category', ''),
-                'gender': staff.get('Gender', ''),
-                'designation': staff.get('Designation', ''),
-                'mobileNo': staff.get('Mobile No', ''),
-                'bloodGroup': staff.get('Blood Group', ''),
-                'permanentAddress': staff.get('Permanent Address', ''),
-                'email': staff.get('Email', ''),
-                'photoUrl': staff.get('photoUrl', ''),
-                'timestamp': firestore.SERVER_TIMESTAMP,
-            })
-        
-        # Commit batch
-        batch.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': f'Successfully uploaded {len(staff_data)} staff records!',
-            'totalRecords': total_records,
-            'processedRecords': processed_records,
-            'uploadedRecords': len(staff_data),
-            'errors': errors
-        })
-
+        task_id = enqueue('upload_excel', {'path': path, 'mode': mode, 'dry_run': dry_run}, created_by=g.firebase_uid)
     except Exception as e:
-        return jsonify({'error': f'Failed to process Excel file: {str(e)}'}), 500
+        return jsonify({'error': f'Failed to start import: {str(e)}'}), 500
+    message = 'Dry run started' if dry_run else 'Import started'
+    return jsonify({'success': True, 'task_id': task_id, 'message': message}), 202
 
 
-def process_excel_image(sheet, row_num, col_index, identifier):
-    """Process image from Excel cell and upload to Firebase Storage"""
+@main.route('/api/upload_excel/<task_id>/commit', methods=['POST'])
+@admin_required
+def commit_upload_excel(task_id):
+    """
+    Apply a finished diff-mode dry run. Rows whose document changed in
+    Firestore after the dry run are reported as conflicts and not written.
+    Returns the task_id of the import.
+    """
+    job = get_job(task_id)
+    if job is None or job.get('kind') != 'upload_excel':
+        return jsonify({'error': 'Unknown task'}), 404
+    preview = (job.get('result') or {}).get('preview')
+    if job.get('status') != 'completed' or not preview:
+        return jsonify({'error': 'Task is not a finished dry run'}), 409
+
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], preview['file'])
+    if not os.path.exists(path):
+        return jsonify({'error': 'The uploaded file is no longer available; upload it again'}), 410
+    if _load_preview(task_id, preview.get('digest')) is None:
+        return jsonify({'error': 'The dry run preview is missing or incomplete; run the dry run again'}), 409
     try:
-        # Get images from the worksheet
-        for image in sheet._images:
-            # Check if image is in the target cell
-            if (image.anchor._from.row + 1 == row_num and 
-                image.anchor._from.col == col_index):
-                
-                # Extract image bytes
-                image_bytes = image._data()
-                
-                if image_bytes:
-                    # Create filename using identifier (email or emp_id)
-                    safe_identifier = str(identifier).replace('@', '_at_').replace('.', '_dot_')
-                    filename = f'staff_photos/{safe_identifier}_photo.jpg'
-                    
-                    # Upload to Firebase Storage
-                    blob = bucket.blob(filename)
-                    blob.upload_from_string(image_bytes, content_type='image/jpeg')
-                    
-                    # Make public and get URL
-                    blob.make_public()
-                    return blob.public_url
-        
-        return ''
+        commit_id = enqueue('upload_excel', {'path': path, 'mode': 'diff',
+                                             'preview': {'task_id': task_id, 'digest': preview['digest']}},
+                            created_by=g.firebase_uid)
     except Exception as e:
-        print(f'Error processing image: {e}')
-        return ''
+        return jsonify({'error': f'Failed to start import: {str(e)}'}), 500
+    return jsonify({'success': True, 'task_id': commit_id, 'message': 'Import started'}), 202
+
 
+def _load_preview(task_id, digest):
+    """The fingerprints a dry run stored, or None if they are missing or don't match its digest"""
+    expected = load_job_data(task_id, 'preview')
+    if expected is None or not digest or preview_digest(expected) != digest:
+        return None
+    return expected
+
+
+def _remove_upload(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not remove {path}: {e}")
 
-# Progress endpoint for real-time updates during upload
-@app.route('/api/upload_progress/<task_id>', methods=['GET'])
+
+def _expire_dry_run_files(folder):
+    """Remove dry-run files that were never committed within IMPORT_PREVIEW_TTL"""
+    cutoff = time.time() - IMPORT_PREVIEW_TTL
+    try:
+        names = [n for n in os.listdir(folder) if n.startswith(DRY_RUN_PREFIX)]
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(folder, name)
+        try:
+            expired = os.path.getmtime(path) < cutoff
+        except OSError:
+            continue
+        if expired:
+            _remove_upload(path)
+
+
+@job_handler('upload_excel')
+def upload_excel_job(ctx, path, mode='replace', dry_run=False, preview=None):
+    def on_progress(processed, written, estimated):
+        ctx.progress(processed, estimated, f'Processed {processed} rows, saved {written}')
+    previewed = False
+    try:
+        expected = None
+        if preview is not None:
+            expected = _load_preview(preview['task_id'], preview['digest'])
+            if expected is None:
+                raise Exception('The dry run preview is missing or incomplete; run the dry run again')
+        result = import_staff_file(path, on_progress=on_progress, mode=mode, dry_run=dry_run, expected=expected)
+        if dry_run:
+            # The fingerprints can outgrow the job document: they are stored
+            # beside it and the result keeps their digest, checked on commit
+            fingerprints = result.pop('fingerprints')
+            ctx.save_data('preview', fingerprints)
+            result['preview'] = {'file': os.path.basename(path), 'digest': preview_digest(fingerprints),
+                                 'rows': len(fingerprints)}
+            previewed = True
+        return result
+    finally:
+        # A finished dry run's file waits in UPLOAD_FOLDER for its commit
+        # (or IMPORT_PREVIEW_TTL); any other import is done with it
+        if not previewed:
+            _remove_upload(path)
+
+
+# Progress endpoint for background jobs (uploads, bulk deletes, approvals)
+@main.route('/api/upload_progress/<task_id>', methods=['GET'])
 @admin_required
 def get_upload_progress(task_id):
-    # This would be used with a task queue like Celery for real progress tracking
-    # For now, return a simple response
-    return jsonify({
-        'status': 'processing',
-        'progress': 50,
-        'message': 'Processing records...'
-    })
+    job = get_job(task_id)
+    if job is None:
+        return jsonify({'error': 'Unknown task'}), 404
+    
+    response = {
+        'task_id': task_id,
+        'kind': job.get('kind'),
+        'status': job.get('status'),
+        'progress': job.get('progress', 0),
+        'message': job.get('message', ''),
+        'processed': job.get('processed', 0),
+        'total': job.get('total'),
+    }
+    if 'result' in job:
+        response['result'] = job['result']
+    if 'error' in job:
+        response['error'] = job['error']
+    return jsonify(response)
+
+
+@main.route('/api/upload_progress/<task_id>/cancel', methods=['POST'])
+@admin_required
+def cancel_upload(task_id):
+    if not cancel_job(task_id):
+        return jsonify({'success': False, 'error': 'Task not found or already finished'}), 404
+    return jsonify({'success': True, 'task_id': task_id, 'message': 'Cancellation requested'})
 
 
 # Endpoint used by web client to create firebase auth user if login fails (mirrors Flutter fallback)
-@app.route('/api/create_if_staff', methods=['POST'])
+@main.route('/api/create_if_staff', methods=['POST'])
 def create_if_staff():
     data = request.json or {}
     email = (data.get('email') or '').strip()
@@ -626,11 +666,9 @@ def create_if_staff():
 
     # Find staff doc with this email
     try:
-        q = db.collection('staff').where('email', '==', email).limit(1).get()
-        if not q:
+        staff = staff_cache.find_by_email(email)
+        if staff is None:
             return jsonify({'found': False, 'message': 'No staff record found'}), 404
-        staff_doc = q[0]
-        staff = staff_doc.to_dict()
         # Accept phone or mobileNo or Phone
         stored_phone = str(staff.get('mobileNo') or staff.get('Phone') or staff.get('phone') or '')
         if stored_phone == password:
@@ -643,6 +681,12 @@ def create_if_staff():
                     'staffId': staff.get('slNo') or staff.get('SlNo') or '',
                     'createdAt': firestore.SERVER_TIMESTAMP
                 })
+                invalidate_admin_role(new_user.uid)
+                try:
+                    set_admin_claim(new_user.uid, False)
+                except Exception as e:
+                    # admin_required falls back to the users doc without the claim
+                    print(f"Could not set the isAdmin claim for {new_user.uid}: {e}")
                 return jsonify({'created': True, 'uid': new_user.uid}), 201
             except Exception as e:
                 return jsonify({'error': 'Could not create user', 'detail': str(e)}), 500
@@ -652,115 +696,236 @@ def create_if_staff():
         return jsonify({'error': 'Server error', 'detail': str(e)}), 500
 
 # Public endpoint for stats
-@app.route('/api/stats', methods=['GET'])
+@main.route('/api/stats', methods=['GET'])
+@conditional_staff_response(STATS_CACHE_CONTROL)
 def get_stats():
     try:
-        docs = db.collection('staff').get()
-        departments = set()
-        for d in docs:
-            data = d.to_dict()
-            dept = data.get('department')
-            if dept:
-                departments.add(dept)
-        
-        return jsonify({
-            'total_staff': len(docs),
-            'total_departments': len(departments)
-        })
+        return jsonify(get_staff_stats())
     except Exception as e:
         return jsonify({'error': 'Failed to fetch stats', 'detail': str(e)}), 500
 
 # Protected endpoint to list staff entries (for web UI)
-@app.route('/api/staffs', methods=['GET'])
+@main.route('/api/staffs', methods=['GET'])
 @login_required
+@conditional_staff_response(STAFF_DATA_CACHE_CONTROL)
 def list_staffs():
+    """
+    List staff entries.
+    Optional query args: limit/cursor for pagination, department, type,
+    designation, bloodGroup and gender filters, and fields/exclude for
+    projection (e.g. ?exclude=permanentAddress for the directory grid).
+    """
     try:
-        # Debug: print the Authorization header to see if token is sent
-        from flask import request
-        print("Authorization header received:", request.headers.get("Authorization"))
-
-        docs = db.collection('staff').stream()
-        staff_list = []
-        for d in docs:
-            data = d.to_dict()
-            data['id'] = d.id
-            staff_list.append(data)
-
-        return jsonify({'staffs': staff_list})
+        spec = parse_staff_query(request.args)
+    except StaffQueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        staff_list, next_cursor = staff_cache.query(spec)
+
+        response = {'staffs': staff_list}
+        if spec['limit']:
+            response['next_cursor'] = next_cursor
+        return jsonify(response)
     except Exception as e:
         return jsonify({'error': 'Failed to fetch staffs', 'detail': str(e)}), 500
 
 
+@main.route('/api/staffs/changes', methods=['GET'])
+@login_required
+def staff_changes_since():
+    """
+    Delta sync: staff created/updated/deleted since ?since=<sync_token>.
+    Without since (or with an expired token) the full roster is returned
+    with reset=true. Supports fields/exclude like /api/staffs.
+    """
+    try:
+        spec = parse_staff_query({k: v for k, v in request.args.items() if k in ('fields', 'exclude')})
+        changes = staff_changes(request.args.get('since'), fields=spec['fields'])
+    except (SyncTokenError, StaffQueryError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'Failed to fetch changes', 'detail': str(e)}), 500
+
+    response = jsonify(changes)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@main.route('/api/staff/search', methods=['GET'])
+@login_required
+@conditional_staff_response(SEARCH_CACHE_CONTROL)
+def search_staffs():
+    """
+    Ranked staff search over name, designation, department, empNo, email
+    and mobileNo (typo tolerant; digits match phone-number endings).
+    Query args: q (required), limit, offset, plus the /api/staffs filters
+    and fields/exclude.
+    """
+    try:
+        query, limit, offset = parse_search_args(request.args)
+        spec = parse_staff_query({k: v for k, v in request.args.items() if k not in ('limit', 'cursor')})
+    except (SearchQueryError, StaffQueryError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        return jsonify(search_staff(query, limit=limit, offset=offset,
+                                    filters=spec['filters'], fields=spec['fields']))
+    except Exception as e:
+        return jsonify({'error': 'Search failed', 'detail': str(e)}), 500
+
+
+@main.route('/api/staff/export', methods=['GET'])
+@admin_required
+def export_staff():
+    """
+    Download the staff directory as .xlsx (default) or .csv in the column
+    layout of /api/upload_excel, so the file can be edited and re-imported.
+    Query args: format=xlsx|csv, the /api/staffs filters, and for xlsx
+    photos=thumb|full to embed staff photos in the Photo column. The xlsx
+    response carries X-Export-Rows and, with photos, X-Export-Photos-Skipped
+    (photos that could not be downloaded or read and were left blank).
+    """
+    try:
+        fmt, photo_field = parse_export_args(request.args)
+        filters = parse_staff_query({k: v for k, v in request.args.items() if k not in ('limit', 'cursor')})['filters']
+    except (ExportError, StaffQueryError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    filename = f"staff_{datetime.now().strftime('%Y%m%d')}.{fmt}"
+    try:
+        if fmt == 'csv':
+            chunks = csv_chunks(filters)
+            # Read the first page here so a Firestore failure is still a 500
+            first = next(chunks)
+            response = Response(itertools.chain([first], chunks), mimetype=EXPORT_CONTENT_TYPES['csv'])
+            response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        else:
+            workbook, rows, photos_skipped = export_xlsx(filters, photo_field)
+            response = send_file(workbook, mimetype=EXPORT_CONTENT_TYPES['xlsx'],
+                                 as_attachment=True, download_name=filename, max_age=0)
+            # Blank Photo cells read as "photo removed" on re-import, so say
+            # how many could not be exported
+            response.headers['X-Export-Rows'] = str(rows)
+            if photo_field:
+                response.headers['X-Export-Photos-Skipped'] = str(photos_skipped)
+    except Exception as e:
+        return jsonify({'error': 'Export failed', 'detail': str(e)}), 500
+
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@main.route('/api/staff/<staff_id>', methods=['GET'])
+@login_required
+@conditional_staff_response(STAFF_DATA_CACHE_CONTROL)
+def get_staff(staff_id):
+    """Fetch a single staff entry (used by the directory profile drawer)"""
+    try:
+        data = staff_cache.get(staff_id)
+        if data is None:
+            return jsonify({'error': 'Staff member not found'}), 404
+        return jsonify({'staff': data})
+    except Exception as e:
+        return jsonify({'error': 'Failed to fetch staff', 'detail': str(e)}), 500
+
+
 # Use web_login_required instead of login_required for HTML pages
-@app.route('/staff_list.html')
+@main.route('/staff_list.html')
 @web_login_required
 def staff_list_page_html():
-    return redirect(url_for('directory_page'))
+    return redirect(url_for('.directory_page'))
 
-@app.route('/admin.html')
+@main.route('/admin.html')
 @web_login_required
 def admin_page_html():
-    return redirect(url_for('admin_page'))
+    return redirect(url_for('.admin_page'))
 
-@app.route('/departments')
+@main.route('/departments')
 @web_login_required
 def departments_page():
     return render_template('departments.html')
 
-@app.route('/directory')
+@main.route('/directory')
 @web_login_required
 def directory_page():
     return render_template('staff_list.html')
 
-@app.route('/admin')
+@main.route('/admin')
 @web_login_required
 def admin_page():
     return render_template('admin.html')
 
 
 # Browser file upload endpoint — processes files server-side
-@app.route('/api/upload_file', methods=['POST'])
+@main.route('/api/upload_file', methods=['POST'])
 @login_required
 def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file uploaded'}), 400
-    f = request.files['file']
-    if f.filename == '':
-        return jsonify({'error': 'Empty filename'}), 400
-    if not allowed_file(f.filename):
-        return jsonify({'error': 'File type not allowed'}), 400
-
-    filename = secure_filename(f.filename)
-    local_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    f.save(local_path)
-
-    # Optional: run ported processing logic
-    try:
-        result = process_uploaded_file(local_path)  # implement in processing/file_processors.py
-    except Exception as e:
-        result = {'error': 'processing_failed', 'detail': str(e)}
-
-    # upload to firebase storage
-    blob = bucket.blob(f'uploads/{filename}')
-    blob.upload_from_filename(local_path)
-    # optionally set public or generate signed url — be cautious with privacy
+    """
+    Stream a multipart upload straight to Firebase Storage.
+    The file is stored under its SHA-256, so an identical re-upload is a
+    no-op; clients that send X-Content-SHA256 skip the transfer entirely.
+    ?process=0 skips the local temp copy and process_uploaded_file.
+    ?check=1 with X-Content-SHA256 only looks the hash up (404 if it isn't
+    stored), so a client can skip sending content the server already has.
+    """
+    process = request.args.get('process', '1') != '0'
+    check = request.args.get('check') == '1'
+    if check and not request.headers.get('X-Content-SHA256'):
+        return jsonify({'error': 'check=1 needs an X-Content-SHA256 header'}), 400
     try:
-        blob.make_public()
-        storage_url = blob.public_url
-    except Exception:
-        storage_url = None
+        # Reads request.stream directly; request.files would buffer the whole body first
+        filename, mimetype, chunks = open_file_part(request.stream, request.content_type)
+        if filename == '':
+            return jsonify({'error': 'Empty filename'}), 400
+        if not allowed_file(filename):
+            return jsonify({'error': 'File type not allowed'}), 400
+        filename = secure_filename(filename)
+
+        expected_sha256 = request.headers.get('X-Content-SHA256')
+        try:
+            existing = find_upload(expected_sha256, filename) if expected_sha256 else None
+        except UploadError:
+            raise
+        except Exception as e:
+            raise UploadStorageError(f'Could not look up the upload: {e}') from e
+        if existing is not None:
+            return jsonify({'filename': filename, 'storage_url': existing.public_url, 'process_result': None,
+                            'sha256': expected_sha256.lower(), 'size': existing.size, 'deduplicated': True})
+        if check:
+            # Probe only: the client sends the file itself in a second request
+            return jsonify({'error': 'Not uploaded yet', 'deduplicated': False}), 404
+
+        stored = store_upload(filename, mimetype, chunks, keep_local=process, local_dir=current_app.config['UPLOAD_FOLDER'])
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
 
-    return jsonify({'filename': filename, 'storage_url': storage_url, 'process_result': result})
+    # Optional: run ported processing logic
+    result = None
+    if stored['local_path']:
+        try:
+            result = process_uploaded_file(stored['local_path'], sha256=stored['sha256'])
+        except Exception as e:
+            result = {'error': 'processing_failed', 'detail': str(e)}
+        finally:
+            os.remove(stored['local_path'])
+
+    return jsonify({'filename': filename, 'storage_url': stored['storage_url'], 'process_result': result,
+                    'sha256': stored['sha256'], 'size': stored['size'], 'deduplicated': stored['deduplicated']})
 
 # Serve static files (if needed)
-@app.route('/static/<path:filename>')
+@main.route('/static/<path:filename>')
 def static_files(filename):
-    return send_from_directory('static', filename)
+    # Templates link static_url() names (images/hero.<hash>.png), which are immutable
+    real_name, cache_control = resolve_static(filename)
+    response = send_from_directory('static', real_name)
+    response.headers['Cache-Control'] = cache_control
+    return response
 
 
 # Add this new endpoint to your existing app.py after the other API routes
 
-@app.route('/api/staff/<staff_id>', methods=['DELETE'])
+@main.route('/api/staff/<staff_id>', methods=['DELETE'])
 @admin_required
 def delete_staff(staff_id):
     """
@@ -776,29 +941,41 @@ def delete_staff(staff_id):
         staff_data = staff_doc.to_dict()
         staff_email = staff_data.get('email')
         
-        # Delete the staff document
-        db.collection('staff').document(staff_id).delete()
+        # Delete the staff document, leaving a tombstone for delta sync
+        def delete_doc():
+            batch = db.batch()
+            batch.delete(db.collection('staff').document(staff_id))
+            add_tombstone(batch, staff_id)
+            batch.commit()
+            staff_cache.remove(staff_id)
+        
+        # The login is looked up while the staff doc is deleted; it is only
+        # removed once the staff delete has succeeded
+        def find_login():
+            return auth.get_user_by_email(staff_email) if staff_email else None
+        
+        doc_result, user_record = gather(delete_doc, find_login, return_exceptions=True)
+        if isinstance(doc_result, Exception):
+            raise doc_result
         
         # Optionally delete the associated Firebase Auth user and users collection document
         deleted_auth_user = False
-        if staff_email:
+        if isinstance(user_record, auth.UserNotFoundError):
+            # User doesn't exist in Firebase Auth, that's okay
+            pass
+        elif isinstance(user_record, Exception):
+            print(f"Failed to delete auth user for {staff_email}: {user_record}")
+        elif user_record is not None:
+            invalidate_admin_role(user_record.uid)
             try:
-                # Find user by email
-                user_record = auth.get_user_by_email(staff_email)
-                
-                # Delete from users collection
-                db.collection('users').document(user_record.uid).delete()
-                
-                # Delete Firebase Auth user
-                auth.delete_user(user_record.uid)
+                gather(
+                    lambda: db.collection('users').document(user_record.uid).delete(),
+                    lambda: auth.delete_user(user_record.uid),
+                )
                 deleted_auth_user = True
-                
-            except auth.UserNotFoundError:
-                # User doesn't exist in Firebase Auth, that's okay
-                pass
-            except Exception as user_delete_error:
+            except Exception as e:
                 # Log error but don't fail the staff deletion
-                print(f"Failed to delete auth user for {staff_email}: {user_delete_error}")
+                print(f"Failed to delete auth user for {staff_email}: {e}")
         
         return jsonify({
             'success': True, 
@@ -813,7 +990,7 @@ def delete_staff(staff_id):
 
 # Add this endpoint to your app.py after the other staff routes
 
-@app.route('/api/staff/<staff_id>/type', methods=['PUT'])
+@main.route('/api/staff/<staff_id>/type', methods=['PUT'])
 @admin_required
 def update_staff_type(staff_id):
     """
@@ -837,10 +1014,12 @@ def update_staff_type(staff_id):
             return jsonify({'error': 'Staff member not found'}), 404
         
         # Update the staff type
-        db.collection('staff').document(staff_id).update({
+        type_update = {
             'type': new_type,
             'updatedAt': firestore.SERVER_TIMESTAMP
-        })
+        }
+        db.collection('staff').document(staff_id).update(type_update)
+        staff_cache.merge(staff_id, type_update)
         
         return jsonify({
             'success': True,
@@ -854,7 +1033,7 @@ def update_staff_type(staff_id):
         return jsonify({'error': 'Failed to update staff type', 'detail': str(e)}), 500
 
 
-@app.route('/api/staff/<staff_id>/update', methods=['PUT'])
+@main.route('/api/staff/<staff_id>/update', methods=['PUT'])
 @admin_required
 def update_staff_profile(staff_id):
     """
@@ -876,6 +1055,7 @@ def update_staff_profile(staff_id):
         if update_fields:
             update_fields['updatedAt'] = firestore.SERVER_TIMESTAMP
             staff_ref.update(update_fields)
+            staff_cache.merge(staff_id, update_fields)
             
         return jsonify({
             'success': True,
@@ -887,12 +1067,13 @@ def update_staff_profile(staff_id):
         return jsonify({'error': 'Failed to update staff profile', 'detail': str(e)}), 500
 
 
-@app.route('/api/staff/bulk_delete', methods=['POST'])
+@main.route('/api/staff/bulk_delete', methods=['POST'])
 @admin_required
 def bulk_delete_staff():
     """
     Delete multiple staff members (admin only)
     Expects JSON: {"staff_ids": ["id1", "id2", "id3"]}
+    Runs as a background job; returns a task_id for /api/upload_progress.
     """
     try:
         data = request.json or {}
@@ -900,52 +1081,165 @@ def bulk_delete_staff():
         
         if not staff_ids or not isinstance(staff_ids, list):
             return jsonify({'error': 'staff_ids array required'}), 400
-            
-        deleted_count = 0
-        deleted_auth_users = 0
-        errors = []
-        
-        for staff_id in staff_ids:
-            try:
-                # Get staff document
-                staff_doc = db.collection('staff').document(staff_id).get()
-                if not staff_doc.exists:
-                    errors.append({'staff_id': staff_id, 'error': 'Staff not found'})
-                    continue
-                    
-                staff_data = staff_doc.to_dict()
-                staff_email = staff_data.get('email')
-                
-                # Delete staff document
-                db.collection('staff').document(staff_id).delete()
-                deleted_count += 1
-                
-                # Try to delete associated auth user
-                if staff_email:
-                    try:
-                        user_record = auth.get_user_by_email(staff_email)
-                        db.collection('users').document(user_record.uid).delete()
-                        auth.delete_user(user_record.uid)
-                        deleted_auth_users += 1
-                    except auth.UserNotFoundError:
-                        pass
-                    except Exception as user_error:
-                        errors.append({'staff_id': staff_id, 'error': f'Auth deletion failed: {user_error}'})
-                        
-            except Exception as e:
-                errors.append({'staff_id': staff_id, 'error': str(e)})
         
-        return jsonify({
-            'success': True,
-            'deleted_staff': deleted_count,
-            'deleted_auth_users': deleted_auth_users,
-            'errors': errors
-        })
+        task_id = enqueue('bulk_delete_staff', {'staff_ids': staff_ids}, created_by=g.firebase_uid)
+        return jsonify({'success': True, 'task_id': task_id, 'message': 'Bulk delete started'}), 202
         
     except Exception as e:
         return jsonify({'error': 'Bulk delete failed', 'detail': str(e)}), 500
 
-@app.route('/api/staff/test_admin_check', methods=['GET'])
+
+@job_handler('bulk_delete_staff')
+def bulk_delete_staff_job(ctx, staff_ids):
+    """
+    Lookups go through db.get_all, staff and users docs are deleted in
+    batches, and auth users are resolved with auth.get_users and removed
+    with auth.delete_users, so a cohort costs a few calls per few hundred
+    staff instead of five round-trips each.
+    """
+    staff_ids = list(dict.fromkeys(staff_ids))
+    total = len(staff_ids)
+    errors = []
+    
+    # Look up emails of the staff to delete
+    emails = {}
+    for chunk in _chunks(staff_ids, GET_ALL_CHUNK):
+        ctx.check_cancelled()
+        refs = [db.collection('staff').document(staff_id) for staff_id in chunk]
+        found = {snap.id: snap for snap in db.get_all(refs)}
+        for staff_id in chunk:
+            snap = found.get(staff_id)
+            if snap is None or not snap.exists:
+                errors.append({'staff_id': staff_id, 'error': 'Staff not found'})
+            else:
+                emails[staff_id] = (snap.to_dict() or {}).get('email')
+    
+    # Delete staff documents; each also writes a tombstone, so two writes per staff
+    deleted = []
+    for chunk in _chunks(list(emails), FIRESTORE_BATCH_LIMIT // 2):
+        ctx.progress(len(deleted), total, f'Deleted {len(deleted)} of {total}')
+        batch = db.batch()
+        for staff_id in chunk:
+            batch.delete(db.collection('staff').document(staff_id))
+            add_tombstone(batch, staff_id)
+        try:
+            batch.commit()
+        except Exception as e:
+            errors.extend({'staff_id': staff_id, 'error': str(e)} for staff_id in chunk)
+            continue
+        for staff_id in chunk:
+            staff_cache.remove(staff_id)
+        deleted.extend(chunk)
+    
+    # Resolve associated auth users by email
+    staff_by_email = {}
+    for staff_id in deleted:
+        if emails[staff_id]:
+            staff_by_email.setdefault(emails[staff_id].lower(), []).append(staff_id)
+    
+    uid_owners = {}
+    for chunk in _chunks(list(staff_by_email), AUTH_GET_USERS_LIMIT):
+        try:
+            result = auth.get_users([auth.EmailIdentifier(email) for email in chunk])
+        except Exception as user_error:
+            for email in chunk:
+                errors.extend({'staff_id': staff_id, 'error': f'Auth deletion failed: {user_error}'}
+                              for staff_id in staff_by_email[email])
+            continue
+        for user in result.users:
+            uid_owners[user.uid] = staff_by_email.get((user.email or '').lower(), [])
+    
+    # Delete users docs and auth users
+    deleted_auth_users = 0
+    uids = list(uid_owners)
+    for chunk in _chunks(uids, AUTH_DELETE_USERS_LIMIT):
+        ctx.progress(total, total, f'Removing {len(uids)} login accounts')
+        try:
+            for docs_chunk in _chunks(chunk, FIRESTORE_BATCH_LIMIT):
+                batch = db.batch()
+                for uid in docs_chunk:
+                    batch.delete(db.collection('users').document(uid))
+                batch.commit()
+            for uid in chunk:
+                invalidate_admin_role(uid)
+            result = auth.delete_users(chunk)
+        except Exception as user_error:
+            for uid in chunk:
+                errors.extend({'staff_id': staff_id, 'error': f'Auth deletion failed: {user_error}'}
+                              for staff_id in uid_owners[uid])
+            continue
+        deleted_auth_users += result.success_count
+        for err in result.errors:
+            errors.extend({'staff_id': staff_id, 'error': f'Auth deletion failed: {err.reason}'}
+                          for staff_id in uid_owners[chunk[err.index]])
+    
+    return {
+        'success': True,
+        'deleted_staff': len(deleted),
+        'deleted_auth_users': deleted_auth_users,
+        'errors': errors
+    }
+
+@main.route('/api/cache/stats', methods=['GET'])
+@admin_required
+def get_cache_stats():
+    """Hit/miss counters of this worker's staff cache"""
+    return jsonify({'staff': staff_cache.stats(), 'search': staff_search_index.stats()})
+
+def _metrics_allowed():
+    if METRICS_TOKEN and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return True
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in network for network in METRICS_ALLOW)
+
+@main.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Request and backend-call metrics of all workers in Prometheus format.
+    Scrapes must send METRICS_TOKEN as a bearer token or come from an
+    address in METRICS_ALLOW; with neither configured the endpoint is off.
+    """
+    if not _metrics_allowed():
+        if METRICS_TOKEN:
+            return jsonify({'error': 'Authorization token required'}), 401
+        return jsonify({'error': 'Metrics are not enabled for this address'}), 403
+    return current_app.response_class(render_metrics(), mimetype=METRICS_CONTENT_TYPE,
+                                      headers={'Cache-Control': 'no-store'})
+
+@main.route('/api/sheets/stats', methods=['GET'])
+@admin_required
+def get_sheets_stats():
+    """Call counts, retries and latency of this worker's Google Sheets calls"""
+    return jsonify({'sheets': sheets_gateway.stats()})
+
+@main.route('/api/users/<uid>/admin', methods=['PUT'])
+@admin_required
+def set_user_admin(uid):
+    """
+    Grant or revoke admin rights: {"isAdmin": true|false}. Updates
+    users/{uid} and the isAdmin custom claim together; the claim reaches
+    the user's requests when their ID token is next refreshed (within an
+    hour). Use this rather than editing users/{uid}.isAdmin directly, which
+    a token that already carries the claim wouldn't see.
+    """
+    data = request.json or {}
+    if not isinstance(data.get('isAdmin'), bool):
+        return jsonify({'error': 'isAdmin must be true or false'}), 400
+    try:
+        # The claim first: it fails for unknown users before any doc is written
+        set_admin_claim(uid, data['isAdmin'])
+        db.collection('users').document(uid).set({'isAdmin': data['isAdmin']}, merge=True)
+        invalidate_admin_role(uid)
+    except auth.UserNotFoundError:
+        return jsonify({'error': 'User not found'}), 404
+    except Exception as e:
+        return jsonify({'error': 'Could not update admin rights', 'detail': str(e)}), 500
+    return jsonify({'success': True, 'uid': uid, 'isAdmin': data['isAdmin']})
+
+@main.route('/api/staff/test_admin_check', methods=['GET'])
 @admin_required
 def test_admin_check():
     """
@@ -954,5 +1248,29 @@ def test_admin_check():
     """
     return jsonify({'isAdmin': True})
 
+def create_app():
+    """
+    Build the Flask app. Importing this module loads no Firebase/Sheets
+    clients; each worker process creates its own on first use (or in the
+    gunicorn post_fork hook, see gunicorn.conf.py).
+    """
+    # static/ is served by static_files(), which knows about fingerprinted names
+    app = Flask(__name__, static_folder=None, template_folder='templates')
+    CORS(app)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')  # Add this for sessions
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    # after_request hooks run in reverse order: the timing hook runs last
+    # so request latency includes compression
+    metrics.init_app(app)
+    fanout.init_app(app)
+    app.after_request(compress_response)
+    app.jinja_env.globals['static_url'] = static_url
+    app.register_blueprint(main)
+    return app
+
+
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
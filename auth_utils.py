@@ -1,9 +1,23 @@
 # auth_utils.py
-import firebase_admin
-from firebase_admin import auth, firestore
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
-from flask import request, jsonify, g, redirect, url_for
-from firebase_config import db, bucket
+from flask import request, jsonify, g
+from firebase_config import db, auth
+
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '1024'))
+ADMIN_ROLE_TTL = int(os.environ.get('ADMIN_ROLE_TTL', '60'))
+
+# sha256(id token) -> decoded token, oldest first; entries die at the token's exp
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# uid -> (expires_at, users doc dict or None)
+_admin_role_cache = {}
+_admin_role_lock = threading.Lock()
 
 
 def get_bearer_token():
@@ -18,17 +32,59 @@ def get_bearer_token():
 def verify_firebase_token(id_token):
     """
     Verifies an ID token using firebase_admin and returns decoded token dict or raises.
+    Verified tokens are remembered until their `exp`, so repeat requests with
+    the same token skip the signature check.
     """
+    key = hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+    now = time.time()
+    with _token_cache_lock:
+        decoded = _token_cache.get(key)
+        if decoded is not None:
+            if decoded.get('exp', 0) > now:
+                _token_cache.move_to_end(key)
+                return decoded
+            del _token_cache[key]
+
     decoded = auth.verify_id_token(id_token)
+    with _token_cache_lock:
+        _token_cache[key] = decoded
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
     return decoded
 
+def get_user_doc(uid):
+    """users/{uid} as a dict (None if missing), cached for ADMIN_ROLE_TTL seconds"""
+    now = time.monotonic()
+    with _admin_role_lock:
+        cached = _admin_role_cache.get(uid)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+    user_doc = db.collection('users').document(uid).get()
+    user_data = user_doc.to_dict() if user_doc.exists else None
+    with _admin_role_lock:
+        _admin_role_cache[uid] = (now + ADMIN_ROLE_TTL, user_data)
+    return user_data
+
+def invalidate_admin_role(uid):
+    """Call after changing or deleting users/{uid}"""
+    with _admin_role_lock:
+        _admin_role_cache.pop(uid, None)
+
+def set_admin_claim(uid, is_admin):
+    """
+    Store isAdmin as a custom claim so admin_required can skip the users doc.
+    Takes effect when the client next refreshes its ID token.
+    """
+    claims = auth.get_user(uid).custom_claims or {}
+    claims['isAdmin'] = bool(is_admin)
+    auth.set_custom_user_claims(uid, claims)
+    invalidate_admin_role(uid)
+
 def login_required(f):
     """For API endpoints that expect Authorization header with Bearer token"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        from flask import request
-        print("Decorator sees Authorization header:", request.headers.get("Authorization"))
-
         auth_header = request.headers.get("Authorization")
         if not auth_header:
             return jsonify({'error': 'Authorization token required'}), 401
@@ -59,11 +115,15 @@ def admin_required(f):
     @login_required
     def wrapper(*args, **kwargs):
         uid = g.firebase_uid
+        # A custom claim in the verified token settles it without a lookup
+        if 'isAdmin' in g.firebase_token:
+            if not g.firebase_token['isAdmin']:
+                return jsonify({'error': 'Admin privileges required'}), 403
+            return f(*args, **kwargs)
         try:
-            user_doc = db.collection('users').document(uid).get()
-            if not user_doc.exists:
+            user_data = get_user_doc(uid)
+            if user_data is None:
                 return jsonify({'error': 'User doc not found'}), 403
-            user_data = user_doc.to_dict()
             if not user_data.get('isAdmin', False):
                 return jsonify({'error': 'Admin privileges required'}), 403
             # pass user_data if needed
@@ -0,0 +1,171 @@
+# benchmarks/concurrency.py
+# Throughput of the gunicorn serving modes on an I/O-bound endpoint.
+#
+#   python benchmarks/concurrency.py [--modes sync:2:1,gthread:2:16]
+#                                    [--clients 32] [--duration 10]
+#                                    [--latency-ms 20] [--path /api/staff/{id}]
+#
+# Each mode (worker_class:workers:threads) starts gunicorn with
+# gunicorn.conf.py on the in-memory fakes (benchmarks/fakes.py), where
+# every backend round-trip sleeps --latency-ms. The staff cache is switched
+# off so each /api/staff/<id> request is a Firestore read, like a cache miss
+# in production. Keep-alive clients hammer the server for --duration
+# seconds; {id} in the path is replaced by a random staff ID.
+import argparse
+import http.client
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+ROSTER_SIZE = 500
+
+
+def wsgi_app():
+    """The app on seeded fakes; gunicorn loads it as 'concurrency:wsgi_app()'"""
+    sys.path.insert(0, ROOT)
+    from fakes import install_fakes
+    from endpoints import seed_staff, add_admin
+
+    fakes = install_fakes(latency=float(os.environ.get('BENCH_LATENCY_MS', '0')) / 1000)
+    add_admin(fakes)
+    seed_staff(fakes, ROSTER_SIZE)
+    from app import app
+    return app
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(port, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with {proc.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/login')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError('gunicorn did not start')
+
+
+def start_server(mode, port, latency_ms, workdir, verbose=False):
+    worker_class, workers, threads = mode.split(':')
+    env = dict(
+        os.environ,
+        BENCH_LATENCY_MS=str(latency_ms),
+        STAFF_CACHE_MAX_SIZE='0',
+        PENDING_SHEET_ID='benchmark-sheet',
+        JOB_STORE='memory',
+        SHEETS_QUOTA_PER_MINUTE='1000000',
+    )
+    cmd = [
+        sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+        '--pythonpath', f'{ROOT},{BENCH_DIR}', '--bind', f'127.0.0.1:{port}',
+        '--worker-class', worker_class, '--workers', workers, '--threads', threads,
+        '--log-level', 'warning', 'concurrency:wsgi_app()',
+    ]
+    output = None if verbose else subprocess.DEVNULL
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=output, stderr=output)
+    try:
+        _wait_ready(port, proc)
+    except Exception:
+        proc.terminate()
+        raise
+    return proc
+
+
+def load(port, path, clients, duration, staff_ids, token):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = []
+        failed = 0
+        while time.monotonic() < deadline:
+            url = path.replace('{id}', random.choice(staff_ids))
+            start = time.perf_counter()
+            try:
+                conn.request('GET', url, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            mine.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+        'p99_ms': latencies[int(0.99 * (len(latencies) - 1))] * 1000 if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare gunicorn serving modes on the in-memory fakes')
+    parser.add_argument('--modes', default='sync:2:1,gthread:2:16',
+                        help='comma-separated worker_class:workers:threads')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--path', default='/api/staff/{id}')
+    parser.add_argument('--verbose', action='store_true', help='show gunicorn output')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from endpoints import staff_email, ADMIN_TOKEN
+    staff_ids = [staff_email(i).replace('@', '_at_').replace('.', '_dot_') for i in range(1, ROSTER_SIZE + 1)]
+
+    print(f'{args.clients} clients, {args.duration:g}s, {args.latency_ms:g} ms per backend call, GET {args.path}')
+    print(f'{"mode":22s} {"req/s":>9s} {"p50 ms":>9s} {"p99 ms":>9s} {"errors":>7s}')
+    for mode in args.modes.split(','):
+        port = _free_port()
+        with tempfile.TemporaryDirectory() as workdir:
+            proc = start_server(mode, port, args.latency_ms, workdir, args.verbose)
+            try:
+                r = load(port, args.path, args.clients, args.duration, staff_ids, ADMIN_TOKEN)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+        print(f'{mode:22s} {r["rps"]:9.1f} {r["p50_ms"] or 0:9.1f} {r["p99_ms"] or 0:9.1f} {r["errors"]:7d}')
+
+
+if __name__ == '__main__':
+    main()
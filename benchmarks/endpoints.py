@@ -0,0 +1,326 @@
+# benchmarks/endpoints.py
+# Offline endpoint benchmarks on the in-memory fakes (benchmarks/fakes.py).
+#
+#   python benchmarks/endpoints.py [--sizes 1000,10000] [--latency-ms 0]
+#                                  [--repeat 50] [--photo-every 10]
+#                                  [--json results.json] [--max-growth 1.5]
+#
+# Drives list_staffs, get_stats, upload_excel (generated workbooks with
+# embedded photos), approve_registration and bulk_delete_staff through the
+# Flask test client, once per roster size, each size in a fresh process.
+# Reports latency (p50/p99), throughput and backend round-trips per
+# operation. Backend calls are deterministic, so the run fails when calls
+# per operation grow faster with the roster size than the endpoint should
+# (O(1) or O(N)) by more than --max-growth; --check-time applies the same
+# test to latency.
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_TOKEN = 'benchmark-admin'
+DEPARTMENTS = ['CSE', 'ECE', 'EEE', 'ME', 'CE', 'Mathematics', 'Physics', 'Office']
+TYPES = ['Teaching', 'Non-Teaching']
+GENDERS = ['Male', 'Female']
+PHOTO_COLUMN = 'N'  # 'Photo' is the 14th of REQUIRED_COLUMNS
+
+
+# -- data ----------------------------------------------------------------
+
+def staff_email(i, prefix='staff'):
+    return f'{prefix}{i:06d}@mace.ac.in'
+
+
+def staff_row(i, prefix='staff'):
+    """Values for processing.staff_import.REQUIRED_COLUMNS (without Photo)"""
+    return [
+        str(i), f'E{i:06d}', f'Staff Member {i}', TYPES[i % 2], 'Permanent',
+        DEPARTMENTS[i % len(DEPARTMENTS)], 'General', GENDERS[i % 2], 'Assistant Professor',
+        f'9{i:09d}', 'O+', f'House {i}, Kothamangalam', staff_email(i, prefix),
+    ]
+
+
+def add_admin(fakes, uid='benchmark-admin'):
+    """Accept ADMIN_TOKEN for an admin user (isAdmin claim and users/{uid} with isAdmin)"""
+    fakes['auth'].add_token(ADMIN_TOKEN, uid, isAdmin=True)
+    fakes['firestore'].seed('users', {uid: {'email': 'admin@mace.ac.in', 'isAdmin': True}})
+
+
+def seed_staff(fakes, size):
+    from processing.staff_import import REQUIRED_COLUMNS, parse_row, staff_doc, staff_doc_id
+    columns = {name: i for i, name in enumerate(REQUIRED_COLUMNS)}
+    docs = {}
+    for i in range(1, size + 1):
+        staff = parse_row(staff_row(i), columns)
+        docs[staff_doc_id(staff)] = staff_doc(staff)
+    fakes['firestore'].seed('staff', docs)
+    fakes['firestore'].seed('counters', {'staff_sl_no': {'next': size + 1}})
+    return {doc_id: doc['email'] for doc_id, doc in docs.items()}
+
+
+def registration_rows(count):
+    from registrations import SHEET_COLUMNS, PENDING
+    rows = []
+    for i in range(1, count + 1):
+        record = {
+            'Timestamp': '2024-06-01 10:00:00', 'Name': f'Applicant {i}', 'Employee ID': f'R{i:06d}',
+            'Email': staff_email(i, 'applicant'), 'Department': DEPARTMENTS[i % len(DEPARTMENTS)],
+            'Designation': 'Lecturer', 'Mobile No': f'8{i:09d}', 'Type': TYPES[i % 2],
+            'Contract Type': 'Guest', 'Category': 'General', 'Gender': GENDERS[i % 2],
+            'Blood Group': 'B+', 'Permanent Address': f'Flat {i}', 'Status': PENDING,
+        }
+        rows.append([record[c] for c in SHEET_COLUMNS])
+    return rows
+
+
+def _photo_png(i):
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new('RGB', (96, 96), ((i * 37) % 256, (i * 91) % 256, (i * 53) % 256)).save(out, format='PNG')
+    return out.getvalue()
+
+
+def build_workbook(path, rows, photo_every):
+    """An import sheet of `rows` new staff, with a photo on every photo_every-th row"""
+    import openpyxl
+    from openpyxl.drawing.image import Image
+    from processing.staff_import import REQUIRED_COLUMNS
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(REQUIRED_COLUMNS)
+    for i in range(1, rows + 1):
+        sheet.append(staff_row(i, 'import'))
+        if photo_every and i % photo_every == 0:
+            sheet.add_image(Image(io.BytesIO(_photo_png(i))), f'{PHOTO_COLUMN}{i + 1}')
+    workbook.save(path)
+
+
+# -- measuring -----------------------------------------------------------
+
+def _calls(fakes):
+    return {name: dict(fake.calls) for name, fake in fakes.items()}
+
+
+def _calls_since(fakes, before):
+    diff = {}
+    for name, fake in fakes.items():
+        ops = {op: n - before[name].get(op, 0) for op, n in fake.calls.items()}
+        ops = {op: n for op, n in ops.items() if n}
+        if ops:
+            diff[name] = ops
+    return diff
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def result(name, size, scale, items, latencies, calls):
+    total = sum(latencies)
+    return {
+        'scenario': name,
+        'size': size,
+        'scale': scale,          # how cost should grow with size: '1' or 'n'
+        'operations': len(latencies),
+        'items': items,          # rows/requests handled, for throughput
+        'seconds': round(total, 4),
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 3),
+        'throughput': round(items / total, 1) if total else None,
+        'calls': calls,
+        'calls_per_op': round(sum(sum(ops.values()) for ops in calls.values()) / len(latencies), 2),
+    }
+
+
+def wait_for_job(task_id, timeout=600):
+    from jobs import get_job, FINISHED_STATUSES
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = get_job(task_id)
+        if job and job.get('status') in FINISHED_STATUSES:
+            if job['status'] != 'completed':
+                raise RuntimeError(f'Job {task_id} {job["status"]}: {job.get("error")}')
+            return job.get('result')
+        time.sleep(0.002)
+    raise TimeoutError(f'Job {task_id} did not finish')
+
+
+def _check(response, status=200):
+    if response.status_code != status:
+        raise RuntimeError(f'{response.request.path}: {response.status_code} {response.get_data(as_text=True)[:200]}')
+    return response
+
+
+# -- scenarios -----------------------------------------------------------
+
+def bench_get(client, fakes, name, size, path, repeat, headers=None):
+    latencies = []
+    before = _calls(fakes)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _check(client.get(path, headers=headers))
+        latencies.append(time.perf_counter() - start)
+    return result(name, size, 'n', repeat, latencies, _calls_since(fakes, before))
+
+
+def bench_approve(client, fakes, size, repeat, headers):
+    latencies = []
+    before = _calls(fakes)
+    for i in range(1, repeat + 1):
+        start = time.perf_counter()
+        response = _check(client.post('/api/approve_registration', json={'email': staff_email(i, 'applicant')},
+                                      headers=headers), 202)
+        outcome = wait_for_job(response.get_json()['task_id'])
+        latencies.append(time.perf_counter() - start)
+        if not outcome.get('success'):
+            raise RuntimeError(f'approve_registration: {outcome}')
+    return result('approve_registration', size, '1', repeat, latencies, _calls_since(fakes, before))
+
+
+def bench_upload(client, fakes, size, photo_every, headers, workdir):
+    path = os.path.join(workdir, f'import_{size}.xlsx')
+    build_workbook(path, size, photo_every)
+    before = _calls(fakes)
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        response = _check(client.post('/api/upload_excel', data={'file': (f, 'staff.xlsx')},
+                                      content_type='multipart/form-data', headers=headers), 202)
+    outcome = wait_for_job(response.get_json()['task_id'])
+    elapsed = time.perf_counter() - start
+    if outcome.get('errors'):
+        raise RuntimeError(f'upload_excel: {outcome["errors"][:3]}')
+    return result('upload_excel', size, 'n', size, [elapsed], _calls_since(fakes, before))
+
+
+def bench_bulk_delete(client, fakes, size, staff, headers):
+    from fakes import FakeUserRecord
+    victims = list(staff)[:max(1, size // 2)]
+    # Give half of them login accounts, created directly so it isn't counted
+    for i, staff_id in enumerate(victims[::2]):
+        fakes['auth']._users[f'uid{i}'] = FakeUserRecord(f'uid{i}', staff[staff_id])
+    before = _calls(fakes)
+    start = time.perf_counter()
+    response = _check(client.post('/api/staff/bulk_delete', json={'staff_ids': victims}, headers=headers), 202)
+    outcome = wait_for_job(response.get_json()['task_id'])
+    elapsed = time.perf_counter() - start
+    if outcome.get('errors'):
+        raise RuntimeError(f'bulk_delete_staff: {outcome["errors"][:3]}')
+    return result('bulk_delete_staff', size, 'n', len(victims), [elapsed], _calls_since(fakes, before))
+
+
+def run_size(size, args):
+    """All scenarios for one roster size, in this process"""
+    os.environ.setdefault('PENDING_SHEET_ID', 'benchmark-sheet')
+    os.environ.setdefault('JOB_STORE', 'memory')
+    # The fake sheet has no quota; don't let the client-side limiter pace the timings
+    os.environ.setdefault('SHEETS_QUOTA_PER_MINUTE', '1000000')
+    sys.path.insert(0, ROOT)
+    from fakes import install_fakes
+
+    latency = args.latency_ms / 1000
+    fakes = install_fakes(latency=latency, sheet_rows=registration_rows(args.repeat))
+    add_admin(fakes)
+    staff = seed_staff(fakes, size)
+
+    import app as app_module
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {ADMIN_TOKEN}'}
+
+    results = [
+        bench_get(client, fakes, 'list_staffs', size, '/api/staffs', args.repeat, headers),
+        bench_get(client, fakes, 'list_staffs_page', size, '/api/staffs?limit=50', args.repeat, headers),
+        bench_get(client, fakes, 'get_stats', size, '/api/stats', args.repeat),
+        bench_approve(client, fakes, size, args.repeat, headers),
+    ]
+    with tempfile.TemporaryDirectory() as workdir:
+        results.append(bench_upload(client, fakes, size, args.photo_every, headers, workdir))
+    results.append(bench_bulk_delete(client, fakes, size, staff, headers))
+    # Paged listing doesn't get slower with the roster
+    results[1]['scale'] = '1'
+    return results
+
+
+# -- reporting -----------------------------------------------------------
+
+def growth_failures(results, max_growth, check_time):
+    """Scenarios whose cost grows faster than their expected scale"""
+    failures = []
+    by_scenario = {}
+    for r in results:
+        by_scenario.setdefault(r['scenario'], []).append(r)
+    for name, runs in by_scenario.items():
+        runs.sort(key=lambda r: r['size'])
+        small, large = runs[0], runs[-1]
+        if small['size'] == large['size']:
+            continue
+        expected = large['size'] / small['size'] if small['scale'] == 'n' else 1.0
+        metrics = [('calls_per_op', 'backend calls')]
+        if check_time:
+            metrics.append(('p50_ms', 'p50 latency'))
+        for key, label in metrics:
+            if not small[key]:
+                continue
+            growth = large[key] / small[key] / expected
+            if growth > max_growth:
+                failures.append(f'{name}: {label} grew {growth:.2f}x more than O({small["scale"]}) '
+                                f'from {small["size"]} to {large["size"]} rows')
+    return failures
+
+
+def print_results(results):
+    print(f'{"scenario":22s} {"size":>7s} {"ops":>5s} {"p50 ms":>9s} {"p99 ms":>9s} {"items/s":>10s} {"calls/op":>9s}  backend calls')
+    for r in results:
+        calls = ', '.join(f'{backend} {sum(ops.values())}' for backend, ops in sorted(r['calls'].items()))
+        print(f'{r["scenario"]:22s} {r["size"]:7d} {r["operations"]:5d} {r["p50_ms"]:9.2f} {r["p99_ms"]:9.2f} '
+              f'{r["throughput"] or 0:10.1f} {r["calls_per_op"]:9.2f}  {calls}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline endpoint benchmarks on in-memory fakes')
+    parser.add_argument('--sizes', default='1000,10000', help='comma-separated roster sizes')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='simulated latency per backend round-trip')
+    parser.add_argument('--repeat', type=int, default=50, help='requests per read/approve scenario')
+    parser.add_argument('--photo-every', type=int, default=10, help='embed a photo on every Nth imported row (0: none)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--max-growth', type=float, default=1.5)
+    parser.add_argument('--check-time', action='store_true', help='also fail on latency growth')
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size is not None:
+        # Child process: one size, results as JSON on the last line of stdout
+        results = run_size(args.size, args)
+        print(json.dumps(results))
+        return 0
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        cmd = [sys.executable, os.path.abspath(__file__), '--size', str(size), '--latency-ms', str(args.latency_ms),
+               '--repeat', str(args.repeat), '--photo-every', str(args.photo_every)]
+        with tempfile.TemporaryDirectory() as cwd:
+            # The app creates uploads/ in its working directory
+            proc = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stdout[-2000:] + proc.stderr[-4000:])
+            return proc.returncode
+        results.extend(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    failures = growth_failures(results, args.max_growth, args.check_time)
+    for failure in failures:
+        print(f'REGRESSION: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,636 @@
+# benchmarks/fakes.py
+# In-memory stand-ins for Firestore, Cloud Storage, Firebase Auth and the
+# gspread client, for running the app offline.
+#
+# Each fake counts its round-trips by operation and can sleep a simulated
+# latency per round-trip (a number of seconds, or {operation: seconds}).
+# They implement the subset of the client APIs this app uses; install them
+# with install_fakes() before the app handles any request.
+import base64
+import copy
+import hashlib
+import io
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+
+class FakeBackend:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+
+    def _round_trip(self, op):
+        with self._calls_lock:
+            self.calls[op] += 1
+        delay = self.latency.get(op, 0.0) if isinstance(self.latency, dict) else self.latency
+        if delay:
+            time.sleep(delay)
+
+    def reset_calls(self):
+        with self._calls_lock:
+            self.calls.clear()
+
+
+# -- Firestore -----------------------------------------------------------
+
+def _resolve(data):
+    now = datetime.now(timezone.utc)
+    return {k: (now if v is firestore.SERVER_TIMESTAMP else copy.deepcopy(v)) for k, v in data.items()}
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentReference:
+    def __init__(self, store, collection, doc_id):
+        self._store = store
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f'{self._collection}/{self.id}'
+
+    def _read(self):
+        return self._store._docs(self._collection).get(self.id)
+
+    def get(self, field_paths=None, transaction=None):
+        self._store._round_trip('get')
+        with self._store._lock:
+            return FakeSnapshot(self, copy.deepcopy(self._read()))
+
+    def set(self, data, merge=False):
+        self._store._round_trip('commit')
+        self._store._apply([('set', self, data, merge)])
+
+    def update(self, fields):
+        self._store._round_trip('commit')
+        self._store._apply([('update', self, fields, False)])
+
+    def delete(self):
+        self._store._round_trip('commit')
+        self._store._apply([('delete', self, None, False)])
+
+    def collection(self, name):
+        return FakeCollectionReference(self._store, f'{self.path}/{name}')
+
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+class FakeQuery:
+    def __init__(self, store, collection, filters=(), fields=None, order=None, after=None, count=None):
+        self._store = store
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._fields = fields
+        self._order = order
+        self._after = after
+        self._count = count
+
+    def _replace(self, **changes):
+        state = dict(filters=self._filters, fields=self._fields, order=self._order,
+                     after=self._after, count=self._count)
+        state.update(changes)
+        return FakeQuery(self._store, self._collection, **state)
+
+    def where(self, field, op, value):
+        return self._replace(filters=self._filters + ((field, _OPERATORS[op], value),))
+
+    def select(self, fields):
+        return self._replace(fields=list(fields))
+
+    def order_by(self, field, direction=None):
+        return self._replace(order=field)
+
+    def start_after(self, values):
+        if isinstance(values, FakeSnapshot):
+            return self._replace(after=self._key((values.id, values._data or {})))
+        ref = values.get('__name__')
+        return self._replace(after=ref.id if hasattr(ref, 'id') else ref)
+
+    def limit(self, count):
+        return self._replace(count=count)
+
+    def _key(self, item):
+        doc_id, data = item
+        if self._order in (None, '__name__'):
+            return doc_id
+        return (data.get(self._order) is None, data.get(self._order), doc_id)
+
+    def stream(self, transaction=None):
+        self._store._round_trip('run_query')
+        with self._store._lock:
+            items = [
+                (doc_id, data) for doc_id, data in self._store._docs(self._collection).items()
+                if all(op(data.get(field), value) for field, op, value in self._filters)
+            ]
+            items.sort(key=self._key)
+            if self._after is not None:
+                items = [(d, v) for d, v in items if self._key((d, v)) > self._after]
+            if self._count is not None:
+                items = items[:self._count]
+            results = []
+            for doc_id, data in items:
+                if self._fields is not None:
+                    data = {f: data[f] for f in self._fields if f in data}
+                ref = FakeDocumentReference(self._store, self._collection, doc_id)
+                results.append(FakeSnapshot(ref, copy.deepcopy(data)))
+        return iter(results)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        # No watch stream: staff_cache falls back to a TTL reload
+        raise NotImplementedError('FakeFirestore has no listeners')
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, store, name):
+        super().__init__(store, name)
+        self.id = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._store, self._collection, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class FakeWriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, merge))
+
+    def update(self, reference, fields):
+        self._writes.append(('update', reference, fields, False))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self):
+        self._store._round_trip('commit')
+        writes, self._writes = self._writes, []
+        self._store._apply(writes)
+        return writes
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Runs under @firestore.transactional: implements the private hooks the
+    decorator calls. Transactions are serialised on the store lock.
+    """
+    _read_only = False
+    _max_attempts = 1
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._id = None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._store._round_trip('begin_transaction')
+        self._store._lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        try:
+            self.commit()
+        finally:
+            self._release()
+
+    def _rollback(self):
+        self._writes = []
+        self._release()
+
+    def _release(self):
+        if self._id is not None:
+            self._id = None
+            self._store._lock.release()
+
+    def get(self, ref_or_query):
+        return ref_or_query.get()
+
+
+class FakeFirestore(FakeBackend):
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self._lock = threading.RLock()
+        self._collections = {}
+
+    def _docs(self, collection):
+        return self._collections.setdefault(collection, {})
+
+    def _apply(self, writes):
+        with self._lock:
+            for kind, ref, data, merge in writes:
+                docs = self._docs(ref._collection)
+                if kind == 'delete':
+                    docs.pop(ref.id, None)
+                elif kind == 'update':
+                    if ref.id not in docs:
+                        raise KeyError(f'No document to update: {ref.path}')
+                    docs[ref.id] = dict(docs[ref.id], **_resolve(data))
+                elif merge and ref.id in docs:
+                    docs[ref.id] = dict(docs[ref.id], **_resolve(data))
+                else:
+                    docs[ref.id] = _resolve(data)
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        self._round_trip('batch_get')
+        with self._lock:
+            return [FakeSnapshot(ref, copy.deepcopy(ref._read())) for ref in references]
+
+    def seed(self, collection, docs):
+        """Load {doc_id: data} without counting round-trips"""
+        with self._lock:
+            self._docs(collection).update({k: _resolve(v) for k, v in docs.items()})
+
+    def count(self, collection):
+        with self._lock:
+            return len(self._docs(collection))
+
+
+# -- Cloud Storage -------------------------------------------------------
+
+class _BlobWriter(io.BytesIO):
+    def __init__(self, blob):
+        super().__init__()
+        self._blob = blob
+
+    def close(self):
+        if not self.closed:
+            self._blob._store(self.getvalue())
+        super().close()
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = None
+        self.content_type = None
+
+    @property
+    def public_url(self):
+        return f'https://storage.googleapis.com/{self.bucket.name}/{self.name}'
+
+    @property
+    def _object(self):
+        return self.bucket._objects.get(self.name)
+
+    @property
+    def md5_hash(self):
+        obj = self._object
+        return base64.b64encode(hashlib.md5(obj).digest()).decode('ascii') if obj is not None else None
+
+    @property
+    def size(self):
+        obj = self._object
+        return len(obj) if obj is not None else None
+
+    @property
+    def time_created(self):
+        return self.bucket._created.get(self.name)
+
+    def _store(self, data):
+        self.bucket._round_trip('upload')
+        with self.bucket._lock:
+            self.bucket._objects[self.name] = bytes(data)
+            self.bucket._created[self.name] = datetime.now(timezone.utc)
+
+    def upload_from_string(self, data, content_type=None):
+        self.content_type = content_type
+        self._store(data.encode('utf-8') if isinstance(data, str) else data)
+
+    def open(self, mode='rb', chunk_size=None, content_type=None, **kwargs):
+        if 'w' in mode:
+            self.content_type = content_type
+            return _BlobWriter(self)
+        self.bucket._round_trip('download')
+        return io.BytesIO(self._object or b'')
+
+    def download_as_bytes(self):
+        self.bucket._round_trip('download')
+        return self._object
+
+    def make_public(self):
+        self.bucket._round_trip('acl')
+
+    def exists(self):
+        self.bucket._round_trip('get')
+        return self._object is not None
+
+    def reload(self):
+        self.bucket._round_trip('get')
+
+    def delete(self):
+        self.bucket._round_trip('delete')
+        with self.bucket._lock:
+            self.bucket._objects.pop(self.name, None)
+            self.bucket._created.pop(self.name, None)
+
+
+class FakeBucket(FakeBackend):
+    def __init__(self, name='fake-bucket', latency=0.0):
+        super().__init__(latency)
+        self.name = name
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._created = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix=''):
+        self._round_trip('list')
+        with self._lock:
+            return [FakeBlob(self, name) for name in sorted(self._objects) if name.startswith(prefix)]
+
+    def get_blob(self, name):
+        self._round_trip('get')
+        with self._lock:
+            return FakeBlob(self, name) if name in self._objects else None
+
+    def copy_blob(self, blob, destination_bucket, new_name):
+        self._round_trip('copy')
+        with self._lock:
+            destination_bucket._objects[new_name] = self._objects[blob.name]
+            destination_bucket._created[new_name] = datetime.now(timezone.utc)
+        return FakeBlob(destination_bucket, new_name)
+
+
+# -- Firebase Auth -------------------------------------------------------
+
+class UserNotFoundError(Exception):
+    pass
+
+
+class EmailAlreadyExistsError(Exception):
+    pass
+
+
+class EmailIdentifier:
+    def __init__(self, email):
+        self.email = email
+
+
+class UidIdentifier:
+    def __init__(self, uid):
+        self.uid = uid
+
+
+class FakeUserRecord:
+    def __init__(self, uid, email, custom_claims=None):
+        self.uid = uid
+        self.email = email
+        self.custom_claims = custom_claims
+
+
+class _GetUsersResult:
+    def __init__(self, users, not_found):
+        self.users = users
+        self.not_found = not_found
+
+
+class _DeleteUsersResult:
+    def __init__(self, success_count):
+        self.success_count = success_count
+        self.failure_count = 0
+        self.errors = []
+
+
+class FakeAuth(FakeBackend):
+    """Stands in for the firebase_admin.auth module"""
+    UserNotFoundError = UserNotFoundError
+    EmailAlreadyExistsError = EmailAlreadyExistsError
+    EmailIdentifier = EmailIdentifier
+    UidIdentifier = UidIdentifier
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self._lock = threading.Lock()
+        self._users = {}
+        self._tokens = {}
+
+    def add_token(self, token, uid, **claims):
+        """Make verify_id_token(token) succeed, e.g. add_token('t', 'admin', isAdmin=True)"""
+        self._tokens[token] = dict(claims, uid=uid)
+
+    def verify_id_token(self, id_token, check_revoked=False):
+        # Real verification is local once the public keys are cached
+        decoded = self._tokens.get(id_token)
+        if decoded is None:
+            raise ValueError('Invalid token')
+        return dict(decoded, exp=time.time() + 3600)
+
+    def create_user(self, email=None, password=None, uid=None, **kwargs):
+        self._round_trip('create_user')
+        with self._lock:
+            if any(u.email == email for u in self._users.values()):
+                raise EmailAlreadyExistsError(email)
+            user = FakeUserRecord(uid or uuid.uuid4().hex[:28], email)
+            self._users[user.uid] = user
+            return user
+
+    def get_user(self, uid):
+        self._round_trip('get_user')
+        with self._lock:
+            if uid not in self._users:
+                raise UserNotFoundError(uid)
+            return self._users[uid]
+
+    def get_user_by_email(self, email):
+        self._round_trip('get_user')
+        with self._lock:
+            for user in self._users.values():
+                if user.email == email:
+                    return user
+        raise UserNotFoundError(email)
+
+    def get_users(self, identifiers):
+        self._round_trip('get_users')
+        with self._lock:
+            by_email = {(u.email or '').lower(): u for u in self._users.values()}
+            users, not_found = [], []
+            for identifier in identifiers:
+                user = (by_email.get(identifier.email.lower()) if hasattr(identifier, 'email')
+                        else self._users.get(identifier.uid))
+                (users if user is not None else not_found).append(user or identifier)
+            return _GetUsersResult(users, not_found)
+
+    def set_custom_user_claims(self, uid, custom_claims):
+        self._round_trip('update_user')
+        with self._lock:
+            self._users[uid].custom_claims = custom_claims
+
+    def delete_user(self, uid):
+        self._round_trip('delete_user')
+        with self._lock:
+            if self._users.pop(uid, None) is None:
+                raise UserNotFoundError(uid)
+
+    def delete_users(self, uids):
+        self._round_trip('delete_users')
+        with self._lock:
+            removed = sum(1 for uid in uids if self._users.pop(uid, None) is not None)
+        return _DeleteUsersResult(removed)
+
+
+# -- Google Sheets (gspread) ---------------------------------------------
+
+_RANGE_RE = re.compile(r'^([A-Z]+)(\d+):([A-Z]+)(\d*)$')
+
+
+def _column_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + ord(ch) - 64
+    return index - 1
+
+
+class FakeWorksheet:
+    id = 0
+    title = 'Sheet1'
+
+    def __init__(self, client, rows):
+        self._client = client
+        self._rows = [list(r) for r in rows]
+        self.spreadsheet = None
+
+    def row_values(self, row):
+        self._client._round_trip('values_get')
+        with self._client._lock:
+            values = list(self._rows[row - 1]) if 0 < row <= len(self._rows) else []
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def batch_get(self, ranges):
+        self._client._round_trip('values_batch_get')
+        result = []
+        with self._client._lock:
+            for a1 in ranges:
+                first_col, first_row, _, last_row = _RANGE_RE.match(a1).groups()
+                col = _column_index(first_col)
+                end = int(last_row) if last_row else len(self._rows)
+                result.append([
+                    [row[col]] if col < len(row) and row[col] != '' else []
+                    for row in self._rows[int(first_row) - 1:end]
+                ])
+        return result
+
+    def get_all_values(self):
+        self._client._round_trip('values_get')
+        with self._client._lock:
+            return [list(r) for r in self._rows]
+
+    def append_row(self, values, **kwargs):
+        self._client._round_trip('values_append')
+        with self._client._lock:
+            self._rows.append([str(v) for v in values])
+            row = len(self._rows)
+        return {'updates': {'updatedRange': f'{self.title}!A{row}:Z{row}'}}
+
+    def delete_rows(self, start_index, end_index=None):
+        self._client._round_trip('batch_update')
+        with self._client._lock:
+            del self._rows[start_index - 1:(end_index or start_index)]
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, worksheet):
+        self._client = client
+        self.sheet1 = worksheet
+        worksheet.spreadsheet = self
+
+    def batch_update(self, body):
+        self._client._round_trip('batch_update')
+        with self._client._lock:
+            for request in body.get('requests', []):
+                span = request['deleteDimension']['range']
+                del self.sheet1._rows[span['startIndex']:span['endIndex']]
+        return {}
+
+
+class FakeSheetsClient(FakeBackend):
+    """Stands in for an authorized gspread client with one spreadsheet"""
+
+    def __init__(self, header, rows=(), latency=0.0):
+        super().__init__(latency)
+        self._lock = threading.RLock()
+        self.spreadsheet = FakeSpreadsheet(self, FakeWorksheet(self, [list(header)] + [list(r) for r in rows]))
+
+    def open_by_key(self, key):
+        self._round_trip('open_by_key')
+        return self.spreadsheet
+
+
+# -- wiring --------------------------------------------------------------
+
+def install_fakes(latency=0.0, sheet_header=None, sheet_rows=()):
+    """
+    Point firebase_config and the Sheets gateway at fresh fakes; returns
+    {'firestore', 'storage', 'auth', 'sheets'}.
+    """
+    import firebase_config
+    from sheets_gateway import sheets_gateway
+    from registrations import SHEET_COLUMNS
+
+    fakes = {
+        'firestore': FakeFirestore(latency),
+        'storage': FakeBucket(latency=latency),
+        'auth': FakeAuth(latency),
+        'sheets': FakeSheetsClient(sheet_header or SHEET_COLUMNS, sheet_rows, latency),
+    }
+    firebase_config.use_backends(fakes['firestore'], fakes['storage'], fakes['auth'])
+    sheets_gateway.use_client(fakes['sheets'])
+    return fakes
@@ -0,0 +1,78 @@
+# benchmarks/startup.py
+# Startup cost of the app: time to `import app` and latency of the first
+# and second request, each run in a fresh interpreter.
+#
+#   python benchmarks/startup.py [--runs 5] [--path /login] [--importtime]
+#
+# Uses only routes that don't touch Firestore, so it runs without
+# FIREBASE_CONFIG. --importtime also prints the slowest imports of one run.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = '''
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+client = app.app.test_client()
+first = client.get(sys.argv[1])
+t2 = time.perf_counter()
+client.get(sys.argv[1])
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "first_request": t2 - t1, "second_request": t3 - t2,
+                  "status": first.status_code}))
+'''
+
+
+def run_once(path, importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X', 'importtime']
+    cmd += ['-c', _PROBE, path]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    # The app creates uploads/ in its working directory
+    with tempfile.TemporaryDirectory() as cwd:
+        result = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, top=15):
+    rows = []
+    for line in stderr.splitlines():
+        # import time: <self us> | <cumulative us> | <module>
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/login')
+    parser.add_argument('--importtime', action='store_true')
+    args = parser.parse_args()
+
+    samples = [run_once(args.path)[0] for _ in range(args.runs)]
+    print(f'{args.runs} runs, GET {args.path} -> {samples[0]["status"]}')
+    for key in ('import', 'first_request', 'second_request'):
+        values = [s[key] * 1000 for s in samples]
+        print(f'  {key:15s} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms   max {max(values):8.1f} ms')
+
+    if args.importtime:
+        _, stderr = run_once(args.path, importtime=True)
+        print('\nslowest imports (cumulative us, self us, module):')
+        for cumulative, own, name in slowest_imports(stderr):
+            print(f'  {cumulative:10d} {own:10d}  {name}')
+
+
+if __name__ == '__main__':
+    main()
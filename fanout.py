@@ -0,0 +1,123 @@
+# fanout.py
+# Run independent backend calls of one request concurrently.
+#
+# gather() submits zero-argument callables to a bounded, process-wide
+# thread pool and waits for all of them, but never past the request's
+# deadline (REQUEST_DEADLINE seconds from the start of the request, set by
+# init_app). Tasks run in a copy of the caller's context, so they see the
+# same deadline and Flask request/g, and a nested gather() from inside a
+# task runs its calls inline instead of waiting on the pool it occupies.
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import g
+
+FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', '32'))
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', '20'))
+
+_deadline = contextvars.ContextVar('fanout_deadline', default=None)
+_in_worker = threading.local()
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request ran out of time while waiting on backend calls."""
+
+
+def _get_executor():
+    # Created on first use and again after a fork: threads don't survive it
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout',
+                                           initializer=_mark_worker)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _mark_worker():
+    _in_worker.active = True
+
+
+# -- deadlines -----------------------------------------------------------
+
+def remaining():
+    """Seconds left before the current deadline, or None without one"""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def set_deadline(seconds):
+    """Start a deadline `seconds` from now (never extending an earlier one); returns a reset token"""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    return _deadline.set(deadline if current is None else min(current, deadline))
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+# -- fan-out -------------------------------------------------------------
+
+def gather(*calls, timeout=None, return_exceptions=False):
+    """
+    Run `calls` concurrently and return their results in order.
+    With return_exceptions the exception a call raised takes its place in
+    the results; otherwise the first one (in argument order) is re-raised
+    once all calls have finished. Raises DeadlineExceeded if `timeout` or
+    the request deadline passes first; calls still running are abandoned
+    and their results discarded.
+    """
+    if getattr(_in_worker, 'active', False) or len(calls) < 2:
+        outcomes = []
+        for call in calls:
+            try:
+                outcomes.append((True, call()))
+            except Exception as e:
+                outcomes.append((False, e))
+    else:
+        executor = _get_executor()
+        futures = [executor.submit(contextvars.copy_context().run, call) for call in calls]
+        limit = remaining()
+        if timeout is not None:
+            limit = timeout if limit is None else min(limit, timeout)
+        done, pending = wait(futures, timeout=limit)
+        if pending:
+            for future in pending:
+                future.cancel()
+            raise DeadlineExceeded(f'{len(pending)} of {len(futures)} backend calls did not finish in time')
+        outcomes = [(f.exception() is None, f.exception() or f.result()) for f in futures]
+
+    results = []
+    for ok, value in outcomes:
+        if not ok and not return_exceptions:
+            raise value
+        results.append(value)
+    return results
+
+
+# -- Flask wiring --------------------------------------------------------
+
+def _start_request_deadline():
+    g.fanout_deadline_token = set_deadline(REQUEST_DEADLINE)
+
+
+def _end_request_deadline(error=None):
+    token = g.pop('fanout_deadline_token', None)
+    if token is not None:
+        try:
+            reset_deadline(token)
+        except ValueError:
+            # Teardown can run in a different context than before_request
+            pass
+
+
+def init_app(app):
+    app.before_request(_start_request_deadline)
+    app.teardown_request(_end_request_deadline)
@@ -1,22 +1,149 @@
 import os
 import json
+import threading
 import firebase_admin
-from firebase_admin import credentials, firestore, storage
+from firebase_admin import credentials, auth as firebase_auth
+from metrics import instrument_firestore, timed_session, TimedModule
 
-# 1. Load and parse the config with error handling
-firebase_config = json.loads(os.environ["FIREBASE_CONFIG"])
+# Firebase is initialised on first use rather than at import, and every
+# process builds its own Firestore/Storage clients: gRPC channels created
+# before gunicorn forks must not be shared by the workers.
 
-# 2. Fix newlines in private key if they were escaped (for Render env vars)
-if '\\n' in firebase_config['private_key']:
-    firebase_config['private_key'] = firebase_config['private_key'].replace('\\n', '\n')
+STORAGE_BUCKET = 'college-staff-manager.firebasestorage.app'  # ← Must match your bucket
 
-# 3. Initialize Firebase (only once)
-if not firebase_admin._apps:
-    cred = credentials.Certificate(firebase_config)
-    firebase_admin.initialize_app(cred, {
-        'storageBucket': 'college-staff-manager.firebasestorage.app'  # ← Must match your bucket
-    })
 
-# 4. Create clients
-db = firestore.client()
-bucket = storage.bucket()
\ No newline at end of file
+def _load_config():
+    # 1. Load and parse the config with error handling
+    firebase_config = json.loads(os.environ["FIREBASE_CONFIG"])
+
+    # 2. Fix newlines in private key if they were escaped (for Render env vars)
+    if '\\n' in firebase_config['private_key']:
+        firebase_config['private_key'] = firebase_config['private_key'].replace('\\n', '\n')
+    return firebase_config
+
+
+_app_lock = threading.Lock()
+
+
+def get_app():
+    # 3. Initialize Firebase (only once)
+    with _app_lock:
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(_load_config())
+            firebase_admin.initialize_app(cred, {'storageBucket': STORAGE_BUCKET})
+        return firebase_admin.get_app()
+
+
+class PerProcess:
+    """A value built on first use and rebuilt after a fork"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._value = self._factory()
+                    self._pid = pid
+        return self._value
+
+    def reset(self, factory=None):
+        with self._lock:
+            if factory is not None:
+                self._factory = factory
+            self._value = None
+            self._pid = None
+
+
+class LazyProxy:
+    """Forwards attribute access to a PerProcess value"""
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_lazy_value', PerProcess(factory))
+
+    def __getattr__(self, name):
+        return getattr(object.__getattribute__(self, '_lazy_value').get(), name)
+
+    def __repr__(self):
+        return f'<LazyProxy {object.__getattribute__(self, "_lazy_value")._factory!r}>'
+
+
+def _firestore_client():
+    # Built directly: firestore.client() caches one client per app, which
+    # a forked worker would inherit from the parent
+    from google.cloud import firestore as gcloud_firestore
+    app = get_app()
+    client = gcloud_firestore.Client(project=app.project_id, credentials=app.credential.get_credential())
+    return instrument_firestore(client)
+
+
+def _storage_bucket():
+    from google.cloud import storage as gcloud_storage
+    app = get_app()
+    credential = app.credential.get_credential()
+    client = gcloud_storage.Client(project=app.project_id, credentials=credential, _http=timed_session(credential))
+    return client.bucket(app.options.get('storageBucket'))
+
+
+# 4. Create clients (lazily, once per process)
+db = LazyProxy(_firestore_client)
+bucket = LazyProxy(_storage_bucket)
+
+
+class _TimedAuth(TimedModule):
+    def __getattr__(self, name):
+        if self._module is firebase_auth:
+            get_app()
+        return super().__getattr__(name)
+
+
+# firebase_admin.auth with the default app initialised and every call timed
+auth = _TimedAuth(firebase_auth, 'auth')
+
+
+class LazyRef:
+    """
+    Forwards attribute access to a reference rebuilt from `db` on each use,
+    so module-level references neither create the client at import nor
+    outlive a fork or a use_backends() switch.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+
+    def __getattr__(self, name):
+        return getattr(object.__getattribute__(self, '_factory')(), name)
+
+
+def lazy_collection(name):
+    """A collection reference that doesn't create the client until used"""
+    return LazyRef(lambda: db.collection(name))
+
+
+def lazy_document(collection, doc_id):
+    return LazyRef(lambda: db.collection(collection).document(doc_id))
+
+
+def init_clients():
+    """Create this process's clients now, e.g. from gunicorn's post_fork hook"""
+    for proxy in (db, bucket):
+        object.__getattribute__(proxy, '_lazy_value').get()
+
+
+def use_backends(firestore_client=None, storage_bucket=None, auth_module=None):
+    """
+    Replace the clients for this process, e.g. with the fakes in
+    benchmarks/fakes.py. References already handed out (the `db`/`bucket`
+    proxies, lazy collections and documents) follow the switch.
+    """
+    if firestore_client is not None:
+        object.__getattribute__(db, '_lazy_value').reset(lambda: firestore_client)
+    if storage_bucket is not None:
+        object.__getattribute__(bucket, '_lazy_value').reset(lambda: storage_bucket)
+    if auth_module is not None:
+        auth.use_module(auth_module)
@@ -0,0 +1,74 @@
+# gunicorn.conf.py
+# Picked up by `gunicorn app:app` (see Procfile). Every setting can be
+# overridden from the environment without editing this file.
+#
+# Handlers spend most of their time waiting on Firestore, Auth, Storage and
+# Sheets, so the default is the threaded (gthread) worker: each process
+# serves GUNICORN_THREADS requests at once and they share one staff cache,
+# search index and set of clients. The Firebase gRPC/HTTP clients are
+# thread-safe; they are created after the fork (post_fork below), which is
+# what gRPC requires. gevent is not supported: it would need grpc's gevent
+# integration and monkey-patching of the job and photo-upload thread pools.
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Threads make up the concurrency, so a few processes are enough; each one
+# keeps its own copy of the staff roster in memory
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count() + 1)))
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+
+# Long enough for a streamed /api/upload_file of the maximum size; imports
+# and bulk operations run as background jobs, not inside the request
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+# Heartbeat files on tmpfs; a slow container disk can otherwise stall workers
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Import the app once in the master so workers fork with Flask, the routes
+# and the heavy libraries already loaded. Nothing in app.py opens a
+# Firebase/Sheets connection at import, so no client is shared across the fork.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')  # e.g. '-' for stdout
+
+# Workers share their metrics through this directory so /metrics covers all
+# of them; set before the app (and metrics.py) is imported
+own_metrics_dir = 'METRICS_DIR' not in os.environ
+if own_metrics_dir:
+    os.environ['METRICS_DIR'] = os.path.join(
+        '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), f'mace-metrics-{os.getpid()}')
+
+
+def on_starting(server):
+    import metrics
+    metrics.reset_metrics_dir()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if own_metrics_dir:
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+
+def post_fork(server, worker):
+    # Each worker builds its own Firestore/Storage clients before it takes
+    # requests, so the first request doesn't pay for it
+    from firebase_config import init_clients
+    from sheets_gateway import sheets_gateway
+    # The Sheets quota is per project: every worker gets an equal share
+    sheets_gateway.share_quota(server.cfg.workers)
+    try:
+        init_clients()
+    except Exception as e:
+        # The clients are retried on first use
+        server.log.warning(f"Worker {worker.pid}: Firebase client init failed: {e}")
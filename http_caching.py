@@ -0,0 +1,188 @@
+# http_caching.py
+# HTTP caching helpers: ETags derived from the staff data, per-endpoint
+# Cache-Control, gzip/brotli compression of large text responses and
+# fingerprinted URLs for files under static/.
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import request, make_response, current_app
+from werkzeug.security import safe_join
+
+from staff_cache import staff_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Cache-Control policies
+STAFF_DATA_CACHE_CONTROL = 'private, no-cache'
+SEARCH_CACHE_CONTROL = 'private, max-age=30'
+STATIC_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+STATIC_CACHE_CONTROL = 'public, max-age=3600'
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = ('application/json', 'text/html', 'text/css', 'application/javascript', 'text/plain')
+COMPRESSED_CACHE_SIZE = 32
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+_FINGERPRINT_RE = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{10})(?P<ext>\.[A-Za-z0-9]+)$')
+
+_compressed = OrderedDict()
+_fingerprints = {}
+_lock = threading.Lock()
+
+
+# -- ETags ---------------------------------------------------------------
+
+def _digest_rows(rows):
+    body = json.dumps(sorted(rows, key=lambda s: s['id']), sort_keys=True, default=str)
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def staff_data_digest():
+    """
+    Content hash of the staff collection, recomputed once per cache
+    version. Unlike the version counter it is the same on every worker.
+    None when the staff cache is switched off.
+    """
+    return staff_cache.memoize('digest', _digest_rows)
+
+
+def conditional_staff_response(cache_control):
+    """
+    For GET endpoints whose body depends only on the staff collection and
+    the query string: sets a weak ETag and `cache_control`, and answers a
+    matching If-None-Match with 304 before the view runs. Put it below the
+    auth decorator so unauthenticated requests are still rejected.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            digest = staff_data_digest()
+            etag = None
+            if digest is not None:
+                query = urlencode(sorted(request.args.items(multi=True)))
+                etag = hashlib.sha1(f'{digest}|{request.path}?{query}'.encode('utf-8')).hexdigest()[:24]
+                if request.if_none_match.contains_weak(etag):
+                    response = current_app.response_class(status=304)
+                    response.set_etag(etag, weak=True)
+                    response.headers['Cache-Control'] = cache_control
+                    return response
+
+            response = make_response(fn(*args, **kwargs))
+            if response.status_code == 200:
+                if etag is not None:
+                    response.set_etag(etag, weak=True)
+                response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+
+# -- compression ---------------------------------------------------------
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response):
+    """after_request hook: brotli/gzip for large text responses"""
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        encoding = 'br'
+    elif accepted['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    # Responses with an ETag are the big, repeated ones; keep their encoded bodies
+    etag = response.get_etag()[0]
+    key = (etag, encoding) if etag else None
+    body = None
+    if key is not None:
+        with _lock:
+            body = _compressed.get(key)
+            if body is not None:
+                _compressed.move_to_end(key)
+    if body is None:
+        body = _compress(data, encoding)
+        if key is not None:
+            with _lock:
+                _compressed[key] = body
+                while len(_compressed) > COMPRESSED_CACHE_SIZE:
+                    _compressed.popitem(last=False)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# -- static files --------------------------------------------------------
+
+def static_fingerprint(filename):
+    """Short content hash of a file under static/, or None if it doesn't exist"""
+    path = safe_join(STATIC_FOLDER, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _fingerprints.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    fingerprint = digest.hexdigest()[:10]
+    with _lock:
+        _fingerprints[path] = (key, fingerprint)
+    return fingerprint
+
+
+def static_url(filename):
+    """/static URL with the content hash in the name, e.g. images/hero.<hash>.png"""
+    fingerprint = static_fingerprint(filename)
+    if fingerprint is None:
+        return f'/static/{filename}'
+    stem, ext = os.path.splitext(filename)
+    return f'/static/{stem}.{fingerprint}{ext}'
+
+
+def resolve_static(filename):
+    """
+    Map a requested static path to (real_filename, cache_control).
+    Fingerprinted names that match the current content are immutable.
+    """
+    match = _FINGERPRINT_RE.match(filename)
+    path = safe_join(STATIC_FOLDER, filename)
+    if match is None or (path is not None and os.path.isfile(path)):
+        return filename, STATIC_CACHE_CONTROL
+    real_name = match.group('stem') + match.group('ext')
+    if static_fingerprint(real_name) == match.group('hash'):
+        return real_name, STATIC_IMMUTABLE_CACHE_CONTROL
+    # An old fingerprint: serve the current file, but don't pin it
+    return real_name, STATIC_CACHE_CONTROL
@@ -0,0 +1,325 @@
+# jobs.py
+# Background jobs for work that is too slow for a gunicorn request
+# (Excel imports, bulk deletes, registration approvals).
+#
+# A job is registered by kind with @job_handler and started with enqueue(),
+# which returns a job ID straight away. Job state lives in a store that every
+# worker can read, so /api/upload_progress/<task_id> works whichever worker
+# serves it:
+#   JOB_STORE=firestore (default)  jobs/{id} documents
+#   JOB_STORE=memory               per-process dict, for local runs
+# Jobs run on a backend:
+#   JOB_BACKEND=thread (default)   in-process thread pool
+#   JOB_BACKEND=rq                 Redis queue (needs `rq`, REDIS_URL and an
+#                                  `rq worker mace-jobs` process that shares
+#                                  UPLOAD_FOLDER with the web workers)
+import importlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+from firebase_config import db
+
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'thread')
+JOB_STORE = os.environ.get('JOB_STORE', 'firestore')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', '3600'))
+# Module that registers the handlers, imported by rq workers on first use
+JOB_HANDLER_MODULE = os.environ.get('JOB_HANDLER_MODULE', 'app')
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+# Progress writes and cancellation checks are throttled to this interval
+PROGRESS_INTERVAL = 1.0
+# Job documents must stay under Firestore's 1 MiB limit: lists in a result
+# (per-row errors, chunks, ...) are cut to this many items when stored
+RESULT_LIST_LIMIT = int(os.environ.get('JOB_RESULT_LIST_LIMIT', '200'))
+MAX_ERROR_LENGTH = 1000
+# Bulky job output (e.g. an import preview) is kept next to the job document,
+# split into documents of this many entries
+JOB_DATA_CHUNK = 2000
+
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+_handlers = {}
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once cancellation has been requested."""
+
+
+def job_handler(kind):
+    """Register fn(ctx, **payload) -> result dict as the handler for `kind`"""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+# -- state stores --------------------------------------------------------
+
+class MemoryJobStore:
+    """Local stand-in for the Firestore store; keeps the most recent jobs"""
+
+    def __init__(self, max_jobs=500):
+        self._jobs = OrderedDict()
+        self._data = {}
+        self._lock = threading.Lock()
+        self.max_jobs = max_jobs
+
+    def create(self, job_id, fields):
+        with self._lock:
+            self._jobs[job_id] = dict(fields, updatedAt=time.time())
+            while len(self._jobs) > self.max_jobs:
+                evicted, _ = self._jobs.popitem(last=False)
+                self._data.pop(evicted, None)
+
+    def update(self, job_id, fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields, updatedAt=time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def put_data(self, job_id, name, mapping):
+        with self._lock:
+            if job_id in self._jobs:
+                self._data.setdefault(job_id, {})[name] = dict(mapping)
+
+    def get_data(self, job_id, name):
+        with self._lock:
+            mapping = self._data.get(job_id, {}).get(name)
+            return dict(mapping) if mapping is not None else None
+
+
+class FirestoreJobStore:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def create(self, job_id, fields):
+        self._collection.document(job_id).set(dict(fields, updatedAt=firestore.SERVER_TIMESTAMP))
+
+    def update(self, job_id, fields):
+        self._collection.document(job_id).update(dict(fields, updatedAt=firestore.SERVER_TIMESTAMP))
+
+    def get(self, job_id):
+        doc = self._collection.document(job_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def put_data(self, job_id, name, mapping):
+        # jobs/{id}/{name}/{n}: parallel key/value arrays, so keys needn't be valid field names
+        items = sorted(mapping.items())
+        chunks = self._collection.document(job_id).collection(name)
+        # An empty mapping still gets a (first, empty) document
+        for n, start in enumerate(range(0, max(len(items), 1), JOB_DATA_CHUNK)):
+            part = items[start:start + JOB_DATA_CHUNK]
+            chunks.document(str(n)).set({'keys': [k for k, _ in part], 'values': [v for _, v in part]})
+
+    def get_data(self, job_id, name):
+        """The stored mapping, or None if nothing was stored"""
+        mapping = None
+        for doc in self._collection.document(job_id).collection(name).stream():
+            data = doc.to_dict()
+            mapping = mapping if mapping is not None else {}
+            mapping.update(zip(data.get('keys', ()), data.get('values', ())))
+        return mapping
+
+
+# -- execution -----------------------------------------------------------
+
+class JobContext:
+    """Handed to job handlers for progress reporting and cancellation"""
+
+    def __init__(self, store, job_id):
+        self._store = store
+        self.job_id = job_id
+        self._last_write = 0.0
+        self._last_cancel_check = 0.0
+        self._cancelled = False
+
+    def progress(self, done, total=None, message=None, force=False):
+        """Record row-level progress; also the point where cancellation is noticed"""
+        self.check_cancelled()
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        fields = {'processed': done, 'total': total}
+        if total:
+            # 100 is reserved for the finished state
+            fields['progress'] = min(99, int(done * 100 / total))
+        if message:
+            fields['message'] = message
+        self._store.update(self.job_id, fields)
+
+    def cancelled(self):
+        if not self._cancelled:
+            now = time.monotonic()
+            if now - self._last_cancel_check >= PROGRESS_INTERVAL:
+                self._last_cancel_check = now
+                job = self._store.get(self.job_id) or {}
+                self._cancelled = bool(job.get('cancelRequested'))
+        return self._cancelled
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise JobCancelled()
+
+    def save_data(self, name, mapping):
+        """Keep a mapping too big for the job result next to the job (see load_job_data)"""
+        self._store.put_data(self.job_id, name, mapping)
+
+
+def _compact(value, limit=RESULT_LIST_LIMIT):
+    """Copy of a result with every list cut to `limit` items; '<key>Omitted' counts what was cut"""
+    if isinstance(value, dict):
+        compacted = {}
+        for key, item in value.items():
+            if isinstance(item, list) and len(item) > limit:
+                compacted[f'{key}Omitted'] = len(item) - limit
+                item = item[:limit]
+            compacted[key] = _compact(item, limit)
+        return compacted
+    if isinstance(value, list):
+        return [_compact(item, limit) for item in value]
+    return value
+
+
+def _finish(store, job_id, fields):
+    """
+    Write a job's final state. If that fails (e.g. a result over the
+    Firestore document limit) the job is marked failed instead, so it
+    doesn't stay 'running' forever.
+    """
+    try:
+        store.update(job_id, dict(fields, finishedAt=time.time()))
+    except Exception as e:
+        print(f"Job {job_id}: could not save final state: {e}")
+        try:
+            store.update(job_id, {'status': 'failed', 'message': 'Failed', 'finishedAt': time.time(),
+                                  'error': f'Could not save the job result: {str(e)[:MAX_ERROR_LENGTH]}'})
+        except Exception as e:
+            print(f"Job {job_id}: could not mark the job failed: {e}")
+
+
+def run_job(job_id, kind, payload):
+    """Execute a queued job; called by every backend"""
+    store = get_store()
+    if kind not in _handlers:
+        importlib.import_module(JOB_HANDLER_MODULE)
+    ctx = JobContext(store, job_id)
+    if ctx.cancelled():
+        store.update(job_id, {'status': 'cancelled', 'message': 'Cancelled before start'})
+        return
+    store.update(job_id, {'status': 'running', 'startedAt': time.time()})
+    try:
+        result = _handlers[kind](ctx, **payload)
+    except JobCancelled:
+        _finish(store, job_id, {'status': 'cancelled', 'message': 'Cancelled'})
+    except Exception as e:
+        print(f"Job {job_id} ({kind}) failed: {e}")
+        _finish(store, job_id, {'status': 'failed', 'error': str(e)[:MAX_ERROR_LENGTH], 'message': 'Failed'})
+    else:
+        _finish(store, job_id, {'status': 'completed', 'progress': 100, 'message': 'Done',
+                                'result': _compact(result)})
+
+
+class ThreadJobBackend:
+    def __init__(self, max_workers=JOB_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, kind, payload):
+        # Created on first use so no threads exist before gunicorn forks
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        self._executor.submit(run_job, job_id, kind, payload)
+
+
+class RqJobBackend:
+    def __init__(self, redis_url=REDIS_URL, queue_name='mace-jobs'):
+        from redis import Redis
+        from rq import Queue
+        self._queue = Queue(queue_name, connection=Redis.from_url(redis_url))
+
+    def submit(self, job_id, kind, payload):
+        self._queue.enqueue(run_job, job_id, kind, payload, job_id=job_id, job_timeout=JOB_TIMEOUT)
+
+
+_store = None
+_backend = None
+_setup_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _setup_lock:
+        if _store is None:
+            _store = MemoryJobStore() if JOB_STORE == 'memory' else FirestoreJobStore(db.collection('jobs'))
+        return _store
+
+
+def get_backend():
+    global _backend
+    with _setup_lock:
+        if _backend is None:
+            _backend = RqJobBackend() if JOB_BACKEND == 'rq' else ThreadJobBackend()
+        return _backend
+
+
+def configure(store=None, backend=None):
+    """Swap the store/backend, e.g. for a MemoryJobStore in local runs"""
+    global _store, _backend
+    with _setup_lock:
+        if store is not None:
+            _store = store
+        if backend is not None:
+            _backend = backend
+
+
+# -- public API ----------------------------------------------------------
+
+def enqueue(kind, payload, created_by=None):
+    """Queue a job and return its ID immediately"""
+    if kind not in _handlers:
+        raise KeyError(f'No job handler registered for {kind}')
+    job_id = uuid.uuid4().hex
+    get_store().create(job_id, {
+        'kind': kind,
+        'status': 'queued',
+        'progress': 0,
+        'processed': 0,
+        'total': None,
+        'message': 'Queued',
+        'createdBy': created_by,
+        'createdAt': time.time(),
+        'cancelRequested': False,
+    })
+    get_backend().submit(job_id, kind, payload)
+    return job_id
+
+
+def get_job(job_id):
+    return get_store().get(job_id)
+
+
+def load_job_data(job_id, name):
+    """A mapping a job stored with ctx.save_data(name, ...), or None"""
+    return get_store().get_data(job_id, name)
+
+
+def cancel_job(job_id):
+    """Request cancellation; returns False if the job is unknown or already finished"""
+    job = get_store().get(job_id)
+    if job is None or job.get('status') in FINISHED_STATUSES:
+        return False
+    get_store().update(job_id, {'cancelRequested': True, 'message': 'Cancelling...'})
+    return True
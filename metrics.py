@@ -0,0 +1,440 @@
+# metrics.py
+# Request and backend-call instrumentation, exposed at /metrics in the
+# Prometheus text format.
+#
+# Every request is timed by before/after_request hooks (histogram by route
+# template, method and status, plus in-flight and status counters). Calls to
+# Firestore, Firebase Auth, Cloud Storage and Google Sheets are timed where
+# they leave the process: the Firestore GAPIC client, the Storage HTTP
+# session, the firebase_admin.auth functions and SheetsGateway.call.
+#
+# Each process counts in memory. With METRICS_DIR set (gunicorn.conf.py sets
+# it to a directory shared by all workers) every worker writes its values
+# there every METRICS_FLUSH_INTERVAL seconds and /metrics adds up the files
+# of all workers, so whichever worker serves the scrape reports the whole
+# server. Counters of exited workers are kept; their gauges are dropped.
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, request, has_request_context
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BACKEND_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Structured per-request log lines (JSON on stdout) when set
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '0') == '1'
+TRACE_HEADER = 'X-Request-ID'
+_TRACE_ID_MAX = 64
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+# Counters and histograms of workers that have exited
+ARCHIVE_FILE = 'archive.json'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{_escape(v)}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def dump(self):
+        """This process's values as JSON-friendly [[label values], value] pairs"""
+        with self._lock:
+            return [[list(k), self._copy(v)] for k, v in self._values.items()]
+
+    def values(self):
+        with self._lock:
+            return {k: self._copy(v) for k, v in self._values.items()}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    @staticmethod
+    def add(values, labels, value):
+        """Add one dumped value into `values` (when merging processes)"""
+        values[labels] = values.get(labels, 0) + value
+
+    def collect(self, values):
+        return [f'{self.name}{_format_labels(self.labels, k)} {v}' for k, v in sorted(values.items())]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # per-bucket counts (+Inf last), sum
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1]]
+
+    def add(self, values, labels, value):
+        entry = values.get(labels)
+        if entry is None:
+            values[labels] = self._copy(value)
+        else:
+            entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+            entry[1] += value[1]
+
+    def collect(self, values):
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, (('le', bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.',
+    ('route', 'method', 'status'), REQUEST_BUCKETS)
+http_requests_total = Counter(
+    'http_requests_total', 'HTTP responses by route and status.', ('route', 'method', 'status'))
+http_requests_in_flight = Gauge(
+    'http_requests_in_flight', 'Requests currently being handled.')
+http_requests_in_flight.inc(amount=0)
+backend_call_duration = Histogram(
+    'backend_call_duration_seconds', 'Time spent in calls to Firestore, Auth, Storage and Sheets.',
+    ('backend', 'operation', 'outcome'), BACKEND_BUCKETS)
+
+REGISTRY = (http_request_duration, http_requests_total, http_requests_in_flight, backend_call_duration)
+
+
+
+# -- multiprocess --------------------------------------------------------
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _worker_file(pid):
+    return os.path.join(METRICS_DIR, f'worker_{pid}.json')
+
+
+def _write_json(path, data):
+    # Written aside and renamed, so readers never see half a file
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def flush():
+    """Write this process's values to METRICS_DIR"""
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _write_json(_worker_file(os.getpid()), {m.name: m.dump() for m in REGISTRY})
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError as e:
+            print(f"Metrics: could not write to {METRICS_DIR}: {e}")
+
+
+def _start_flusher():
+    """Start the periodic flush once per (forked) process"""
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+        atexit.register(flush)
+
+
+def reset_metrics_dir():
+    """Empty METRICS_DIR (gunicorn on_starting), so a restart doesn't count old workers"""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        os.remove(path)
+
+
+def mark_process_dead(pid):
+    """
+    Fold an exited worker's counters and histograms into the archive and
+    drop its gauges (gunicorn child_exit, which runs in the master only).
+    """
+    if not METRICS_DIR:
+        return
+    path = _worker_file(pid)
+    dead = _read_json(path)
+    if not dead:
+        return
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+    merged = _merge([_read_json(archive_path), dead], gauges=False)
+    _write_json(archive_path, {name: [[list(k), v] for k, v in values.items()] for name, values in merged.items()})
+    os.remove(path)
+
+
+def _merge(dumps, gauges=True):
+    """{metric name: {labels: value}} summed over dumped processes"""
+    merged = {m.name: {} for m in REGISTRY}
+    for dump in dumps:
+        for metric in REGISTRY:
+            if not gauges and metric.kind == 'gauge':
+                continue
+            for labels, value in dump.get(metric.name, ()):
+                metric.add(merged[metric.name], tuple(labels), value)
+    return merged
+
+
+def render_metrics():
+    """
+    All metrics in the Prometheus text format: of every worker with
+    METRICS_DIR set, otherwise of this process.
+    """
+    if METRICS_DIR:
+        flush()
+        paths = glob.glob(os.path.join(METRICS_DIR, 'worker_*.json'))
+        merged = _merge([_read_json(os.path.join(METRICS_DIR, ARCHIVE_FILE))] + [_read_json(p) for p in paths])
+    else:
+        merged = {m.name: m.values() for m in REGISTRY}
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.header()
+        lines += metric.collect(merged[metric.name])
+    return '\n'.join(lines) + '\n'
+
+
+# -- backend calls -------------------------------------------------------
+
+def observe_backend(backend, operation, elapsed, ok=True):
+    backend_call_duration.observe(elapsed, backend, operation, 'ok' if ok else 'error')
+    if has_request_context():
+        calls = g.setdefault('backend_calls', {})
+        count, total = calls.get(backend, (0, 0.0))
+        calls[backend] = (count + 1, total + elapsed)
+
+
+@contextmanager
+def backend_timer(backend, operation):
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        observe_backend(backend, operation, time.perf_counter() - start, ok)
+
+
+def timed_call(backend, operation, fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with backend_timer(backend, operation):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _timed_stream(backend, operation, fn):
+    # Server-streaming RPCs return an iterator; time until it is exhausted
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            responses = fn(*args, **kwargs)
+        except Exception:
+            observe_backend(backend, operation, time.perf_counter() - start, False)
+            raise
+
+        def iterate():
+            ok = False
+            try:
+                yield from responses
+                ok = True
+            finally:
+                observe_backend(backend, operation, time.perf_counter() - start, ok)
+        return iterate()
+    return wrapper
+
+
+FIRESTORE_RPCS = (
+    'get_document', 'list_documents', 'create_document', 'update_document', 'delete_document',
+    'begin_transaction', 'commit', 'rollback', 'batch_write', 'list_collection_ids',
+)
+FIRESTORE_STREAMING_RPCS = ('batch_get_documents', 'run_query', 'run_aggregation_query')
+
+
+def instrument_firestore(client):
+    """
+    Time the RPCs of a google.cloud.firestore.Client. Every document read,
+    query, batch and transaction goes through these; the long-lived listen
+    stream behind on_snapshot does not and isn't timed.
+    """
+    try:
+        api = client._firestore_api
+    except AttributeError:
+        print("Firestore metrics unavailable: client has no _firestore_api")
+        return client
+    for name in FIRESTORE_RPCS:
+        fn = getattr(api, name, None)
+        if fn is not None:
+            setattr(api, name, timed_call('firestore', name, fn))
+    for name in FIRESTORE_STREAMING_RPCS:
+        fn = getattr(api, name, None)
+        if fn is not None:
+            setattr(api, name, _timed_stream('firestore', name, fn))
+    return client
+
+
+def timed_session(credentials):
+    """An authorized requests session that times each HTTP call (for Storage)"""
+    from google.auth.transport.requests import AuthorizedSession
+
+    class TimedSession(AuthorizedSession):
+        def request(self, method, url, *args, **kwargs):
+            with backend_timer('storage', method.upper()):
+                return super().request(method, url, *args, **kwargs)
+
+    return TimedSession(credentials)
+
+
+class TimedModule:
+    """Wraps a module so each of its functions is timed as `backend`"""
+
+    def __init__(self, module, backend):
+        self._module = module
+        self._backend = backend
+        self._wrapped = {}
+
+    def __getattr__(self, name):
+        value = getattr(self._module, name)
+        # Classes (exceptions, identifiers) are passed through untouched
+        if not callable(value) or isinstance(value, type):
+            return value
+        wrapped = self._wrapped.get(name)
+        if wrapped is None:
+            wrapped = self._wrapped[name] = timed_call(self._backend, name, value)
+        return wrapped
+
+    def use_module(self, module):
+        self._module = module
+        self._wrapped = {}
+
+
+# -- requests ------------------------------------------------------------
+
+def _route():
+    # The URL rule keeps label cardinality bounded (/api/staff/<staff_id>)
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def before_request():
+    _start_flusher()
+    g.request_started = time.perf_counter()
+    trace_id = request.headers.get(TRACE_HEADER, '')[:_TRACE_ID_MAX]
+    g.trace_id = trace_id or uuid.uuid4().hex[:16]
+    http_requests_in_flight.inc()
+    g.in_flight = True
+
+
+def after_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route, method, status = _route(), request.method, str(response.status_code)
+    http_request_duration.observe(elapsed, route, method, status)
+    http_requests_total.inc(route, method, status)
+    response.headers[TRACE_HEADER] = g.trace_id
+    if REQUEST_LOG:
+        print(json.dumps({
+            'trace_id': g.trace_id,
+            'method': method,
+            'route': route,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'backend': {k: {'calls': c, 'ms': round(t * 1000, 2)} for k, (c, t) in g.get('backend_calls', {}).items()},
+        }), flush=True)
+    return response
+
+
+def teardown_request(error=None):
+    if g.pop('in_flight', False):
+        http_requests_in_flight.dec()
+
+
+def trace_id():
+    """The current request's trace ID, or None outside a request"""
+    return g.get('trace_id') if has_request_context() else None
+
+
+def init_app(app):
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
@@ -1,11 +1,458 @@
 # processing/file_processors.py
-# Put Python versions of your dart/io processing functions here.
-# For now we expose a simple stub.
+# Server-side processing of files sent to /api/upload_file.
+#
+# The file type is detected from its leading bytes (not the extension) and
+# the matching processor from the registry extracts a summary: image
+# metadata, spreadsheet row count and schema, PDF page count and text
+# preview, audio/video duration. Processors run in a separate process pool
+# with a per-file time limit and address-space limit, so a pathological
+# file can't hang or exhaust a web worker, and results are cached by
+# content hash.
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import struct
+import subprocess
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 
-def process_uploaded_file(local_path: str) -> dict:
+PROCESSOR_WORKERS = int(os.environ.get('PROCESSOR_WORKERS', '2'))
+PROCESSOR_TIMEOUT = float(os.environ.get('PROCESSOR_TIMEOUT', '20'))
+PROCESSOR_MEMORY_MB = int(os.environ.get('PROCESSOR_MEMORY_MB', '512'))
+# The pool is replaced after this many files, so memory a processor leaks
+# (or fragments) in a long-lived worker is given back
+PROCESSOR_POOL_MAX_TASKS = int(os.environ.get('PROCESSOR_POOL_MAX_TASKS', '100'))
+PROCESSOR_CACHE_SIZE = 256
+# Bump when processor output changes so cached results are recomputed
+PROCESSOR_VERSION = 1
+
+SNIFF_BYTES = 4096
+PREVIEW_CHARS = 500
+SCHEMA_SAMPLE_ROWS = 50
+
+_processors = {}
+
+
+class ProcessorTimeout(Exception):
+    """The processor ran past PROCESSOR_TIMEOUT."""
+
+
+def processor(*mime_types):
+    """Register fn(path) -> dict as the processor for the given MIME types"""
+    def register(fn):
+        for mime in mime_types:
+            _processors[mime] = fn
+        return fn
+    return register
+
+
+# -- type detection ------------------------------------------------------
+
+def _zip_mime(path):
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = set(archive.namelist())
+    except zipfile.BadZipFile:
+        return 'application/octet-stream'
+    if 'xl/workbook.xml' in names:
+        return 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return 'application/zip'
+
+
+def _text_mime(head):
+    try:
+        text = head.decode('utf-8')
+    except UnicodeDecodeError:
+        # A multi-byte character may be cut off at the end of the sample
+        try:
+            text = head[:-3].decode('utf-8')
+        except UnicodeDecodeError:
+            return 'application/octet-stream'
+    if '\x00' in text:
+        return 'application/octet-stream'
+    lines = [line for line in text.splitlines()[:5] if line.strip()]
+    if len(lines) > 1 and all(line.count(',') >= 1 for line in lines):
+        counts = {line.count(',') for line in lines}
+        if len(counts) <= 2:
+            return 'text/csv'
+    return 'text/plain'
+
+
+def detect_mime(path):
+    """MIME type from the file's magic bytes"""
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'audio/wav'
+    if head.startswith(b'%PDF-'):
+        return 'application/pdf'
+    if head.startswith(b'PK\x03\x04'):
+        return _zip_mime(path)
+    if head.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        return 'application/vnd.ms-excel'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        return 'audio/mp4' if brand in (b'M4A ', b'M4B ') else 'video/mp4'
+    if head.startswith(b'ID3') or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return 'audio/mpeg'
+    if head.startswith(b'OggS'):
+        return 'audio/ogg'
+    if not head:
+        return 'application/x-empty'
+    return _text_mime(head)
+
+
+# -- processors ----------------------------------------------------------
+
+@processor('image/png', 'image/jpeg', 'image/gif', 'image/webp')
+def process_image(path):
+    from PIL import Image as PILImage
+
+    with PILImage.open(path) as image:
+        info = {
+            'format': image.format,
+            'width': image.width,
+            'height': image.height,
+            'mode': image.mode,
+            'frames': getattr(image, 'n_frames', 1),
+            'hasExif': bool(image.getexif()),
+        }
+        image.verify()
+    return info
+
+
+def _cell_type(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if hasattr(value, 'isoformat'):
+        return 'date'
+    text = str(value).strip()
+    if re.fullmatch(r'-?\d+(\.\d+)?', text):
+        return 'number'
+    if re.fullmatch(r'\d{4}-\d{2}-\d{2}([ T].*)?|\d{1,2}[/-]\d{1,2}[/-]\d{2,4}', text):
+        return 'date'
+    return 'text'
+
+
+def _sheet_summary(rows):
+    """Row count plus header and per-column type guess from the first rows"""
+    header = None
+    samples = []
+    row_count = 0
+    for values in rows:
+        if not any(v not in (None, '') for v in values):
+            continue
+        if header is None:
+            header = [str(v).strip() if v not in (None, '') else '' for v in values]
+            continue
+        row_count += 1
+        if len(samples) < SCHEMA_SAMPLE_ROWS:
+            samples.append(values)
+
+    columns = []
+    for i, name in enumerate(header or []):
+        types = {_cell_type(row[i]) for row in samples if i < len(row)} - {None}
+        columns.append({
+            'name': name,
+            'type': types.pop() if len(types) == 1 else ('mixed' if types else 'empty'),
+        })
+    return {'rows': row_count, 'columns': columns}
+
+
+@processor('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+def process_xlsx(path):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        summary = _sheet_summary(sheet.iter_rows(values_only=True))
+        summary['sheets'] = workbook.sheetnames
+    finally:
+        workbook.close()
+    return summary
+
+
+@processor('application/vnd.ms-excel')
+def process_xls(path):
+    try:
+        import xlrd
+    except ImportError:
+        return {'error': 'xlrd is not installed'}
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        summary = _sheet_summary(sheet.row_values(i) for i in range(sheet.nrows))
+        summary['sheets'] = book.sheet_names()
+    finally:
+        book.release_resources()
+    return summary
+
+
+@processor('text/csv')
+def process_csv(path):
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        sample = f.read(SNIFF_BYTES)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample)
+        except csv.Error:
+            dialect = csv.excel
+        summary = _sheet_summary(csv.reader(f, dialect))
+    summary['delimiter'] = dialect.delimiter
+    return summary
+
+
+@processor('text/plain')
+def process_text(path):
+    lines = 0
+    preview = ''
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            lines += 1
+            if len(preview) < PREVIEW_CHARS:
+                preview += line
+    return {'lines': lines, 'preview': preview[:PREVIEW_CHARS]}
+
+
+@processor('application/pdf')
+def process_pdf(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        # Without pypdf, count page objects; no text preview
+        with open(path, 'rb') as f:
+            data = f.read()
+        return {'pages': len(re.findall(rb'/Type\s*/Page(?!s)', data)), 'preview': None}
+
+    reader = PdfReader(path)
+    preview = ''
+    for page in reader.pages:
+        preview += page.extract_text() or ''
+        if len(preview) >= PREVIEW_CHARS:
+            break
+    return {
+        'pages': len(reader.pages),
+        'encrypted': reader.is_encrypted,
+        'preview': preview[:PREVIEW_CHARS].strip(),
+    }
+
+
+def _ffprobe_duration(path):
+    ffprobe = shutil.which('ffprobe')
+    if not ffprobe:
+        return None
+    output = subprocess.run(
+        [ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', path],
+        capture_output=True, timeout=PROCESSOR_TIMEOUT, check=False,
+    ).stdout
+    try:
+        return float(json.loads(output)['format']['duration'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _mp4_duration(path):
+    """Duration from the moov/mvhd box, walking box headers only"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size
+        offset = 0
+        while offset + 8 <= end:
+            f.seek(offset)
+            box_size, box_type = struct.unpack('>I4s', f.read(8))
+            header = 8
+            if box_size == 1:
+                box_size = struct.unpack('>Q', f.read(8))[0]
+                header = 16
+            elif box_size == 0:
+                box_size = end - offset
+            if box_size < header:
+                return None
+            if box_type == b'moov':
+                # Descend into moov
+                end = offset + box_size
+                offset += header
+                continue
+            if box_type == b'mvhd':
+                version = f.read(1)[0]
+                f.read(3)
+                if version == 1:
+                    f.read(16)
+                    timescale, duration = struct.unpack('>IQ', f.read(12))
+                else:
+                    f.read(8)
+                    timescale, duration = struct.unpack('>II', f.read(8))
+                return duration / timescale if timescale else None
+            offset += box_size
+    return None
+
+
+@processor('video/mp4', 'audio/mp4', 'audio/mpeg', 'audio/wav', 'audio/ogg')
+def process_media(path):
+    duration = _ffprobe_duration(path)
+    if duration is None and detect_mime(path) in ('video/mp4', 'audio/mp4'):
+        duration = _mp4_duration(path)
+    return {'durationSeconds': round(duration, 3) if duration is not None else None}
+
+
+# -- execution -----------------------------------------------------------
+
+def _init_worker(started):
+    """Pool initializer: report the worker's pid to the pool and cap its address space"""
+    started.put(os.getpid())
+    try:
+        import resource
+        limit = PROCESSOR_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def _on_alarm(signum, frame):
+    raise ProcessorTimeout(f'Processing took longer than {PROCESSOR_TIMEOUT:g}s')
+
+
+def _run_processor(path, mime):
+    """Runs inside a pool worker"""
+    use_alarm = hasattr(signal, 'setitimer')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, PROCESSOR_TIMEOUT)
+    try:
+        return _processors[mime](path)
+    except ProcessorTimeout as e:
+        return {'error': 'timeout', 'detail': str(e)}
+    except MemoryError:
+        return {'error': 'memory_limit', 'detail': f'Processing needed more than {PROCESSOR_MEMORY_MB} MB'}
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class ProcessorPool:
     """
-    Replace this stub with full ported logic from your Flutter dart/io-based processors.
-    E.g., image metadata checks, steganography extraction, audio transcription, etc.
+    Lazily started process pool. If a worker doesn't come back within the
+    time limit (e.g. stuck in C code that ignores the alarm) or dies, the
+    pool is torn down and rebuilt on the next call. Workers report their
+    pids when they start, so a stuck one can be killed; the pool is also
+    replaced every `max_tasks` files.
     """
-    # Example stub
-    return {'status': 'ok', 'path': local_path}
+
+    def __init__(self, max_workers=PROCESSOR_WORKERS, max_tasks=PROCESSOR_POOL_MAX_TASKS):
+        self.max_workers = max_workers
+        self.max_tasks = max_tasks
+        self._executor = None
+        self._started = None
+        self._tasks = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """(executor, pid queue) for the next task"""
+        with self._lock:
+            if self._executor is not None and self._tasks >= self.max_tasks:
+                # Running tasks finish; the old workers exit once they're done
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                # spawn: forking a process that holds gRPC/Firebase threads is unsafe
+                context = multiprocessing.get_context('spawn')
+                self._started = context.SimpleQueue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self._started,),
+                )
+                self._tasks = 0
+            self._tasks += 1
+            return self._executor, self._started
+
+    def _discard(self, executor, started):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        while not started.empty():
+            try:
+                os.kill(started.get(), getattr(signal, 'SIGKILL', signal.SIGTERM))
+            except OSError:
+                pass  # already gone
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, path, mime):
+        executor, started = self._get_executor()
+        future = executor.submit(_run_processor, path, mime)
+        try:
+            # The in-worker alarm normally fires first; this is the backstop
+            return future.result(timeout=PROCESSOR_TIMEOUT + 5)
+        except FutureTimeoutError:
+            self._discard(executor, started)
+            return {'error': 'timeout', 'detail': f'Processing took longer than {PROCESSOR_TIMEOUT:g}s'}
+        except BrokenProcessPool:
+            self._discard(executor, started)
+            return {'error': 'processor_crashed', 'detail': 'The processing worker exited unexpectedly'}
+
+
+_pool = ProcessorPool()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def process_uploaded_file(local_path: str, sha256: str = None) -> dict:
+    """
+    Detect the file type and run its processor.
+    Returns {'mime', 'sha256', 'size', 'processor', 'result'}; results are
+    cached by content hash, pass `sha256` when the caller already has it.
+    """
+    sha256 = sha256 or file_sha256(local_path)
+    key = (sha256, PROCESSOR_VERSION)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return dict(_cache[key], cached=True)
+
+    mime = detect_mime(local_path)
+    fn = _processors.get(mime)
+    summary = {
+        'mime': mime,
+        'sha256': sha256,
+        'size': os.path.getsize(local_path),
+        'processor': fn.__name__ if fn else None,
+        'result': _pool.run(local_path, mime) if fn else None,
+    }
+
+    # Timeouts and crashes may be transient (a busy host), so they aren't cached
+    if (summary['result'] or {}).get('error') not in ('timeout', 'processor_crashed'):
+        with _cache_lock:
+            _cache[key] = summary
+            while len(_cache) > PROCESSOR_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return dict(summary, cached=False)
@@ -0,0 +1,119 @@
+# processing/photo_pipeline.py
+# Turns an uploaded staff photo into the images we actually serve.
+#
+# The upload is decoded with PIL (rejecting anything that isn't a real
+# image), rotated according to its EXIF orientation and re-encoded without
+# any metadata as a bounded-size JPEG (or WebP with PHOTO_FORMAT=webp), plus
+# square 64px and 256px thumbnails for list views.
+import hashlib
+import io
+import os
+
+PHOTO_FORMAT = os.environ.get('PHOTO_FORMAT', 'jpeg').lower()
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+PHOTO_MAX_PIXELS = 40_000_000
+PHOTO_MAX_SIZE = 1024
+PHOTO_QUALITY = 85
+THUMBNAIL_SIZES = (64, 256)
+ACCEPTED_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF', 'BMP', 'TIFF', 'MPO')
+
+# Staff doc field holding the URL of each variant
+VARIANT_FIELDS = {
+    'photo': 'photoUrl',
+    'thumb64': 'photoThumb64Url',
+    'thumb256': 'photoThumb256Url',
+}
+# Staff doc field holding source_hash() of the photo the variants were made from
+SOURCE_HASH_FIELD = 'photoSourceHash'
+
+_CONTENT_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+_EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+
+class PhotoValidationError(ValueError):
+    """The uploaded bytes aren't an image we accept."""
+
+
+def _decode(image_bytes):
+    # PIL is imported on first use so it isn't loaded at app startup
+    from PIL import Image as PILImage, ImageOps
+    if not image_bytes:
+        raise PhotoValidationError('Photo is empty')
+    if len(image_bytes) > PHOTO_MAX_BYTES:
+        raise PhotoValidationError(f'Photo is larger than {PHOTO_MAX_BYTES // (1024 * 1024)} MB')
+    try:
+        # verify() catches truncated/corrupt files but leaves the image unusable,
+        # so the bytes are opened a second time for the actual decode
+        with PILImage.open(io.BytesIO(image_bytes)) as probe:
+            fmt = probe.format
+            width, height = probe.size
+            probe.verify()
+        if fmt not in ACCEPTED_FORMATS:
+            raise PhotoValidationError(f'Unsupported photo format: {fmt}')
+        if width * height > PHOTO_MAX_PIXELS:
+            raise PhotoValidationError('Photo dimensions are too large')
+        image = PILImage.open(io.BytesIO(image_bytes))
+        image.load()
+    except PhotoValidationError:
+        raise
+    except Exception as e:
+        raise PhotoValidationError(f'Invalid image: {e}')
+
+    # Apply the camera orientation before the EXIF block is dropped
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        background = PILImage.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    return image.convert('RGB')
+
+
+def _encode(image):
+    out = io.BytesIO()
+    if PHOTO_FORMAT == 'webp':
+        image.save(out, format='WEBP', quality=PHOTO_QUALITY, method=4)
+    else:
+        image.save(out, format='JPEG', quality=PHOTO_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def source_hash(image_bytes):
+    """
+    Digest of an uploaded photo and the settings it is processed with; equal
+    hashes mean prepare_photo() would produce the same variants again.
+    """
+    settings = f'{PHOTO_FORMAT}:{PHOTO_QUALITY}:{PHOTO_MAX_SIZE}:{THUMBNAIL_SIZES}'
+    return hashlib.sha256(settings.encode('ascii') + image_bytes).hexdigest()
+
+
+def content_type():
+    return _CONTENT_TYPES.get(PHOTO_FORMAT, 'image/jpeg')
+
+
+def variant_path(identifier, variant):
+    # Create filename using identifier (email or emp_id)
+    safe_identifier = str(identifier).replace('@', '_at_').replace('.', '_dot_')
+    ext = _EXTENSIONS.get(PHOTO_FORMAT, 'jpg')
+    if variant == 'photo':
+        return f'staff_photos/{safe_identifier}_photo.{ext}'
+    return f'staff_photos/{safe_identifier}_{variant}.{ext}'
+
+
+def prepare_photo(image_bytes):
+    """
+    Validate and normalise a photo.
+    Returns {variant: encoded_bytes} for 'photo', 'thumb64' and 'thumb256';
+    raises PhotoValidationError for anything that isn't a usable image.
+    """
+    from PIL import Image as PILImage, ImageOps
+    image = _decode(image_bytes)
+
+    photo = image.copy()
+    photo.thumbnail((PHOTO_MAX_SIZE, PHOTO_MAX_SIZE), PILImage.LANCZOS)
+    variants = {'photo': _encode(photo)}
+
+    for size in THUMBNAIL_SIZES:
+        thumb = ImageOps.fit(image, (size, size), PILImage.LANCZOS, centering=(0.5, 0.35))
+        variants[f'thumb{size}'] = _encode(thumb)
+    return variants
@@ -0,0 +1,99 @@
+# processing/photo_uploads.py
+# Concurrent staff photo uploads for the Excel importer and manual adds.
+import base64
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_config import bucket
+from processing.photo_pipeline import (prepare_photo, variant_path, content_type, source_hash, VARIANT_FIELDS,
+                                      SOURCE_HASH_FIELD, PhotoValidationError)
+
+PHOTO_UPLOAD_WORKERS = int(os.environ.get('PHOTO_UPLOAD_WORKERS', '8'))
+PHOTO_UPLOAD_RETRIES = 3
+
+
+class PhotoUploader:
+    """
+    Normalises photos (see photo_pipeline) and uploads every variant on a
+    bounded thread pool.
+    submit() returns a future resolving to the staff fields to store, e.g.
+    {'photoUrl': ..., 'photoThumb64Url': ..., 'photoThumb256Url': ...,
+    'photoSourceHash': ...}; the dict is empty when the photo is invalid or
+    the upload failed. Given the stored staff doc (`existing`), a photo whose
+    source_hash matches the doc's is not processed at all; otherwise a
+    variant whose bytes match the stored object's MD5 is not uploaded again.
+    """
+
+    def __init__(self, max_workers=PHOTO_UPLOAD_WORKERS, retries=PHOTO_UPLOAD_RETRIES):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self.retries = retries
+        self._lock = threading.Lock()
+        self.uploaded = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def submit(self, identifier, image_bytes, existing=None):
+        return self._executor.submit(self.process, identifier, image_bytes, existing)
+
+    def process(self, identifier, image_bytes, existing=None):
+        """Synchronous version of submit(), for callers already off the request thread"""
+        digest = source_hash(image_bytes)
+        if existing and existing.get(SOURCE_HASH_FIELD) == digest:
+            stored = {field: existing.get(field) for field in VARIANT_FIELDS.values()}
+            if all(stored.values()):
+                self._count('unchanged')
+                return dict(stored, **{SOURCE_HASH_FIELD: digest})
+
+        try:
+            variants = prepare_photo(image_bytes)
+        except PhotoValidationError as e:
+            print(f'Rejected photo for {identifier}: {e}')
+            self._count('rejected')
+            return {}
+
+        urls = {}
+        changed = False
+        for variant, data in variants.items():
+            url, uploaded = self._upload(variant_path(identifier, variant), data)
+            if url is None:
+                print(f'Error processing image for {identifier}: {variant} upload failed')
+                self._count('failed')
+                return {}
+            urls[VARIANT_FIELDS[variant]] = url
+            changed = changed or uploaded
+        self._count('uploaded' if changed else 'unchanged')
+        urls[SOURCE_HASH_FIELD] = digest
+        return urls
+
+    def _upload(self, filename, data):
+        """(public_url, uploaded) for one object; (None, False) once retries run out"""
+        md5 = base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+        for attempt in range(self.retries):
+            try:
+                existing = bucket.get_blob(filename)
+                if existing is not None and existing.md5_hash == md5:
+                    return existing.public_url, False
+
+                # Upload to Firebase Storage
+                blob = bucket.blob(filename)
+                blob.upload_from_string(data, content_type=content_type())
+
+                # Make public and get URL
+                blob.make_public()
+                return blob.public_url, True
+            except Exception as e:
+                if attempt == self.retries - 1:
+                    print(f'Error uploading {filename}: {e}')
+                    return None, False
+                time.sleep(0.5 * 2 ** attempt)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,218 @@
+# processing/staff_export.py
+# Streaming staff export used by /api/staff/export.
+#
+# Staff documents are read from Firestore a page at a time (ordered by ID,
+# with the /api/staffs equality filters) and written out as they arrive, in
+# the column layout of the importer, so an export can be uploaded again as
+# is. CSV is produced by a generator; .xlsx goes through an openpyxl
+# write-only workbook saved to a temporary file. Embedded photos are
+# downloaded into the same temporary directory and referenced by path, so
+# memory use doesn't grow with the roster.
+import csv
+import io
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, unquote
+
+from firebase_config import db, bucket
+from staff_query import run_staff_query, decode_cursor
+from processing.staff_import import REQUIRED_COLUMNS, COLUMN_FIELDS
+from processing.photo_uploads import PHOTO_UPLOAD_WORKERS
+
+EXPORT_FORMATS = ('xlsx', 'csv')
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '500'))
+
+# ?photos= value -> staff field of the embedded image. 'full' embeds the
+# stored photo, so a re-import rebuilds the same photo and thumbnails;
+# 'thumb' keeps the file small but a re-import would shrink the photos
+PHOTO_FIELDS = {'thumb': 'photoThumb256Url', 'full': 'photoUrl'}
+PHOTO_CELL_PX = 48
+PHOTO_ROW_HEIGHT = 38  # points, a little over PHOTO_CELL_PX
+COLUMN_WIDTHS = {'Name': 28, 'Designation': 24, 'Department': 16, 'Permanent Address': 40, 'Email': 30}
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+class ExportError(ValueError):
+    """The export options are invalid."""
+
+
+def parse_export_args(args):
+    """(format, photo_field) from the request args; photo_field is None without ?photos="""
+    fmt = (args.get('format') or 'xlsx').strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f'format must be one of: {", ".join(EXPORT_FORMATS)}')
+    photos = (args.get('photos') or '').strip().lower()
+    if photos and photos not in PHOTO_FIELDS:
+        raise ExportError(f'photos must be one of: {", ".join(PHOTO_FIELDS)}')
+    if photos and fmt != 'xlsx':
+        raise ExportError('Photos can only be embedded in xlsx exports')
+    return fmt, PHOTO_FIELDS.get(photos)
+
+
+def iter_staff_pages(filters, fields=None, page_size=EXPORT_PAGE_SIZE):
+    """Staff dicts (with 'id') matching `filters`, one page-sized list at a time"""
+    spec = {'filters': filters, 'fields': fields, 'limit': page_size, 'cursor': None}
+    while True:
+        page, next_cursor = run_staff_query(db.collection('staff'), spec)
+        if page:
+            yield page
+        if next_cursor is None:
+            return
+        spec['cursor'] = decode_cursor(next_cursor)
+
+
+def _export_fields(photo_field=None):
+    fields = list(COLUMN_FIELDS.values())
+    return fields + [photo_field] if photo_field else fields
+
+
+def _row_values(staff):
+    return ['' if staff.get(field) is None else str(staff.get(field))
+            for column, field in COLUMN_FIELDS.items()]
+
+
+# -- csv -----------------------------------------------------------------
+
+def csv_chunks(filters):
+    """
+    Generator of CSV text, one chunk per page of staff. The first chunk
+    (header and first page) is read eagerly by callers that want Firestore
+    errors before the response starts.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # Photo is left out: CSV imports have no images
+    writer.writerow([c for c in REQUIRED_COLUMNS if c != 'Photo'])
+    for page in iter_staff_pages(filters, _export_fields()):
+        for staff in page:
+            writer.writerow(_row_values(staff))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# -- xlsx ----------------------------------------------------------------
+
+def _blob_name(url):
+    """Storage object name behind a public URL of our bucket, or None"""
+    if not url:
+        return None
+    path = urlparse(url).path
+    prefix = f'/{bucket.name}/'
+    return unquote(path[len(prefix):]) if path.startswith(prefix) else None
+
+
+def _download_photo(url, target):
+    """Download the photo at `url` to the file `target`; returns target, or None if unavailable"""
+    name = _blob_name(url)
+    if not name:
+        if url:
+            print(f'Export: photo URL is outside the bucket: {url}')
+        return None
+    try:
+        data = bucket.blob(name).download_as_bytes()
+    except Exception as e:
+        print(f'Export: could not download {name}: {e}')
+        return None
+    if not data:
+        print(f'Export: photo {name} is missing or empty')
+        return None
+    with open(target, 'wb') as f:
+        f.write(data)
+    return target
+
+
+def _text_cell(ws, value):
+    from openpyxl.cell import WriteOnlyCell
+    cell = WriteOnlyCell(ws, value)
+    # openpyxl would write '=...' as a formula; keep it as the text it is
+    if isinstance(value, str) and value.startswith('='):
+        cell.data_type = 's'
+    return cell
+
+
+def _embed_photo(ws, path, row_num, photo_letter):
+    """Place the image at `path` in the Photo cell of `row_num`; returns False if it is unreadable"""
+    from openpyxl.drawing.image import Image
+    try:
+        image = Image(path)
+    except Exception as e:
+        print(f'Export: skipping unreadable photo {os.path.basename(path)}: {e}')
+        return False
+    scale = PHOTO_CELL_PX / max(image.width, image.height, 1)
+    image.width = round(image.width * scale)
+    image.height = round(image.height * scale)
+    ws.add_image(image, f'{photo_letter}{row_num}')
+    return True
+
+
+def write_xlsx(path, filters, photo_field=None, workdir=None):
+    """
+    Write the filtered roster to the .xlsx file `path`; returns
+    (rows, photos_skipped). With photo_field the image at that URL is
+    embedded in the Photo column, which the importer reads back. Photos
+    are downloaded to `workdir` (which must outlive the save) on a bounded
+    thread pool; photos_skipped counts staff whose photo could not be
+    downloaded or read and whose Photo cell is therefore blank.
+    """
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+
+    workbook = openpyxl.Workbook(write_only=True)
+    ws = workbook.create_sheet('Staff')
+    for i, column in enumerate(REQUIRED_COLUMNS, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = COLUMN_WIDTHS.get(column, 14)
+    photo_letter = get_column_letter(REQUIRED_COLUMNS.index('Photo') + 1)
+    if photo_field:
+        ws.sheet_format.defaultRowHeight = PHOTO_ROW_HEIGHT
+        ws.sheet_format.customHeight = True
+    ws.append(REQUIRED_COLUMNS)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, PHOTO_UPLOAD_WORKERS)) if photo_field else None
+    row_num = 1
+    photos_skipped = 0
+    try:
+        for page in iter_staff_pages(filters, _export_fields(photo_field)):
+            first_row = row_num + 1
+            photos = []
+            if executor is not None:
+                targets = [os.path.join(workdir, f'photo{first_row + i}') for i in range(len(page))]
+                photos = list(executor.map(_download_photo, [s.get(photo_field) for s in page], targets))
+            for i, staff in enumerate(page):
+                row_num += 1
+                ws.append([_text_cell(ws, value) for value in _row_values(staff)])
+                if not photos or not staff.get(photo_field):
+                    continue
+                if not (photos[i] and _embed_photo(ws, photos[i], row_num, photo_letter)):
+                    photos_skipped += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    workbook.save(path)
+    if photos_skipped:
+        print(f'Export: {photos_skipped} photo(s) left out of the workbook')
+    return row_num - 1, photos_skipped
+
+
+def export_xlsx(filters, photo_field=None):
+    """
+    Build the workbook in a temporary directory; returns (file, rows,
+    photos_skipped) with the workbook as an open binary file. The directory
+    is removed right away; the file itself goes away once the caller closes it.
+    """
+    workdir = tempfile.mkdtemp(prefix='staff_export_')
+    try:
+        path = os.path.join(workdir, 'staff.xlsx')
+        rows, photos_skipped = write_xlsx(path, filters, photo_field, workdir)
+        return open(path, 'rb'), rows, photos_skipped
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,601 @@
+# processing/staff_import.py
+# Streaming staff import used by /api/upload_excel.
+#
+# Rows are read one at a time (openpyxl read-only mode for .xlsx, the csv
+# module for .csv, xlrd for legacy .xls), validated as they arrive and
+# written to Firestore in batches of at most 500 writes, with a bounded
+# number of batch commits in flight. Photos are located through a one-pass
+# (row, col) index, normalised with thumbnails and uploaded concurrently;
+# a row is handed to the batch writer once its photo upload has finished.
+# Photos are stored under the staff doc ID; the stored docs of rows with a
+# photo are fetched in bulk first so an unchanged photo (same source hash)
+# isn't processed again. Diff mode fetches every row's doc and plans the row
+# before its photo is touched, so unchanged rows upload nothing.
+import csv
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from firebase_admin import firestore
+from firebase_config import db
+from staff_cache import staff_cache
+from serial_numbers import sl_allocator
+from processing.xlsx_images import XlsxImages
+from processing.photo_uploads import PhotoUploader, PHOTO_UPLOAD_WORKERS
+from processing.photo_pipeline import VARIANT_FIELDS, SOURCE_HASH_FIELD, source_hash
+
+# Required columns exactly as in Flutter (Photo is optional)
+REQUIRED_COLUMNS = [
+    'Sl No', 'Emp No', 'Name', 'Type', 'Contract Type', 'Department',
+    'Category', 'Gender', 'Designation', 'Mobile No', 'Blood Group',
+    'Permanent Address', 'Email', 'Photo'
+]
+
+# Staff doc field behind each column (see staff_doc); Photo has none
+COLUMN_FIELDS = {
+    'Sl No': 'slNo', 'Emp No': 'empNo', 'Name': 'name', 'Type': 'type',
+    'Contract Type': 'contractType', 'Department': 'department', 'Category': 'category',
+    'Gender': 'gender', 'Designation': 'designation', 'Mobile No': 'mobileNo',
+    'Blood Group': 'bloodGroup', 'Permanent Address': 'permanentAddress', 'Email': 'email',
+}
+# Fields a diff-mode import compares against the stored document
+COMPARED_FIELDS = tuple(COLUMN_FIELDS.values()) + tuple(VARIANT_FIELDS.values()) + (SOURCE_HASH_FIELD,)
+# Fields read from stored docs to decide whether a photo changed
+PHOTO_FIELDS = tuple(VARIANT_FIELDS.values()) + (SOURCE_HASH_FIELD,)
+
+IMPORT_EXTENSIONS = ('xlsx', 'xls', 'csv')
+# replace: every row is written with set(); diff: see DiffPlanner
+IMPORT_MODES = ('replace', 'diff')
+
+# Firestore rejects batches with more than 500 writes
+FIRESTORE_BATCH_LIMIT = 500
+IMPORT_MAX_IN_FLIGHT = int(os.environ.get('IMPORT_MAX_IN_FLIGHT', '4'))
+# Stored documents fetched per get_all()
+LOOKUP_SIZE = int(os.environ.get('IMPORT_LOOKUP_SIZE', '300'))
+# Rows listed per category in a diff report; the counts are always complete
+DIFF_REPORT_LIMIT = 200
+
+
+class ImportFormatError(ValueError):
+    """The file can't be imported at all (bad type, missing columns)."""
+
+
+# -- row sources ---------------------------------------------------------
+
+class _XlsxSource:
+    def __init__(self, path):
+        import openpyxl
+        self._workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        self._sheet = self._workbook.active
+        self.estimated_rows = max((self._sheet.max_row or 1) - 1, 0)
+        self.images = XlsxImages(path)
+
+    def rows(self):
+        return self._sheet.iter_rows(values_only=True)
+
+    def close(self):
+        self.images.close()
+        self._workbook.close()
+
+
+class _CsvSource:
+    images = None
+
+    def __init__(self, path):
+        self._file = open(path, newline='', encoding='utf-8-sig')
+        # Line count; quoted multi-line cells make it an overestimate
+        self.estimated_rows = max(sum(1 for _ in self._file) - 1, 0)
+        self._file.seek(0)
+
+    def rows(self):
+        return csv.reader(self._file)
+
+    def close(self):
+        self._file.close()
+
+
+class _XlsSource:
+    images = None
+
+    def __init__(self, path):
+        try:
+            import xlrd
+        except ImportError:
+            raise ImportFormatError('.xls files need the xlrd package; save the sheet as .xlsx instead')
+        self._book = xlrd.open_workbook(path, on_demand=True)
+        self._sheet = self._book.sheet_by_index(0)
+        self.estimated_rows = max(self._sheet.nrows - 1, 0)
+
+    def rows(self):
+        for i in range(self._sheet.nrows):
+            yield self._sheet.row_values(i)
+
+    def close(self):
+        self._book.release_resources()
+
+
+def open_source(path):
+    ext = path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+    if ext == 'xlsx':
+        return _XlsxSource(path)
+    if ext == 'csv':
+        return _CsvSource(path)
+    if ext == 'xls':
+        return _XlsSource(path)
+    raise ImportFormatError(f'Unsupported file type: .{ext}')
+
+
+# -- row handling --------------------------------------------------------
+
+def map_columns(header_row):
+    column_indices = {}
+    for i, value in enumerate(header_row):
+        header = str(value).strip() if value else ''
+        if header:
+            column_indices[header] = i
+
+    missing_columns = [c for c in REQUIRED_COLUMNS if c != 'Photo' and c not in column_indices]
+    if missing_columns:
+        raise ImportFormatError(f'Missing columns: {", ".join(missing_columns)}')
+    return column_indices
+
+
+def parse_row(values, column_indices):
+    """Sheet row -> dict keyed by column name; raises ValueError on invalid rows"""
+    staff = {}
+    for column in REQUIRED_COLUMNS:
+        if column == 'Photo':
+            continue
+        col_index = column_indices.get(column)
+        if col_index is None or col_index >= len(values):
+            staff[column] = ''
+            continue
+
+        cell_value = values[col_index]
+
+        # Special handling for Mobile No
+        if column == 'Mobile No' and cell_value:
+            cell_value = str(cell_value).replace('.0', '')
+
+        staff[column] = str(cell_value).strip() if cell_value else ''
+
+    if not staff['Name']:
+        raise ValueError('Name is empty')
+    if staff['Email'] and '@' not in staff['Email']:
+        raise ValueError(f'Invalid email: {staff["Email"]}')
+    return staff
+
+
+def staff_doc_id(staff):
+    """Email as document ID if available, otherwise Emp No, otherwise None (auto-ID)"""
+    if staff.get('Email') and staff.get('Email').strip():
+        # Make email Firebase-safe by replacing special characters
+        return staff.get('Email').strip().replace('@', '_at_').replace('.', '_dot_')
+    if staff.get('Emp No') and staff.get('Emp No').strip():
+        return str(staff.get('Emp No')).strip()
+    return None
+
+
+def staff_doc(staff):
+    # Structure exactly matching Flutter
+    return {
+        'slNo': staff.get('Sl No', ''),
+        'empNo': staff.get('Emp No', ''),
+        'name': staff.get('Name', ''),
+        'type': staff.get('Type', ''),
+        'contractType': staff.get('Contract Type', ''),
+        'department': staff.get('Department', ''),
+        'category': staff.get('Category', ''),
+        'gender': staff.get('Gender', ''),
+        'designation': staff.get('Designation', ''),
+        'mobileNo': staff.get('Mobile No', ''),
+        'bloodGroup': staff.get('Blood Group', ''),
+        'permanentAddress': staff.get('Permanent Address', ''),
+        'email': staff.get('Email', ''),
+        'photoUrl': staff.get('photoUrl', ''),
+        'photoThumb64Url': staff.get('photoThumb64Url', ''),
+        'photoThumb256Url': staff.get('photoThumb256Url', ''),
+        SOURCE_HASH_FIELD: staff.get(SOURCE_HASH_FIELD, ''),
+        'timestamp': firestore.SERVER_TIMESTAMP,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }
+
+
+# -- batched writes ------------------------------------------------------
+
+class BatchWriter:
+    """
+    Collects set() and update() writes and commits them in chunks of
+    `chunk_size`, with at most `max_in_flight` commits running at once.
+    """
+
+    def __init__(self, chunk_size=FIRESTORE_BATCH_LIMIT, max_in_flight=IMPORT_MAX_IN_FLIGHT, on_chunk=None):
+        self.chunk_size = min(chunk_size, FIRESTORE_BATCH_LIMIT)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_in_flight))
+        self._max_in_flight = max(1, max_in_flight)
+        self._in_flight = set()
+        self._pending = []
+        self._on_chunk = on_chunk
+        # First exception raised by on_chunk (e.g. JobCancelled); close() re-raises it
+        self._callback_error = None
+        self.chunks = []
+        self.errors = []
+        self.written = 0
+
+    def set(self, doc_ref, data, row_num):
+        self._add('set', doc_ref, data, row_num)
+
+    def update(self, doc_ref, fields, row_num):
+        self._add('update', doc_ref, fields, row_num)
+
+    def _add(self, op, doc_ref, data, row_num):
+        self._pending.append((op, doc_ref, data, row_num))
+        if len(self._pending) >= self.chunk_size:
+            self.flush()
+
+    def _commit(self, chunk_no, items):
+        batch = db.batch()
+        for op, doc_ref, data, _ in items:
+            if op == 'update':
+                batch.update(doc_ref, data)
+            else:
+                batch.set(doc_ref, data)
+        batch.commit()
+        return chunk_no, items
+
+    def _collect(self, done):
+        for future in done:
+            self._in_flight.discard(future)
+            chunk_no, items = future.chunk_info
+            rows = [row_num for _, _, _, row_num in items]
+            try:
+                future.result()
+            except Exception as e:
+                self.chunks.append({'chunk': chunk_no, 'rows': len(items), 'status': 'failed', 'error': str(e)})
+                self.errors.extend({'row': row_num, 'error': f'Write failed: {e}'} for row_num in rows)
+                continue
+            for op, doc_ref, data, _ in items:
+                if op == 'update':
+                    staff_cache.merge(doc_ref.id, data)
+                else:
+                    staff_cache.put(doc_ref.id, data)
+            self.written += len(items)
+            self.chunks.append({'chunk': chunk_no, 'rows': len(items), 'status': 'committed',
+                                'firstRow': rows[0], 'lastRow': rows[-1]})
+            if self._on_chunk and self._callback_error is None:
+                try:
+                    self._on_chunk(self.written)
+                except BaseException as e:
+                    # Keep collecting so every committed chunk reaches the cache
+                    self._callback_error = e
+
+    def flush(self):
+        if self._callback_error is not None:
+            self._pending = []
+        if not self._pending:
+            return
+        if len(self._in_flight) >= self._max_in_flight:
+            done, _ = wait(self._in_flight, return_when=FIRST_COMPLETED)
+            self._collect(done)
+        items, self._pending = self._pending, []
+        chunk_no = len(self.chunks) + len(self._in_flight) + 1
+        future = self._executor.submit(self._commit, chunk_no, items)
+        future.chunk_info = (chunk_no, items)
+        self._in_flight.add(future)
+
+    def discard(self):
+        """Drop writes that haven't been handed to a commit yet"""
+        self._pending = []
+
+    def close(self):
+        """
+        Commit what is left and stop the pool. An exception from on_chunk is
+        raised here, after the in-flight commits have been collected.
+        """
+        try:
+            self.flush()
+            if self._in_flight:
+                done, _ = wait(self._in_flight)
+                self._collect(done)
+        finally:
+            self._executor.shutdown()
+            self.chunks.sort(key=lambda c: c['chunk'])
+        if self._callback_error is not None:
+            raise self._callback_error
+
+
+# -- diff mode -----------------------------------------------------------
+
+def _normalize(value):
+    return '' if value is None else str(value).strip()
+
+
+def fingerprint(data):
+    """Short digest of the compared fields of a staff doc; None when the doc doesn't exist"""
+    if data is None:
+        return None
+    raw = '\x1f'.join(_normalize(data.get(field)) for field in COMPARED_FIELDS)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def preview_digest(fingerprints):
+    """Digest of a dry run's fingerprints; the commit checks the stored preview against it"""
+    raw = json.dumps(sorted(fingerprints.items()), separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def photo_changed(existing, photo_hash):
+    """True if the stored doc doesn't already hold the variants of the photo with `photo_hash`"""
+    if photo_hash is None:
+        return False
+    if not existing or existing.get(SOURCE_HASH_FIELD) != photo_hash:
+        return True
+    return not all(existing.get(field) for field in VARIANT_FIELDS.values())
+
+
+class DiffPlanner:
+    """
+    Diff-mode import. The caller fetches each row's stored document in bulk
+    and classifies the row with plan() before any photo is uploaded: rows
+    without a document become set() writes, changed rows update() only
+    their changed fields (plus updatedAt), unchanged rows are skipped. A
+    photo counts as changed when its source_hash differs from the stored
+    one, so only new and changed photos are uploaded. Rows that can't be
+    matched safely are reported as conflicts and skipped:
+      - no Email or Emp No (the document ID would be random)
+      - the same document ID as an earlier row
+      - with `expected` (the fingerprints a dry run saw), a document that
+        changed in Firestore after the dry run
+    With writer=None nothing is written (dry run).
+    """
+
+    def __init__(self, writer=None, expected=None, report_limit=DIFF_REPORT_LIMIT):
+        self.writer = writer
+        self.expected = expected
+        self.report_limit = report_limit
+        self._seen = set()
+        self.counts = {'creates': 0, 'updates': 0, 'unchanged': 0, 'conflicts': 0}
+        self.details = {'creates': [], 'updates': [], 'conflicts': []}
+        # Fingerprint of every document a dry run would write, for the commit
+        self.fingerprints = {}
+
+    def _record(self, kind, entry):
+        self.counts[kind] += 1
+        if kind in self.details and len(self.details[kind]) < self.report_limit:
+            self.details[kind].append(entry)
+
+    def doc_id(self, row_num, staff):
+        """The row's document ID, or None (reported as a conflict) if it can't be matched"""
+        doc_id = staff_doc_id(staff)
+        if doc_id is None:
+            self._record('conflicts', {'row': row_num, 'id': None, 'reason': 'No Email or Emp No to match on'})
+        elif doc_id in self._seen:
+            self._record('conflicts', {'row': row_num, 'id': doc_id, 'reason': 'Same Email/Emp No as an earlier row'})
+            return None
+        else:
+            self._seen.add(doc_id)
+        return doc_id
+
+    def plan(self, row_num, doc_id, staff, existing, photo_hash=None):
+        """
+        Classify a row against its stored doc (None if there is none).
+        Returns (kind, changed fields); only 'creates' and 'updates' are
+        written. A changed photo shows up as its source hash in `changed`.
+        """
+        if existing is None:
+            kind, changed = 'creates', None
+        else:
+            new = staff_doc(staff)
+            changed = {f: new[f] for f in COLUMN_FIELDS.values()
+                       if _normalize(new[f]) != _normalize(existing.get(f))}
+            if photo_changed(existing, photo_hash):
+                changed[SOURCE_HASH_FIELD] = photo_hash
+            kind = 'updates' if changed else 'unchanged'
+        if kind == 'unchanged':
+            self._record(kind, None)
+            return kind, changed
+        if self.expected is not None and self.expected.get(doc_id, '') != fingerprint(existing):
+            self._record('conflicts', {'row': row_num, 'id': doc_id, 'reason': 'Changed since the dry run'})
+            return 'conflicts', None
+
+        if kind == 'creates':
+            self._record(kind, {'row': row_num, 'id': doc_id})
+        else:
+            fields = sorted('photoUrl' if f == SOURCE_HASH_FIELD else f for f in changed)
+            self._record(kind, {'row': row_num, 'id': doc_id, 'fields': fields})
+        if self.writer is None:
+            self.fingerprints[doc_id] = fingerprint(existing)
+        return kind, changed
+
+    def write(self, row_num, doc_id, staff, kind, changed):
+        """Queue the write for a planned row; `staff` carries the uploaded photo URLs, if any"""
+        if self.writer is None or kind not in ('creates', 'updates'):
+            return
+        ref = db.collection('staff').document(doc_id)
+        if kind == 'creates':
+            self.writer.set(ref, staff_doc(staff), row_num)
+            return
+        fields = {f: v for f, v in changed.items() if f != SOURCE_HASH_FIELD}
+        if SOURCE_HASH_FIELD in changed:
+            # Empty when the upload failed: the stored photo is kept
+            fields.update({f: staff[f] for f in PHOTO_FIELDS if f in staff})
+        if fields:
+            self.writer.update(ref, dict(fields, updatedAt=firestore.SERVER_TIMESTAMP), row_num)
+
+    def report(self):
+        return dict(self.counts, details=self.details)
+
+
+# -- entry point ---------------------------------------------------------
+
+def import_staff_file(path, on_progress=None, chunk_size=FIRESTORE_BATCH_LIMIT, max_in_flight=IMPORT_MAX_IN_FLIGHT,
+                      mode='replace', dry_run=False, expected=None):
+    """
+    Import a staff spreadsheet.
+    mode='diff' writes only new and changed rows (see DiffPlanner) and adds
+    a 'diff' report to the result. With dry_run (diff mode only) nothing is
+    written or uploaded and the result carries the 'fingerprints' to pass
+    back as `expected` when the same file is committed.
+    on_progress(processed_rows, written_rows, estimated_rows) is called for
+    every row read, after every committed chunk and at the end; if it raises
+    (e.g. a job being cancelled) rows not yet committed are dropped and the
+    exception propagates. Raises ImportFormatError when the file type or
+    header row is unusable; row-level problems are returned in 'errors'.
+    """
+    source = open_source(path)
+    photos = PhotoUploader()
+    # Rows waiting for the bulk lookup of their stored doc: (row_num, staff, doc_id, media)
+    awaiting_lookup = []
+    # Rows waiting for their photo upload: (row_num, staff, doc_id, future, plan)
+    awaiting_photo = deque()
+    max_awaiting = PHOTO_UPLOAD_WORKERS * 4
+    processed_records = 0
+    total_records = 0
+    max_sl_no = None
+    row_errors = []
+
+    def report(written):
+        if on_progress:
+            on_progress(processed_records, written, source.estimated_rows)
+
+    writer = BatchWriter(chunk_size=chunk_size, max_in_flight=max_in_flight, on_chunk=report)
+    planner = DiffPlanner(None if dry_run else writer, expected) if mode == 'diff' else None
+
+    def write_row(row_num, staff, doc_id, plan=None):
+        nonlocal processed_records, max_sl_no
+        if planner is not None:
+            if plan is not None:
+                planner.write(row_num, doc_id, staff, *plan)
+        else:
+            writer.set(db.collection('staff').document(doc_id), staff_doc(staff), row_num)
+        processed_records += 1
+        if staff['Sl No'].isdigit():
+            max_sl_no = max(max_sl_no or 0, int(staff['Sl No']))
+
+    def drain_photos(keep):
+        # Rows are written in sheet order once their upload has finished;
+        # waits on the oldest upload while more than `keep` rows are queued
+        while awaiting_photo:
+            row_num, staff, doc_id, future, plan = awaiting_photo[0]
+            if future is not None and not future.done() and len(awaiting_photo) <= keep:
+                break
+            awaiting_photo.popleft()
+            if future is not None:
+                staff.update(future.result())
+            write_row(row_num, staff, doc_id, plan)
+
+    def lookup_rows():
+        # One get_all() for the stored docs of the queued rows (diff mode:
+        # every row, to plan it; otherwise the photo fields of rows with a
+        # photo), then the photos that changed are uploaded
+        queued = list(awaiting_lookup)
+        del awaiting_lookup[:]
+        if planner is not None:
+            lookup_ids, field_paths = [doc_id for _, _, doc_id, _ in queued if doc_id is not None], None
+        else:
+            lookup_ids, field_paths = [doc_id for _, _, doc_id, media in queued if media is not None], list(PHOTO_FIELDS)
+        existing = {}
+        if lookup_ids:
+            refs = [db.collection('staff').document(doc_id) for doc_id in lookup_ids]
+            existing = {snap.id: snap.to_dict() for snap in db.get_all(refs, field_paths=field_paths) if snap.exists}
+        for row_num, staff, doc_id, media in queued:
+            image_bytes = None
+            if media is not None:
+                try:
+                    image_bytes = source.images.read(media)
+                except Exception as e:
+                    # The row is still imported, just without its photo
+                    print(f'Could not read the photo of row {row_num}: {e}')
+                    row_errors.append({'row': row_num, 'error': f'Photo could not be read: {e}'})
+            future = plan = None
+            if planner is None:
+                if image_bytes:
+                    future = photos.submit(doc_id, image_bytes, existing.get(doc_id))
+            elif doc_id is not None:
+                plan = planner.plan(row_num, doc_id, staff, existing.get(doc_id),
+                                    source_hash(image_bytes) if image_bytes else None)
+                kind, changed = plan
+                # Photos of unchanged rows and conflicts aren't touched
+                upload = kind == 'creates' or (kind == 'updates' and SOURCE_HASH_FIELD in changed)
+                if image_bytes and upload and not dry_run:
+                    future = photos.submit(doc_id, image_bytes, existing.get(doc_id))
+            awaiting_photo.append((row_num, staff, doc_id, future, plan))
+            drain_photos(keep=max_awaiting)
+
+    try:
+        rows = iter(source.rows())
+        column_indices = map_columns(next(rows, ()))
+        photo_cells = {}
+        if source.images is not None and 'Photo' in column_indices:
+            photo_col = column_indices['Photo']
+            photo_cells = {row: media for (row, col), media in source.images.index().items() if col == photo_col}
+
+        # Process data rows (starting from row 2)
+        for row_num, values in enumerate(rows, start=2):
+            # Skip empty rows
+            if not values or not values[0]:
+                continue
+            total_records += 1
+            report(writer.written)
+            try:
+                staff = parse_row(values, column_indices)
+            except Exception as e:
+                row_errors.append({'row': row_num, 'error': str(e)})
+                continue
+
+            if planner is not None:
+                # None for conflicts, which are passed through unwritten
+                doc_id = planner.doc_id(row_num, staff)
+            else:
+                # Rows without Email or Emp No get an auto-ID now, so their
+                # photo has a path of its own
+                doc_id = staff_doc_id(staff) or db.collection('staff').document().id
+            media = photo_cells.get(row_num) if doc_id is not None else None
+            awaiting_lookup.append((row_num, staff, doc_id, media))
+            if len(awaiting_lookup) >= LOOKUP_SIZE:
+                lookup_rows()
+        lookup_rows()
+        drain_photos(keep=0)
+    except BaseException:
+        for _, _, _, future, _ in awaiting_photo:
+            if future is not None:
+                future.cancel()
+        writer.discard()
+        raise
+    finally:
+        try:
+            photos.close()
+            writer.close()
+        finally:
+            source.close()
+
+    # Keep the allocator ahead of serial numbers taken from the sheet
+    if max_sl_no is not None and writer.written:
+        sl_allocator.observe(max_sl_no)
+    report(writer.written)
+
+    result = {
+        'success': True,
+        'message': f'Successfully uploaded {writer.written} staff records!',
+        'totalRecords': total_records,
+        'processedRecords': processed_records,
+        'uploadedRecords': writer.written,
+        'errors': sorted(row_errors + writer.errors, key=lambda e: e['row']),
+        'chunks': writer.chunks,
+        'photos': {'uploaded': photos.uploaded, 'unchanged': photos.unchanged,
+                   'failed': photos.failed, 'rejected': photos.rejected},
+    }
+    if planner is not None:
+        counts = planner.counts
+        summary = (f'{counts["creates"]} new, {counts["updates"]} changed, '
+                   f'{counts["unchanged"]} unchanged, {counts["conflicts"]} conflicts')
+        result.update(mode='diff', dryRun=dry_run, diff=planner.report())
+        if dry_run:
+            result['message'] = f'Dry run: {summary}'
+            result['fingerprints'] = planner.fingerprints
+            result['photos']['inFile'] = len(photo_cells)
+        else:
+            result['message'] = f'Saved {writer.written} staff records ({summary})'
+    return result
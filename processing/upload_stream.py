@@ -0,0 +1,230 @@
+# processing/upload_stream.py
+# Streaming storage path for /api/upload_file.
+#
+# The multipart body is parsed incrementally from the WSGI input stream and
+# each chunk goes through a hashing / size-limiting sink straight into a
+# chunked resumable upload to Cloud Storage, optionally teeing into a local
+# temp file for processors that need a path. Files are stored under their
+# SHA-256, so uploading identical content again reuses the existing object.
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, Epilogue, NeedData
+
+from firebase_config import bucket
+
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(200 * 1024 * 1024)))
+# Size of each resumable upload request; GCS needs a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+READ_SIZE = 64 * 1024
+UPLOAD_PREFIX = 'uploads'
+INCOMING_PREFIX = f'{UPLOAD_PREFIX}/_incoming/'
+# Staging objects whose cleanup failed are swept once older than this; a
+# bucket lifecycle rule (delete, age 1, matchesPrefix uploads/_incoming/)
+# does the same without the sweep
+INCOMING_MAX_AGE = int(os.environ.get('UPLOAD_INCOMING_MAX_AGE', str(24 * 3600)))
+INCOMING_SWEEP_INTERVAL = 3600
+SHA256_PATTERN = re.compile(r'[0-9a-fA-F]{64}')
+
+
+class UploadError(ValueError):
+    """The request doesn't contain a usable file upload."""
+    status = 400
+
+
+class UploadTooLarge(UploadError):
+    status = 413
+
+
+class UploadStorageError(UploadError):
+    """Cloud Storage failed while storing the upload."""
+    status = 502
+
+
+def content_path(sha256, filename):
+    ext = posixpath.splitext(filename)[1].lower()
+    return f'{UPLOAD_PREFIX}/{sha256}{ext}'
+
+
+def find_upload(sha256, filename):
+    """The stored blob for this content hash, or None"""
+    if not SHA256_PATTERN.fullmatch(sha256 or ''):
+        raise UploadError('X-Content-SHA256 must be 64 hex characters')
+    return bucket.get_blob(content_path(sha256.lower(), filename))
+
+
+class HashingSink:
+    """Hashes and counts everything written, enforces the size limit and tees to `sinks`"""
+
+    def __init__(self, sinks, max_bytes=UPLOAD_MAX_BYTES):
+        self._sinks = sinks
+        self._sha256 = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f'File is larger than {self.max_bytes // (1024 * 1024)} MB')
+        self._sha256.update(data)
+        for sink in self._sinks:
+            sink.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+
+def _multipart_events(stream, boundary):
+    decoder = MultipartDecoder(boundary)
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError as e:
+            raise UploadError(f'Malformed upload: {e}')
+        if isinstance(event, NeedData):
+            chunk = stream.read(READ_SIZE)
+            decoder.receive_data(chunk if chunk else None)
+        elif isinstance(event, Epilogue):
+            return
+        else:
+            yield event
+
+
+def open_file_part(stream, content_type, field_name='file'):
+    """
+    Read a multipart/form-data stream up to the `field_name` file part.
+    Returns (filename, mimetype, chunks) where chunks lazily yields the
+    file contents; nothing after the part headers has been read yet.
+    """
+    mimetype, options = parse_options_header(content_type or '')
+    if mimetype != 'multipart/form-data' or not options.get('boundary'):
+        raise UploadError('No file uploaded')
+    events = _multipart_events(stream, options['boundary'].encode('latin-1'))
+    for event in events:
+        if isinstance(event, File) and event.name == field_name:
+            def chunks():
+                for part in events:
+                    if isinstance(part, Data):
+                        if part.data:
+                            yield part.data
+                        if not part.more_data:
+                            return
+            return event.filename, event.headers.get('Content-Type'), chunks()
+    raise UploadError('No file uploaded')
+
+
+_last_sweep = 0.0
+_sweep_lock = threading.Lock()
+
+
+def sweep_incoming(max_age=INCOMING_MAX_AGE):
+    """Delete staging objects left under _incoming/; returns how many were removed"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    removed = 0
+    for blob in bucket.list_blobs(prefix=INCOMING_PREFIX):
+        if blob.time_created is not None and blob.time_created < cutoff:
+            try:
+                blob.delete()
+                removed += 1
+            except Exception as e:
+                print(f'Could not delete stale upload {blob.name}: {e}')
+    return removed
+
+
+def _maybe_sweep_incoming():
+    """Start a background sweep at most once per INCOMING_SWEEP_INTERVAL per process"""
+    global _last_sweep
+    with _sweep_lock:
+        now = time.monotonic()
+        if _last_sweep and now - _last_sweep < INCOMING_SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+
+    def run():
+        try:
+            sweep_incoming()
+        except Exception as e:
+            print(f'Sweeping {INCOMING_PREFIX} failed: {e}')
+    threading.Thread(target=run, name='upload-sweep', daemon=True).start()
+
+
+def _discard_incoming(incoming):
+    # Best effort: the upload is stored (or failed) either way, and a left
+    # over staging object is removed by sweep_incoming later
+    try:
+        incoming.delete()
+    except Exception as e:
+        print(f'Could not delete staging object {incoming.name}: {e}')
+
+
+def store_upload(filename, mimetype, chunks, keep_local=False, local_dir=None, max_bytes=UPLOAD_MAX_BYTES):
+    """
+    Stream `chunks` to Cloud Storage and store them under their SHA-256.
+    Returns {'path', 'storage_url', 'sha256', 'size', 'deduplicated',
+    'local_path'}; local_path is a temp file the caller must remove, or
+    None unless keep_local is set.
+    """
+    _maybe_sweep_incoming()
+    try:
+        incoming = bucket.blob(f'{INCOMING_PREFIX}{uuid.uuid4().hex}')
+        incoming.metadata = {'originalFilename': filename}
+        writer = incoming.open('wb', chunk_size=UPLOAD_CHUNK_SIZE,
+                               content_type=mimetype or 'application/octet-stream')
+    except Exception as e:
+        raise UploadStorageError(f'Could not start the upload to storage: {e}') from e
+    local = None
+    if keep_local:
+        local = tempfile.NamedTemporaryFile(dir=local_dir, suffix=posixpath.splitext(filename)[1], delete=False)
+    sink = HashingSink([writer] + ([local] if local else []), max_bytes)
+    try:
+        try:
+            for chunk in chunks:
+                sink.write(chunk)
+            writer.close()
+            if local:
+                local.close()
+
+            # The staging object exists from here on
+            sha256 = sink.hexdigest()
+            try:
+                blob = bucket.get_blob(content_path(sha256, filename))
+                deduplicated = blob is not None
+                if not deduplicated:
+                    blob = bucket.copy_blob(incoming, bucket, content_path(sha256, filename))
+            finally:
+                _discard_incoming(incoming)
+        except UploadError:
+            raise
+        except Exception as e:
+            raise UploadStorageError(f'Could not store the upload: {e}') from e
+    except BaseException:
+        # The writer is left unclosed so no partial object is finalised;
+        # GCS expires the abandoned resumable session on its own
+        if local:
+            local.close()
+            os.remove(local.name)
+        raise
+
+    if not deduplicated:
+        # optionally set public or generate signed url — be cautious with privacy
+        try:
+            blob.make_public()
+        except Exception as e:
+            print(f'Could not make {blob.name} public: {e}')
+
+    return {
+        'path': blob.name,
+        'storage_url': blob.public_url,
+        'sha256': sha256,
+        'size': sink.size,
+        'deduplicated': deduplicated,
+        'local_path': local.name if local else None,
+    }
@@ -0,0 +1,116 @@
+# processing/xlsx_images.py
+# Reads pictures anchored on the active sheet of an .xlsx file straight from
+# the zip package. openpyxl's read-only mode does not load drawings, so the
+# streaming importer uses this to find photos without materialising the
+# whole workbook.
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+NS = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+    'xdr': 'http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing',
+    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+}
+R_EMBED = '{%s}embed' % NS['r']
+R_ID = '{%s}id' % NS['r']
+
+
+def _rels_path(part):
+    folder, name = posixpath.split(part)
+    return posixpath.join(folder, '_rels', name + '.rels')
+
+
+def _resolve(base_part, target):
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_part), target))
+
+
+class XlsxImages:
+    """
+    Pictures on the active worksheet of an .xlsx file.
+    Iterating yields (row, col, media_path) with 1-based rows and 0-based
+    columns, matching the row numbers and column indices used by the
+    importer. Use read(media_path) to get the image bytes.
+    """
+
+    def __init__(self, path):
+        self._zip = zipfile.ZipFile(path)
+        self._names = set(self._zip.namelist())
+        self.anchors = list(self._find_anchors())
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.anchors)
+
+    def __len__(self):
+        return len(self.anchors)
+
+    def index(self):
+        """{(row, col): media_path}, built in one pass; the first picture in a cell wins"""
+        cells = {}
+        for row, col, media_path in self.anchors:
+            cells.setdefault((row, col), media_path)
+        return cells
+
+    def read(self, media_path):
+        return self._zip.read(media_path)
+
+    def _xml(self, part):
+        return ET.fromstring(self._zip.read(part))
+
+    def _relationships(self, part):
+        rels_part = _rels_path(part)
+        if rels_part not in self._names:
+            return {}
+        return {
+            rel.get('Id'): (rel.get('Type', ''), _resolve(part, rel.get('Target', '')))
+            for rel in self._xml(rels_part).findall('rel:Relationship', NS)
+        }
+
+    def _active_sheet_part(self):
+        workbook_part = 'xl/workbook.xml'
+        workbook = self._xml(workbook_part)
+        active = 0
+        view = workbook.find('main:bookViews/main:workbookView', NS)
+        if view is not None:
+            active = int(view.get('activeTab', '0'))
+        sheets = workbook.findall('main:sheets/main:sheet', NS)
+        if not sheets:
+            return None
+        sheet = sheets[min(active, len(sheets) - 1)]
+        rel = self._relationships(workbook_part).get(sheet.get(R_ID))
+        return rel[1] if rel else None
+
+    def _find_anchors(self):
+        sheet_part = self._active_sheet_part()
+        if not sheet_part:
+            return
+        for rel_type, drawing_part in self._relationships(sheet_part).values():
+            if not rel_type.endswith('/drawing') or drawing_part not in self._names:
+                continue
+            media = self._relationships(drawing_part)
+            drawing = self._xml(drawing_part)
+            for tag in ('xdr:twoCellAnchor', 'xdr:oneCellAnchor'):
+                for anchor in drawing.findall(tag, NS):
+                    start = anchor.find('xdr:from', NS)
+                    blip = anchor.find('xdr:pic/xdr:blipFill/a:blip', NS)
+                    if start is None or blip is None:
+                        continue
+                    target = media.get(blip.get(R_EMBED))
+                    if not target:
+                        continue
+                    row = int(start.find('xdr:row', NS).text) + 1
+                    col = int(start.find('xdr:col', NS).text)
+                    yield row, col, target[1]
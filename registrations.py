@@ -0,0 +1,397 @@
+# registrations.py
+# Storage for pending staff registrations.
+#
+# Records are dicts keyed by the column names of the pending-registrations
+# sheet. REGISTRATION_BACKEND picks where they live:
+#   sheets (default)  the Google Sheet admins already use
+#   firestore         pending_registrations/{email-id} documents
+#   sqlite            local stand-in (REGISTRATION_SQLITE_PATH, default :memory:)
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+REGISTRATION_BACKEND = os.environ.get('REGISTRATION_BACKEND', 'sheets')
+REGISTRATION_SQLITE_PATH = os.environ.get('REGISTRATION_SQLITE_PATH', ':memory:')
+# How long the sheet's email/employee-ID index is trusted before re-reading
+REGISTRATION_INDEX_TTL = int(os.environ.get('REGISTRATION_INDEX_TTL', '60'))
+
+SHEET_COLUMNS = [
+    'Timestamp', 'Name', 'Employee ID', 'Email', 'Department', 'Designation',
+    'Mobile No', 'Type', 'Contract Type', 'Category', 'Gender', 'Blood Group',
+    'Permanent Address', 'Status'
+]
+
+PENDING = 'PENDING'
+
+
+def _key(value):
+    return str(value).strip() if value is not None else ''
+
+
+def _column_letter(index):
+    """0-based column index -> A1 column letters"""
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+class SheetsRegistrationRepository:
+    """
+    Pending registrations in a Google Sheet.
+
+    Keeps an in-memory index of email -> row and employee ID -> row built
+    from just those two columns. Lookups read a single row and check it
+    still holds the expected key; on a miss or a moved row the two key
+    columns are re-read and the lookup retried, so a lookup never costs a
+    full-sheet download. Appends and deletes made through this object
+    update the index in place.
+    """
+
+    def __init__(self, open_worksheet, index_ttl=REGISTRATION_INDEX_TTL):
+        self._open_worksheet = open_worksheet
+        self.index_ttl = index_ttl
+        self._lock = threading.RLock()
+        self._header = None
+        self._email_rows = {}
+        self._emp_rows = {}
+        self._indexed_at = None
+
+    # -- index -------------------------------------------------------------
+
+    def _columns(self, ws):
+        if self._header is None:
+            self._header = ws.row_values(1) or list(SHEET_COLUMNS)
+        return self._header
+
+    def _col(self, ws, name):
+        header = self._columns(ws)
+        return header.index(name) if name in header else SHEET_COLUMNS.index(name)
+
+    def _set_index(self, emails, emp_nos):
+        self._email_rows = {}
+        self._emp_rows = {}
+        for offset, value in enumerate(emails):
+            if value and _key(value[0]):
+                self._email_rows.setdefault(_key(value[0]), offset + 2)
+        for offset, value in enumerate(emp_nos):
+            if value and _key(value[0]):
+                self._emp_rows.setdefault(_key(value[0]), offset + 2)
+        self._indexed_at = time.monotonic()
+
+    def _refresh_index(self, ws):
+        email_col = _column_letter(self._col(ws, 'Email'))
+        emp_col = _column_letter(self._col(ws, 'Employee ID'))
+        emails, emp_nos = ws.batch_get([f'{email_col}2:{email_col}', f'{emp_col}2:{emp_col}'])
+        self._set_index(emails, emp_nos)
+
+    def _ensure_index(self, ws):
+        """Rebuild the index if it is stale; returns True if it was rebuilt"""
+        if self._indexed_at is None or time.monotonic() - self._indexed_at > self.index_ttl:
+            self._refresh_index(ws)
+            return True
+        return False
+
+    def _shift_after_delete(self, row):
+        for rows in (self._email_rows, self._emp_rows):
+            for key in [k for k, r in rows.items() if r == row]:
+                del rows[key]
+            for key, r in rows.items():
+                if r > row:
+                    rows[key] = r - 1
+
+    def _record(self, ws, values):
+        header = self._columns(ws)
+        values = list(values) + [''] * (len(header) - len(values))
+        return dict(zip(header, values))
+
+    def _locate(self, ws, column, value):
+        """(row, record) for the first row whose `column` equals value, or (None, None)"""
+        value = _key(value)
+        if not value:
+            return None, None
+        fresh = self._ensure_index(ws)
+        for attempt in range(2):
+            rows = self._email_rows if column == 'Email' else self._emp_rows
+            row = rows.get(value)
+            if row is not None:
+                record = self._record(ws, ws.row_values(row))
+                if _key(record.get(column)) == value:
+                    return row, record
+            if attempt == 0 and not fresh:
+                # Missing or moved: another worker may have appended or
+                # deleted rows, so re-read the key columns once
+                self._refresh_index(ws)
+            else:
+                break
+        return None, None
+
+    # -- repository API ----------------------------------------------------
+
+    def find_by_email(self, email):
+        with self._lock:
+            return self._locate(self._open_worksheet(), 'Email', email)[1]
+
+    def find_by_emp_no(self, emp_no):
+        with self._lock:
+            return self._locate(self._open_worksheet(), 'Employee ID', emp_no)[1]
+
+    def find_pending(self, email):
+        record = self.find_by_email(email)
+        return record if record is not None and record.get('Status') == PENDING else None
+
+    def add(self, record):
+        with self._lock:
+            ws = self._open_worksheet()
+            header = self._columns(ws)
+            response = ws.append_row([record.get(column, '') for column in header])
+            match = re.search(r'![A-Z]+(\d+)', (response or {}).get('updates', {}).get('updatedRange', ''))
+            if match and self._indexed_at is not None:
+                row = int(match.group(1))
+                if _key(record.get('Email')):
+                    self._email_rows.setdefault(_key(record.get('Email')), row)
+                if _key(record.get('Employee ID')):
+                    self._emp_rows.setdefault(_key(record.get('Employee ID')), row)
+
+    def _read_all(self, ws):
+        """All data rows as records (row 2 first); a full read is a free index refresh"""
+        values = ws.get_all_values()
+        if not values:
+            return []
+        self._header = values[0]
+        email_col = self._col(ws, 'Email')
+        emp_col = self._col(ws, 'Employee ID')
+        self._set_index(
+            [[row[email_col]] if email_col < len(row) else [] for row in values[1:]],
+            [[row[emp_col]] if emp_col < len(row) else [] for row in values[1:]],
+        )
+        return [self._record(ws, row) for row in values[1:]]
+
+    def list_pending(self):
+        with self._lock:
+            records = self._read_all(self._open_worksheet())
+            return [r for r in records if r.get('Status') == PENDING]
+
+    def find_pending_many(self, emails):
+        """{email: record} for the emails that have a pending row, from one sheet read"""
+        with self._lock:
+            records = self._read_all(self._open_worksheet())
+            found = {}
+            for email in emails:
+                row = self._email_rows.get(_key(email))
+                if row is not None and records[row - 2].get('Status') == PENDING:
+                    found[email] = records[row - 2]
+            return found
+
+    def remove_many(self, emails):
+        """
+        Delete the pending rows of several registrations in one batch_update.
+        The sheet is read first and a row is only deleted if it still holds
+        that email with status PENDING (like remove()); rows are deleted
+        bottom-up so earlier deletions don't shift later ones.
+        Returns the emails whose rows were deleted.
+        """
+        with self._lock:
+            ws = self._open_worksheet()
+            records = self._read_all(ws)
+            rows = {}
+            for email in emails:
+                row = self._email_rows.get(_key(email))
+                if row is None or not _key(email):
+                    continue
+                record = records[row - 2]
+                if _key(record.get('Email')) == _key(email) and record.get('Status') == PENDING:
+                    rows[row] = email
+            if not rows:
+                return []
+            ordered = sorted(rows, reverse=True)
+            ws.spreadsheet.batch_update({'requests': [
+                {'deleteDimension': {'range': {
+                    'sheetId': ws.id, 'dimension': 'ROWS', 'startIndex': row - 1, 'endIndex': row,
+                }}}
+                for row in ordered
+            ]})
+            for row in ordered:
+                self._shift_after_delete(row)
+            return [rows[row] for row in ordered]
+
+    def remove(self, email):
+        """Delete the pending row for email; returns False if there is none"""
+        with self._lock:
+            ws = self._open_worksheet()
+            row, record = self._locate(ws, 'Email', email)
+            if row is None or record.get('Status') != PENDING:
+                return False
+            ws.delete_rows(row)
+            self._shift_after_delete(row)
+            return True
+
+
+class FirestoreRegistrationRepository:
+    def __init__(self, collection):
+        self._collection = collection
+
+    @staticmethod
+    def _doc_id(email):
+        return _key(email).replace('@', '_at_').replace('.', '_dot_')
+
+    def find_by_email(self, email):
+        if not _key(email):
+            return None
+        doc = self._collection.document(self._doc_id(email)).get()
+        return doc.to_dict() if doc.exists else None
+
+    def find_by_emp_no(self, emp_no):
+        if not _key(emp_no):
+            return None
+        docs = self._collection.where('Employee ID', '==', _key(emp_no)).limit(1).get()
+        return docs[0].to_dict() if docs else None
+
+    def find_pending(self, email):
+        record = self.find_by_email(email)
+        return record if record is not None and record.get('Status') == PENDING else None
+
+    def add(self, record):
+        self._collection.document(self._doc_id(record.get('Email'))).set(dict(record))
+
+    def list_pending(self):
+        docs = self._collection.where('Status', '==', PENDING).stream()
+        return sorted((d.to_dict() for d in docs), key=lambda r: r.get('Timestamp', ''))
+
+    def find_pending_many(self, emails):
+        from firebase_config import db
+        refs = {self._doc_id(email): email for email in emails if _key(email)}
+        found = {}
+        for doc in db.get_all([self._collection.document(doc_id) for doc_id in refs]):
+            if doc.exists and doc.to_dict().get('Status') == PENDING:
+                found[refs[doc.id]] = doc.to_dict()
+        return found
+
+    def remove(self, email):
+        ref = self._collection.document(self._doc_id(email))
+        doc = ref.get()
+        if not doc.exists or doc.to_dict().get('Status') != PENDING:
+            return False
+        ref.delete()
+        return True
+
+    def remove_many(self, emails):
+        """
+        Delete the registrations that are still PENDING, 500 per transaction,
+        so one approved or rejected concurrently isn't deleted or reported
+        twice. Returns the emails whose documents were deleted.
+        """
+        from firebase_admin import firestore
+        from firebase_config import db
+
+        @firestore.transactional
+        def remove_pending(transaction, doc_ids):
+            removed = []
+            refs = [self._collection.document(doc_id) for doc_id in doc_ids]
+            for doc in db.get_all(refs, transaction=transaction):
+                if doc.exists and doc.to_dict().get('Status') == PENDING:
+                    transaction.delete(doc.reference)
+                    removed.append(doc_ids[doc.id])
+            return removed
+
+        doc_ids = {}
+        for email in emails:
+            if _key(email):
+                doc_ids.setdefault(self._doc_id(email), email)
+        pending = list(doc_ids)
+        removed = []
+        # Firestore transactions hold at most 500 writes
+        for i in range(0, len(pending), 500):
+            chunk = {doc_id: doc_ids[doc_id] for doc_id in pending[i:i + 500]}
+            removed.extend(remove_pending(db.transaction(), chunk))
+        return removed
+
+
+class SqliteRegistrationRepository:
+    """Local stand-in with the same behaviour, for tests and benchmarks"""
+
+    def __init__(self, path=REGISTRATION_SQLITE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS pending_registrations ('
+                ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' email TEXT, emp_no TEXT, status TEXT, record TEXT)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_pending_email ON pending_registrations (email)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_pending_emp_no ON pending_registrations (emp_no)')
+
+    def _one(self, column, value):
+        if not _key(value):
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT record FROM pending_registrations WHERE {column} = ? ORDER BY seq LIMIT 1',
+                (_key(value),)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_by_email(self, email):
+        return self._one('email', email)
+
+    def find_by_emp_no(self, emp_no):
+        return self._one('emp_no', emp_no)
+
+    def find_pending(self, email):
+        record = self.find_by_email(email)
+        return record if record is not None and record.get('Status') == PENDING else None
+
+    def add(self, record):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO pending_registrations (email, emp_no, status, record) VALUES (?, ?, ?, ?)',
+                (_key(record.get('Email')), _key(record.get('Employee ID')), record.get('Status'), json.dumps(record))
+            )
+
+    def list_pending(self):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT record FROM pending_registrations WHERE status = ? ORDER BY seq', (PENDING,)
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def find_pending_many(self, emails):
+        found = {}
+        for email in emails:
+            record = self.find_pending(email)
+            if record is not None:
+                found[email] = record
+        return found
+
+    def remove_many(self, emails):
+        return [email for email in emails if self.remove(email)]
+
+    def remove(self, email):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'DELETE FROM pending_registrations WHERE seq = ('
+                ' SELECT seq FROM pending_registrations WHERE email = ? AND status = ? ORDER BY seq LIMIT 1)',
+                (_key(email), PENDING)
+            )
+            return cursor.rowcount > 0
+
+
+def create_registration_repository(open_worksheet=None, backend=REGISTRATION_BACKEND):
+    """
+    Repository for the configured backend, or None when the sheets backend
+    is selected but no worksheet opener is available.
+    """
+    if backend == 'firestore':
+        from firebase_config import lazy_collection
+        return FirestoreRegistrationRepository(lazy_collection('pending_registrations'))
+    if backend == 'sqlite':
+        return SqliteRegistrationRepository()
+    if open_worksheet is None:
+        return None
+    return SheetsRegistrationRepository(open_worksheet)
@@ -0,0 +1,120 @@
+# serial_numbers.py
+# Allocation of staff serial numbers (`slNo`) from a counter document.
+#
+# counters/staff_sl_no holds `next`, the lowest number not yet handed out.
+# Numbers are taken from it inside a Firestore transaction, so concurrent
+# gunicorn workers never see the same value. A worker may reserve a block
+# of numbers at once and hand them out locally; unused numbers in a block
+# are lost when the worker exits, which leaves gaps but never duplicates.
+import os
+import sys
+import threading
+
+from firebase_admin import firestore
+from firebase_config import db, lazy_collection, lazy_document
+
+SL_NO_BLOCK_SIZE = int(os.environ.get('SL_NO_BLOCK_SIZE', '1'))
+
+
+def _as_int(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+
+@firestore.transactional
+def _take(transaction, counter_ref, count, floor):
+    snapshot = counter_ref.get(transaction=transaction)
+    current = (snapshot.to_dict() or {}).get('next', 1) if snapshot.exists else 1
+    start = max(current, floor)
+    transaction.set(counter_ref, {
+        'next': start + count,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    })
+    return start
+
+
+@firestore.transactional
+def _raise_to(transaction, counter_ref, value):
+    snapshot = counter_ref.get(transaction=transaction)
+    current = (snapshot.to_dict() or {}).get('next', 1) if snapshot.exists else 1
+    if value >= current:
+        transaction.set(counter_ref, {
+            'next': value + 1,
+            'updatedAt': firestore.SERVER_TIMESTAMP,
+        })
+
+
+class SerialNumberAllocator:
+    def __init__(self, counter_ref, staff_collection, block_size=SL_NO_BLOCK_SIZE):
+        self._counter_ref = counter_ref
+        self._staff_collection = staff_collection
+        self.block_size = max(1, block_size)
+        self._lock = threading.Lock()
+        self._block = []
+        self._seeded = False
+
+    def _seed_floor(self):
+        """Lowest allowed start when the counter has never been written"""
+        if self._seeded or self._counter_ref.get().exists:
+            return 1
+        return self.current_max() + 1
+
+    def current_max(self):
+        """Highest numeric slNo in the staff collection (full scan)"""
+        max_sl = 0
+        for doc in self._staff_collection.select(['slNo']).stream():
+            sl_no = _as_int((doc.to_dict() or {}).get('slNo'))
+            if sl_no is not None:
+                max_sl = max(max_sl, sl_no)
+        return max_sl
+
+    def reserve(self, count):
+        """Reserve `count` consecutive numbers directly from the counter"""
+        if count < 1:
+            return []
+        start = _take(db.transaction(), self._counter_ref, count, self._seed_floor())
+        self._seeded = True
+        return list(range(start, start + count))
+
+    def allocate(self):
+        """Next serial number, refilling this worker's block when it runs out"""
+        with self._lock:
+            if not self._block:
+                self._block = self.reserve(self.block_size)
+            return self._block.pop(0)
+
+    def observe(self, value):
+        """
+        Make sure `value` is never handed out again.
+        Called for numbers that were written without the allocator, such as
+        the Sl No column of an Excel upload.
+        """
+        value = _as_int(value)
+        if value is None:
+            return
+        _raise_to(db.transaction(), self._counter_ref, value)
+        with self._lock:
+            self._block = [n for n in self._block if n > value]
+
+    def backfill(self):
+        """Seed the counter from the current maximum slNo; returns the new `next`"""
+        next_value = self.current_max() + 1
+        _raise_to(db.transaction(), self._counter_ref, next_value - 1)
+        return next_value
+
+
+sl_allocator = SerialNumberAllocator(
+    lazy_document('counters', 'staff_sl_no'),
+    lazy_collection('staff'),
+)
+
+
+if __name__ == '__main__':
+    # One-time backfill: python serial_numbers.py backfill
+    if sys.argv[1:] == ['backfill']:
+        print(f"Serial number counter seeded; next slNo is {sl_allocator.backfill()}")
+    else:
+        print('usage: python serial_numbers.py backfill')
@@ -0,0 +1,220 @@
+# sheets_gateway.py
+# Per-worker access to the pending-registrations Google Sheet.
+#
+# The gspread client and the opened worksheet are created on first use and
+# reused, instead of an open_by_key() metadata round-trip per request. Every
+# Sheets call goes through a client-side rate limiter holding this worker's
+# share of the per-minute quota and is retried with exponential backoff and
+# jitter on 429 and 5xx responses. Call counts and latency are kept for
+# /api/sheets/stats and /metrics.
+import json
+import os
+import random
+import threading
+import time
+
+from metrics import observe_backend
+
+GOOGLE_SHEETS_SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+LOCAL_CREDENTIALS_FILE = 'test123456.json'
+
+# Project-wide quota; each of the SHEETS_QUOTA_SHARES worker processes gets an
+# equal part (gunicorn's post_fork sets the share from the worker count)
+SHEETS_QUOTA_PER_MINUTE = int(os.environ.get('SHEETS_QUOTA_PER_MINUTE', '60'))
+SHEETS_QUOTA_SHARES = int(os.environ.get('SHEETS_QUOTA_SHARES', os.environ.get('WEB_CONCURRENCY', '1')))
+# Calls a worker may make back to back before the refill rate applies
+SHEETS_BURST = int(os.environ.get('SHEETS_BURST', '3'))
+SHEETS_MAX_RETRIES = int(os.environ.get('SHEETS_MAX_RETRIES', '5'))
+SHEETS_BACKOFF_BASE = 1.0
+SHEETS_BACKOFF_CAP = 32.0
+# Re-open the worksheet after this long so sheet renames/resizes are picked up
+SHEETS_HANDLE_TTL = 3600
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class SheetsUnavailableError(Exception):
+    """Sheets kept failing (usually quota) after all retries."""
+
+    def __init__(self, message, retry_after=60):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token bucket refilled at `per_minute` tokens per minute that holds at
+    most `burst` tokens, and starts with them, so a fresh worker can't spend
+    a whole minute's quota at once.
+    """
+
+    def __init__(self, per_minute, burst=SHEETS_BURST):
+        self.per_minute = max(1.0, per_minute)
+        self.capacity = max(1, min(burst, int(self.per_minute)))
+        self._tokens = float(self.capacity)
+        self._rate = self.per_minute / 60.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available; returns seconds waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self._rate
+            time.sleep(delay)
+            waited += delay
+
+
+def _status_of(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+class _Proxy:
+    """Wraps a gspread object so every method call goes through the gateway"""
+
+    def __init__(self, gateway, target):
+        self._gateway = gateway
+        self._target = target
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name == 'spreadsheet':
+            return _Proxy(self._gateway, value)
+        if callable(value):
+            def call(*args, **kwargs):
+                return self._gateway.call(name, value, *args, **kwargs)
+            return call
+        return value
+
+
+class SheetsGateway:
+    def __init__(self, sheet_id, quota_per_minute=SHEETS_QUOTA_PER_MINUTE, max_retries=SHEETS_MAX_RETRIES,
+                 shares=SHEETS_QUOTA_SHARES):
+        self.sheet_id = sheet_id
+        self.max_retries = max_retries
+        self.quota_per_minute = quota_per_minute
+        self._limiter = RateLimiter(quota_per_minute / max(1, shares))
+        self._lock = threading.Lock()
+        self._client = None
+        self._worksheet = None
+        self._opened_at = 0.0
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._injected = False
+
+    # -- configuration -----------------------------------------------------
+
+    def share_quota(self, shares):
+        """Limit this process to 1/shares of the quota, e.g. one of `shares` gunicorn workers"""
+        self._limiter = RateLimiter(self.quota_per_minute / max(1, shares))
+
+    def is_configured(self):
+        if self._injected:
+            return True
+        return bool(self.sheet_id) and (
+            bool(os.environ.get('GOOGLE_SHEETS_CREDENTIALS')) or os.path.exists(LOCAL_CREDENTIALS_FILE)
+        )
+
+    def _authorize(self):
+        import gspread
+        from google.oauth2.service_account import Credentials
+
+        # For Render deployment, use environment variable
+        creds_json = os.environ.get('GOOGLE_SHEETS_CREDENTIALS')
+        if creds_json:
+            creds = Credentials.from_service_account_info(json.loads(creds_json), scopes=GOOGLE_SHEETS_SCOPES)
+        else:
+            # For local development, use file
+            creds = Credentials.from_service_account_file(LOCAL_CREDENTIALS_FILE, scopes=GOOGLE_SHEETS_SCOPES)
+        return gspread.authorize(creds)
+
+    def use_client(self, client):
+        """Use an already authorized client (e.g. a fake for benchmarks)"""
+        with self._lock:
+            self._client = client
+            self._worksheet = None
+            self._injected = True
+
+    def _reset(self):
+        with self._lock:
+            if not self._injected:
+                self._client = None
+            self._worksheet = None
+
+    # -- calls -------------------------------------------------------------
+
+    def _record(self, op, elapsed, ok, retries, throttled):
+        observe_backend('sheets', op, elapsed, ok)
+        with self._stats_lock:
+            stats = self._stats.setdefault(op, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'throttled_seconds': 0.0,
+                'total_seconds': 0.0, 'max_seconds': 0.0,
+            })
+            stats['calls'] += 1
+            stats['errors'] += 0 if ok else 1
+            stats['retries'] += retries
+            stats['throttled_seconds'] += throttled
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+
+    def call(self, op, fn, *args, **kwargs):
+        """Run one Sheets API call with rate limiting, retries and metrics"""
+        retries = 0
+        throttled = 0.0
+        start = time.monotonic()
+        while True:
+            throttled += self._limiter.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                status = _status_of(e)
+                if status == 401 and retries == 0:
+                    # Expired or revoked credentials: authorize again on next use
+                    self._reset()
+                elif status not in RETRYABLE_STATUSES or retries >= self.max_retries:
+                    self._record(op, time.monotonic() - start, False, retries, throttled)
+                    if status in RETRYABLE_STATUSES:
+                        raise SheetsUnavailableError(f'Google Sheets is busy ({status}), please retry shortly') from e
+                    raise
+                delay = min(SHEETS_BACKOFF_CAP, SHEETS_BACKOFF_BASE * 2 ** retries)
+                time.sleep(random.uniform(0, delay))
+                retries += 1
+                continue
+            self._record(op, time.monotonic() - start, True, retries, throttled)
+            return result
+
+    def worksheet(self):
+        """The first worksheet of the pending sheet, opened once per worker"""
+        with self._lock:
+            if self._worksheet is not None and time.monotonic() - self._opened_at < SHEETS_HANDLE_TTL:
+                return self._worksheet
+            if self._client is None:
+                self._client = self._authorize()
+            client = self._client
+        spreadsheet = self.call('open_by_key', client.open_by_key, self.sheet_id)
+        worksheet = _Proxy(self, spreadsheet.sheet1)
+        with self._lock:
+            self._worksheet = worksheet
+            self._opened_at = time.monotonic()
+        return worksheet
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                op: dict(s, avg_seconds=round(s['total_seconds'] / s['calls'], 4) if s['calls'] else None)
+                for op, s in self._stats.items()
+            }
+
+
+sheets_gateway = SheetsGateway(os.environ.get('PENDING_SHEET_ID'))
@@ -0,0 +1,266 @@
+# staff_cache.py
+# Per-worker in-memory copy of the `staff` collection.
+#
+# The cache is warmed lazily on first use (so nothing is opened before
+# gunicorn forks), kept coherent by a Firestore on_snapshot listener, and
+# updated write-through by the mutation endpoints so a worker sees its own
+# writes before the listener echoes them back.
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from firebase_config import lazy_collection
+from staff_query import apply_staff_query, run_staff_query
+
+STAFF_CACHE_TTL = int(os.environ.get('STAFF_CACHE_TTL', '300'))
+STAFF_CACHE_MAX_SIZE = int(os.environ.get('STAFF_CACHE_MAX_SIZE', '20000'))
+STAFF_CACHE_WARM_TIMEOUT = 10
+
+
+def _resolve_sentinels(data):
+    """Replace SERVER_TIMESTAMP sentinels with a local approximation"""
+    now = datetime.now(timezone.utc)
+    return {k: (now if v is firestore.SERVER_TIMESTAMP else v) for k, v in data.items()}
+
+
+class StaffCache:
+    """
+    Serves staff reads from memory.
+
+    Freshness: while the snapshot listener is active the copy is live; if
+    the listener cannot be started or dies, the copy is reloaded from
+    Firestore once it is older than `ttl` seconds. If the collection grows
+    past `max_size` documents the cache switches itself off and every read
+    goes to Firestore.
+    """
+
+    def __init__(self, collection, ttl=STAFF_CACHE_TTL, max_size=STAFF_CACHE_MAX_SIZE):
+        self._collection = collection
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._docs = {}
+        self._loaded_at = None
+        self._watch = None
+        self._first_snapshot = threading.Event()
+        self._disabled = False
+        self._memo = {}
+        # Bumped on every change to the in-memory copy
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    # -- loading -----------------------------------------------------------
+
+    def _listening(self):
+        return self._watch is not None and self._watch.is_active
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        with self._lock:
+            if not self._first_snapshot.is_set():
+                self._docs = {d.id: d.to_dict() for d in col_snapshot}
+            else:
+                for change in changes:
+                    if change.type.name == 'REMOVED':
+                        self._docs.pop(change.document.id, None)
+                    else:
+                        self._docs[change.document.id] = change.document.to_dict()
+            self.version += 1
+            self._loaded_at = time.monotonic()
+            self._check_size()
+        self._first_snapshot.set()
+
+    def _start_listener(self):
+        self._first_snapshot.clear()
+        try:
+            self._watch = self._collection.on_snapshot(self._on_snapshot)
+        except Exception as e:
+            print(f"Staff cache listener failed to start: {e}")
+            self._watch = None
+            return False
+        return self._first_snapshot.wait(STAFF_CACHE_WARM_TIMEOUT)
+
+    def _stop_listener(self):
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                pass
+            self._watch = None
+
+    def _reload(self):
+        docs = {d.id: d.to_dict() for d in self._collection.stream()}
+        with self._lock:
+            self._docs = docs
+            self.version += 1
+            self._loaded_at = time.monotonic()
+            self._check_size()
+
+    def _check_size(self):
+        if len(self._docs) > self.max_size:
+            print(f"Staff cache disabled: {len(self._docs)} docs exceeds {self.max_size}")
+            self._disabled = True
+            self._docs = {}
+            self._loaded_at = None
+            # Unsubscribing from inside the listener callback would deadlock
+            threading.Thread(target=self._stop_listener, daemon=True).start()
+
+    def _is_fresh(self):
+        with self._lock:
+            if self._loaded_at is None:
+                return False
+            return self._listening() or time.monotonic() - self._loaded_at < self.ttl
+
+    def is_warm(self):
+        """True if reads are served from memory without loading the collection first"""
+        return not self._disabled and self._is_fresh()
+
+    def _ensure_fresh(self):
+        """Make the in-memory copy usable; returns False if reads must bypass it"""
+        if self._disabled:
+            self._record(False)
+            return False
+        if self._is_fresh():
+            self._record(True)
+            return True
+
+        self._record(False)
+        # The listener callback takes self._lock, so loading must not hold it
+        with self._load_lock:
+            if self._disabled:
+                return False
+            if self._is_fresh():
+                return True
+            with self._lock:
+                self.reloads += 1
+            self._stop_listener()
+            if not self._start_listener():
+                self._stop_listener()
+                self._reload()
+            return not self._disabled
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # -- reads -------------------------------------------------------------
+
+    def all(self):
+        """All staff dicts, each with its document ID under 'id'"""
+        fresh = self._ensure_fresh()
+        if fresh:
+            with self._lock:
+                return [dict(data, id=doc_id) for doc_id, data in self._docs.items()]
+        return [dict(d.to_dict(), id=d.id) for d in self._collection.stream()]
+
+    def query(self, spec):
+        """Run a staff_query spec; returns (staff_list, next_cursor)"""
+        if self._ensure_fresh():
+            with self._lock:
+                rows = [dict(data, id=doc_id) for doc_id, data in self._docs.items()]
+            return apply_staff_query(rows, spec)
+        return run_staff_query(self._collection, spec)
+
+    def get(self, doc_id):
+        """A single staff dict with 'id', or None if it doesn't exist"""
+        fresh = self._ensure_fresh()
+        if fresh:
+            with self._lock:
+                data = self._docs.get(doc_id)
+                return dict(data, id=doc_id) if data is not None else None
+        doc = self._collection.document(doc_id).get()
+        return dict(doc.to_dict(), id=doc.id) if doc.exists else None
+
+    def find_by_email(self, email):
+        fresh = self._ensure_fresh()
+        if fresh:
+            with self._lock:
+                for doc_id, data in self._docs.items():
+                    if data.get('email') == email:
+                        return dict(data, id=doc_id)
+                return None
+        docs = self._collection.where('email', '==', email).limit(1).get()
+        return dict(docs[0].to_dict(), id=docs[0].id) if docs else None
+
+    def snapshot(self):
+        """
+        (version, {doc_id: data}) for consumers that keep derived state.
+        Changed documents are always replaced by a new dict, so comparing
+        entries by identity finds what changed since an earlier snapshot.
+        Returns None when the cache is switched off. Treat the dicts as
+        read-only.
+        """
+        if not self._ensure_fresh():
+            return None
+        with self._lock:
+            return self.version, dict(self._docs)
+
+    def memoize(self, key, compute):
+        """
+        compute(staff_list) evaluated once per version of the collection.
+        Returns None when the cache is switched off, so the caller can fall
+        back to its own Firestore query.
+        """
+        if not self._ensure_fresh():
+            return None
+        with self._lock:
+            cached = self._memo.get(key)
+            if cached is not None and cached[0] == self.version:
+                return cached[1]
+            version = self.version
+            rows = [dict(data, id=doc_id) for doc_id, data in self._docs.items()]
+        value = compute(rows)
+        with self._lock:
+            self._memo[key] = (version, value)
+        return value
+
+    # -- write-through -----------------------------------------------------
+
+    def put(self, doc_id, data):
+        """Record a full document write (set)"""
+        with self._lock:
+            if self._loaded_at is not None:
+                self._docs[doc_id] = _resolve_sentinels(data)
+                self.version += 1
+
+    def merge(self, doc_id, fields):
+        """Record a partial document write (update)"""
+        with self._lock:
+            if self._loaded_at is not None and doc_id in self._docs:
+                self._docs[doc_id] = dict(self._docs[doc_id], **_resolve_sentinels(fields))
+                self.version += 1
+
+    def remove(self, doc_id):
+        with self._lock:
+            if self._docs.pop(doc_id, None) is not None:
+                self.version += 1
+
+    def invalidate(self):
+        """Force a reload from Firestore on the next read"""
+        self._stop_listener()
+        with self._lock:
+            self._loaded_at = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': not self._disabled,
+                'listening': self._listening(),
+                'size': len(self._docs),
+                'age_seconds': None if self._loaded_at is None else round(time.monotonic() - self._loaded_at, 1),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'reloads': self.reloads,
+            }
+
+
+staff_cache = StaffCache(lazy_collection('staff'))
@@ -0,0 +1,139 @@
+# staff_query.py
+# Parsing and execution of the filter / projection / pagination options
+# accepted by the staff list endpoints.
+import base64
+import binascii
+
+# Fields written by add_staff_manual, approve_registration and upload_excel
+STAFF_FIELDS = (
+    'slNo', 'empNo', 'name', 'type', 'contractType', 'department', 'category',
+    'gender', 'designation', 'mobileNo', 'bloodGroup', 'permanentAddress',
+    'email', 'photoUrl', 'photoThumb64Url', 'photoThumb256Url', 'photoSourceHash', 'timestamp', 'updatedAt',
+)
+
+# Query parameters that map to an equality filter on the same staff field
+FILTER_FIELDS = ('department', 'type', 'designation', 'bloodGroup', 'gender')
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class StaffQueryError(ValueError):
+    """Raised when the query string of a staff list request is invalid."""
+
+
+def encode_cursor(doc_id):
+    return base64.urlsafe_b64encode(doc_id.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+    except (binascii.Error, UnicodeError, ValueError):
+        raise StaffQueryError('Invalid cursor')
+
+
+def _split_fields(raw):
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in STAFF_FIELDS]
+    if unknown:
+        raise StaffQueryError(f'Unknown fields: {", ".join(unknown)}')
+    return fields
+
+
+def parse_staff_query(args):
+    """
+    Build a query spec from request args.
+    Supported args: limit, cursor, fields, exclude and the FILTER_FIELDS.
+    Without limit/cursor the whole (filtered) collection is returned, which
+    keeps the old /api/staffs behaviour for existing clients.
+    """
+    spec = {'filters': {}, 'fields': None, 'limit': None, 'cursor': None}
+
+    for field in FILTER_FIELDS:
+        value = args.get(field)
+        if value:
+            spec['filters'][field] = value.strip()
+
+    if args.get('fields'):
+        spec['fields'] = _split_fields(args.get('fields'))
+    if args.get('exclude'):
+        excluded = set(_split_fields(args.get('exclude')))
+        base = spec['fields'] if spec['fields'] is not None else STAFF_FIELDS
+        spec['fields'] = [f for f in base if f not in excluded]
+    if spec['fields'] is not None and not spec['fields']:
+        raise StaffQueryError('No fields left to return')
+
+    limit = args.get('limit')
+    cursor = args.get('cursor')
+    if limit is not None or cursor:
+        try:
+            limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+        except ValueError:
+            raise StaffQueryError('limit must be an integer')
+        if limit < 1:
+            raise StaffQueryError('limit must be positive')
+        spec['limit'] = min(limit, MAX_PAGE_SIZE)
+    if cursor:
+        spec['cursor'] = decode_cursor(cursor)
+
+    return spec
+
+
+def _paginate(staff_list, spec):
+    next_cursor = None
+    if spec['limit'] and len(staff_list) > spec['limit']:
+        staff_list = staff_list[:spec['limit']]
+        next_cursor = encode_cursor(staff_list[-1]['id'])
+    return staff_list, next_cursor
+
+
+def run_staff_query(collection, spec):
+    """
+    Execute a query spec against the staff collection.
+    Results are ordered by document ID, which is unique and needs no
+    composite index alongside the equality filters.
+    Returns (staff_list, next_cursor); next_cursor is None on the last page.
+    """
+    query = collection
+    for field, value in spec['filters'].items():
+        query = query.where(field, '==', value)
+    if spec['fields'] is not None:
+        query = query.select(spec['fields'])
+    query = query.order_by('__name__')
+    if spec['cursor']:
+        query = query.start_after({'__name__': collection.document(spec['cursor'])})
+    if spec['limit']:
+        # One extra document tells us whether another page exists
+        query = query.limit(spec['limit'] + 1)
+
+    staff_list = []
+    for d in query.stream():
+        data = d.to_dict()
+        data['id'] = d.id
+        staff_list.append(data)
+    return _paginate(staff_list, spec)
+
+
+def apply_staff_query(staff_list, spec):
+    """
+    In-memory counterpart of run_staff_query for staff dicts carrying 'id'.
+    Produces the same ordering and cursors, so clients can't tell which
+    path served a page.
+    """
+    rows = [
+        s for s in staff_list
+        if all(s.get(field) == value for field, value in spec['filters'].items())
+    ]
+    rows.sort(key=lambda s: s['id'])
+    if spec['cursor']:
+        rows = [s for s in rows if s['id'] > spec['cursor']]
+    if spec['limit']:
+        rows = rows[:spec['limit'] + 1]
+    if spec['fields'] is not None:
+        rows = [
+            dict({f: s[f] for f in spec['fields'] if f in s}, id=s['id'])
+            for s in rows
+        ]
+    return _paginate(rows, spec)
@@ -0,0 +1,304 @@
+# staff_search.py
+# In-memory search index behind /api/staff/search.
+#
+# Indexes name, designation, department, empNo, email and mobileNo of every
+# staff document: an inverted index of lowercase tokens (with prefix lookups
+# over the sorted vocabulary), character trigrams of each token for typo
+# tolerance, and the trailing digits of phone numbers. The index follows
+# staff_cache: on each search it compares the cache snapshot with what it
+# has indexed and only re-indexes documents that changed.
+import bisect
+import heapq
+import re
+import threading
+import time
+
+from staff_cache import staff_cache
+
+# Field -> weight of a match in that field
+SEARCH_FIELDS = {
+    'name': 3.0,
+    'empNo': 3.0,
+    'email': 2.0,
+    'designation': 1.5,
+    'department': 1.0,
+    'mobileNo': 1.0,
+}
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_QUERY_LENGTH = 100
+# Shortest phone-number tail that is matched on its own
+PHONE_SUFFIX_MIN = 4
+# Shorter terms only match whole tokens, not every token they start
+PREFIX_MIN = 2
+# Minimum trigram similarity for a fuzzy token match
+FUZZY_THRESHOLD = 0.35
+# Score multipliers by kind of token match
+EXACT, PREFIX, FUZZY = 1.0, 0.7, 0.5
+SEARCH_FALLBACK_TTL = 60
+
+_TOKEN_RE = re.compile(r'[0-9a-z]+')
+
+
+class SearchQueryError(ValueError):
+    """Raised when the search query string is invalid."""
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text).lower()) if text else []
+
+
+def _trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _fuzzy_grams(token):
+    # Only words take part in typo matching; IDs, numbers and addresses
+    # would swamp the trigram lists without producing useful matches
+    return _trigrams(token) if len(token) >= 3 and token.isalpha() else ()
+
+
+def _digits(text):
+    return re.sub(r'\D', '', str(text)) if text else ''
+
+
+class StaffSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}        # token -> {doc_id: weight}
+        self._vocabulary = []      # sorted tokens, for prefix lookups
+        self._trigram_index = {}   # trigram -> set(tokens)
+        self._phone_suffixes = {}  # digits -> set(doc_ids)
+        self._doc_tokens = {}      # doc_id -> set(tokens)
+        self._doc_phones = {}      # doc_id -> set(suffixes)
+        self._docs = {}            # doc_id -> indexed dict (identity marks the version)
+        self._sort_names = {}      # doc_id -> lowercase name, the tie-breaker
+        self.version = None
+
+    # -- maintenance -------------------------------------------------------
+
+    def _add_token(self, token, doc_id, weight):
+        postings = self._postings.get(token)
+        if postings is None:
+            postings = self._postings[token] = {}
+            bisect.insort(self._vocabulary, token)
+            for gram in _fuzzy_grams(token):
+                self._trigram_index.setdefault(gram, set()).add(token)
+        postings[doc_id] = max(weight, postings.get(doc_id, 0))
+
+    def _drop_token(self, token, doc_id):
+        postings = self._postings.get(token)
+        if postings is None:
+            return
+        postings.pop(doc_id, None)
+        if not postings:
+            del self._postings[token]
+            del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+            for gram in _fuzzy_grams(token):
+                tokens = self._trigram_index.get(gram)
+                if tokens is not None:
+                    tokens.discard(token)
+                    if not tokens:
+                        del self._trigram_index[gram]
+
+    def _unindex(self, doc_id):
+        for token in self._doc_tokens.pop(doc_id, ()):
+            self._drop_token(token, doc_id)
+        for suffix in self._doc_phones.pop(doc_id, ()):
+            docs = self._phone_suffixes.get(suffix)
+            if docs is not None:
+                docs.discard(doc_id)
+                if not docs:
+                    del self._phone_suffixes[suffix]
+        self._docs.pop(doc_id, None)
+        self._sort_names.pop(doc_id, None)
+
+    def _index(self, doc_id, data):
+        self._unindex(doc_id)
+        tokens = set()
+        for field, weight in SEARCH_FIELDS.items():
+            value = data.get(field)
+            if field == 'email':
+                # Local part only; the shared domain would match everyone
+                value = str(value or '').split('@')[0]
+            for token in tokenize(value):
+                self._add_token(token, doc_id, weight)
+                tokens.add(token)
+        email = str(data.get('email') or '').lower().strip()
+        if email:
+            # The full address as one token, so pasting an email finds it
+            self._add_token(email, doc_id, SEARCH_FIELDS['email'])
+            tokens.add(email)
+        phone = _digits(data.get('mobileNo'))
+        suffixes = {phone[-n:] for n in range(PHONE_SUFFIX_MIN, len(phone) + 1)}
+        for suffix in suffixes:
+            self._phone_suffixes.setdefault(suffix, set()).add(doc_id)
+        self._doc_tokens[doc_id] = tokens
+        self._doc_phones[doc_id] = suffixes
+        self._docs[doc_id] = data
+        self._sort_names[doc_id] = str(data.get('name') or '').lower()
+
+    def sync(self, version, docs):
+        """Bring the index up to date with a staff_cache snapshot"""
+        with self._lock:
+            if version is not None and version == self.version:
+                return 0
+            changed = 0
+            for doc_id in [d for d in self._docs if d not in docs]:
+                self._unindex(doc_id)
+                changed += 1
+            for doc_id, data in docs.items():
+                if self._docs.get(doc_id) is not data:
+                    self._index(doc_id, data)
+                    changed += 1
+            self.version = version
+            return changed
+
+    # -- queries -----------------------------------------------------------
+
+    def _prefix_tokens(self, prefix):
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + '\uffff')
+        return self._vocabulary[start:end]
+
+    def _fuzzy_tokens(self, term):
+        grams = _trigrams(term)
+        overlap = {}
+        for gram in grams:
+            for token in self._trigram_index.get(gram, ()):
+                overlap[token] = overlap.get(token, 0) + 1
+        matches = []
+        for token, shared in overlap.items():
+            similarity = shared / (len(grams) + len(_trigrams(token)) - shared)
+            if similarity >= FUZZY_THRESHOLD:
+                matches.append((token, similarity))
+        return matches
+
+    def _term_scores(self, term):
+        """{doc_id: score} for one query term"""
+        scores = {}
+
+        def add(token, multiplier):
+            for doc_id, weight in self._postings.get(token, {}).items():
+                score = weight * multiplier
+                if score > scores.get(doc_id, 0):
+                    scores[doc_id] = score
+
+        add(term, EXACT)
+        if len(term) >= PREFIX_MIN:
+            for token in self._prefix_tokens(term):
+                if token != term:
+                    add(token, PREFIX)
+        if term.isdigit() and len(term) >= PHONE_SUFFIX_MIN:
+            for doc_id in self._phone_suffixes.get(term, ()):
+                scores[doc_id] = max(scores.get(doc_id, 0), SEARCH_FIELDS['mobileNo'] * EXACT)
+        if not scores and len(term) >= 3 and term.isalpha():
+            for token, similarity in self._fuzzy_tokens(term):
+                add(token, FUZZY * similarity)
+        return scores
+
+    def search(self, query, filters=None, top=None):
+        """
+        Rank documents for `query`: every term must match (exactly, as a
+        prefix, as a phone-number tail or, failing those, fuzzily).
+        `filters` are {field: value} equality filters as in staff_query.
+        Returns (total_matches, doc_ids best first), cut to `top` IDs.
+        """
+        terms = tokenize(query)
+        email = query.strip().lower()
+        if '@' in email:
+            terms = [email]
+        if not terms:
+            return 0, []
+        with self._lock:
+            totals = None
+            for term in dict.fromkeys(terms):
+                scores = self._term_scores(term)
+                if totals is None:
+                    totals = scores
+                else:
+                    totals = {d: s + scores[d] for d, s in totals.items() if d in scores}
+                if not totals:
+                    return 0, []
+            if filters:
+                docs = self._docs
+                totals = {
+                    d: s for d, s in totals.items()
+                    if all(docs[d].get(field) == value for field, value in filters.items())
+                }
+            names = self._sort_names
+            rank = lambda d: (-totals[d], names[d], d)
+            if top is not None and top < len(totals):
+                return len(totals), heapq.nsmallest(top, totals, key=rank)
+            return len(totals), sorted(totals, key=rank)
+
+    def get(self, doc_id):
+        with self._lock:
+            return self._docs.get(doc_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': len(self._docs),
+                'tokens': len(self._postings),
+                'trigrams': len(self._trigram_index),
+                'phone_suffixes': len(self._phone_suffixes),
+                'version': self.version,
+            }
+
+
+staff_search_index = StaffSearchIndex()
+_fallback_loaded_at = None
+
+
+def _refresh_index():
+    global _fallback_loaded_at
+    snapshot = staff_cache.snapshot()
+    if snapshot is not None:
+        staff_search_index.sync(*snapshot)
+        return
+    # Cache switched off: rebuild from Firestore at most once a minute
+    now = time.monotonic()
+    if _fallback_loaded_at is None or now - _fallback_loaded_at > SEARCH_FALLBACK_TTL:
+        docs = {s.pop('id'): s for s in staff_cache.all()}
+        staff_search_index.sync(None, docs)
+        _fallback_loaded_at = now
+
+
+def parse_search_args(args):
+    """(query, limit, offset) from request args"""
+    query = (args.get('q') or '').strip()
+    if not query:
+        raise SearchQueryError('q is required')
+    if len(query) > MAX_QUERY_LENGTH:
+        raise SearchQueryError(f'q must be at most {MAX_QUERY_LENGTH} characters')
+    try:
+        limit = int(args.get('limit', DEFAULT_SEARCH_LIMIT))
+        offset = int(args.get('offset', 0))
+    except ValueError:
+        raise SearchQueryError('limit and offset must be integers')
+    if limit < 1 or limit > MAX_SEARCH_LIMIT:
+        raise SearchQueryError(f'limit must be between 1 and {MAX_SEARCH_LIMIT}')
+    if offset < 0:
+        raise SearchQueryError('offset must not be negative')
+    return query, limit, offset
+
+
+def search_staff(query, limit=DEFAULT_SEARCH_LIMIT, offset=0, filters=None, fields=None):
+    """
+    Returns {'results', 'total', 'next_offset'}; results are staff dicts
+    with 'id' (projected to `fields` when given), best match first.
+    """
+    _refresh_index()
+    total, ranked = staff_search_index.search(query, filters, top=offset + limit)
+    page = ranked[offset:offset + limit]
+    results = []
+    for doc_id in page:
+        data = staff_search_index.get(doc_id) or {}
+        if fields is not None:
+            data = {f: data[f] for f in fields if f in data}
+        results.append(dict(data, id=doc_id))
+    next_offset = offset + limit if offset + limit < total else None
+    return {'results': results, 'total': total, 'next_offset': next_offset}
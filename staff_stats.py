@@ -0,0 +1,60 @@
+# staff_stats.py
+# Aggregate counts behind the public /api/stats endpoint.
+#
+# Normally computed from the per-worker staff cache and recomputed only when
+# the collection changes. When the cache is switched off the counts come from
+# a projected query (three small fields per doc) and are kept for
+# STATS_FALLBACK_TTL seconds, so anonymous traffic can't turn into one full
+# collection read per request.
+import os
+import threading
+import time
+
+from firebase_config import db
+from staff_cache import staff_cache
+
+STATS_FALLBACK_TTL = int(os.environ.get('STATS_FALLBACK_TTL', '60'))
+
+# Served as Cache-Control on /api/stats
+STATS_CACHE_CONTROL = 'public, max-age=60, stale-while-revalidate=300'
+
+_fallback_lock = threading.Lock()
+_fallback = {'stats': None, 'computed_at': 0.0}
+
+
+def _count(counter, key):
+    counter[key] = counter.get(key, 0) + 1
+
+
+def compute_staff_stats(staff_list):
+    departments = {}
+    types = {}
+    genders = {}
+    named_departments = set()
+    for staff in staff_list:
+        if staff.get('department'):
+            named_departments.add(staff['department'])
+        _count(departments, staff.get('department') or 'Other')
+        _count(types, staff.get('type') or 'Other')
+        _count(genders, staff.get('gender') or 'Other')
+
+    return {
+        'total_staff': len(staff_list),
+        'total_departments': len(named_departments),
+        'departments': dict(sorted(departments.items())),
+        'types': dict(sorted(types.items())),
+        'genders': dict(sorted(genders.items())),
+    }
+
+
+def get_staff_stats():
+    stats = staff_cache.memoize('stats', compute_staff_stats)
+    if stats is not None:
+        return stats
+
+    with _fallback_lock:
+        if _fallback['stats'] is None or time.monotonic() - _fallback['computed_at'] > STATS_FALLBACK_TTL:
+            docs = db.collection('staff').select(['department', 'type', 'gender']).stream()
+            _fallback['stats'] = compute_staff_stats([d.to_dict() for d in docs])
+            _fallback['computed_at'] = time.monotonic()
+        return _fallback['stats']
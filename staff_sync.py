@@ -0,0 +1,133 @@
+# staff_sync.py
+# Delta sync for /api/staffs/changes.
+#
+# A staff doc has changed since a point in time if its `updatedAt` (or, for
+# docs written before updatedAt was set everywhere, `timestamp`) is later.
+# A warm staff cache answers that from memory; otherwise Firestore is asked
+# for docs with a later updatedAt, a page at a time (every writer sets it).
+# Deletions leave a tombstone in `staff_tombstones/{doc_id}`. Sync tokens
+# are opaque to clients; they encode the time the previous sync was served,
+# minus a small overlap so writes still in flight at that moment are sent
+# again rather than missed (clients apply changes idempotently).
+import base64
+import binascii
+import os
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+from firebase_config import db
+from staff_cache import staff_cache
+
+TOMBSTONE_COLLECTION = 'staff_tombstones'
+# Tombstones carry expireAt so a Firestore TTL policy on that field can prune
+# them; tokens older than this get a full resync instead of a delta
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '30'))
+SYNC_OVERLAP = timedelta(seconds=60)
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '500'))
+TOKEN_VERSION = 'v1'
+
+
+class SyncTokenError(ValueError):
+    """Raised when a sync token can't be decoded."""
+
+
+def encode_sync_token(as_of):
+    raw = f'{TOKEN_VERSION}:{as_of.isoformat()}'
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_sync_token(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        version, _, value = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii').partition(':')
+        if version != TOKEN_VERSION:
+            raise ValueError(version)
+        as_of = datetime.fromisoformat(value)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise SyncTokenError('Invalid sync token')
+    return as_of if as_of.tzinfo else as_of.replace(tzinfo=timezone.utc)
+
+
+def changed_at(data):
+    """When the doc last changed, or None if it has no usable marker"""
+    markers = [v for v in (data.get('updatedAt'), data.get('timestamp')) if isinstance(v, datetime)]
+    return max(markers) if markers else None
+
+
+# -- tombstones ----------------------------------------------------------
+
+def _tombstone_fields():
+    return {
+        'deletedAt': firestore.SERVER_TIMESTAMP,
+        'expireAt': datetime.now(timezone.utc) + timedelta(days=TOMBSTONE_RETENTION_DAYS),
+    }
+
+
+def add_tombstone(batch, staff_id):
+    """Queue a tombstone for `staff_id` on a write batch (one extra write)"""
+    batch.set(db.collection(TOMBSTONE_COLLECTION).document(staff_id), _tombstone_fields())
+
+
+def _deleted_since(since):
+    query = db.collection(TOMBSTONE_COLLECTION).where('deletedAt', '>', since).select(['deletedAt'])
+    return {doc.id: doc.to_dict().get('deletedAt') for doc in query.stream()}
+
+
+# -- changes -------------------------------------------------------------
+
+def _query_changed(since, page_size=SYNC_PAGE_SIZE):
+    """Staff dicts with updatedAt after `since`, read from Firestore a page at a time"""
+    base = db.collection('staff').where('updatedAt', '>', since).order_by('updatedAt').limit(page_size)
+    changed = []
+    last = None
+    while True:
+        query = base.start_after(last) if last is not None else base
+        page = list(query.stream())
+        changed.extend(dict(d.to_dict(), id=d.id) for d in page)
+        if len(page) < page_size:
+            return changed
+        last = page[-1]
+
+
+def _changed_docs(since):
+    if since is None:
+        # A reset sends the whole roster, which is what the cache holds
+        return staff_cache.all()
+    if staff_cache.is_warm():
+        return [s for s in staff_cache.all() if (changed_at(s) or since) > since]
+    return _query_changed(since)
+
+
+def staff_changes(token=None, fields=None):
+    """
+    Everything that changed since `token`.
+    Returns {'changed': [staff dicts with 'id'], 'deleted': [ids],
+    'sync_token', 'reset'}. With no token, or one older than the
+    tombstone retention, 'reset' is true and 'changed' is the full roster:
+    the client should replace its copy instead of merging.
+    """
+    now = datetime.now(timezone.utc)
+    since = decode_sync_token(token) if token else None
+    if since is not None and now - since > timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        since = None
+
+    changed = _changed_docs(since)
+    deleted = set()
+    if since is not None:
+        live = {s['id']: changed_at(s) for s in changed}
+        for staff_id, deleted_at in _deleted_since(since).items():
+            # A doc re-created after its deletion is reported as changed only
+            if staff_id in live and (live[staff_id] is None or deleted_at is None or live[staff_id] >= deleted_at):
+                continue
+            deleted.add(staff_id)
+        changed = [s for s in changed if s['id'] not in deleted]
+
+    if fields is not None:
+        changed = [dict({f: s[f] for f in fields if f in s}, id=s['id']) for s in changed]
+
+    return {
+        'changed': changed,
+        'deleted': sorted(deleted),
+        'sync_token': encode_sync_token(now - SYNC_OVERLAP),
+        'reset': since is None,
+    }